@@ -0,0 +1,95 @@
+"""
+Compares the sync and async serving modes on the read endpoints.
+
+    python benchmarks/async_bench.py --characters 10000 --workers 4 --concurrency 256
+
+Both servers run under gunicorn with the same worker count on the same
+seeded database: sync workers on src/wsgi.py and uvicorn workers on
+src/asgi.py. Every GET scenario that the async app serves is replayed
+at the given concurrency against each of them, and the JSON report puts
+p50/p99 latency and throughput side by side with the async/sync ratio.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+from seed import SRC, scale_for, seed
+from bench import SCENARIOS, Context, git_commit, run_http, start_gunicorn
+
+ASYNC_SCENARIOS = ['users', 'users_page_500', 'user', 'characters', 'characters_page_500',
+                   'characters_ndjson_tail', 'characters_filtered', 'planets_sorted',
+                   'character', 'planets', 'planet', 'films', 'film', 'favorites']
+
+MODES = {
+    'sync': ('wsgi', 'sync'),
+    'async': ('asgi:app', 'uvicorn.workers.UvicornWorker'),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--characters', type=int, default=10000)
+    parser.add_argument('--database', default='sqlite:////tmp/bench.db')
+    parser.add_argument('--requests', type=int, default=1000, help='requests per scenario')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=256)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database
+    os.environ['CACHE_MAX_ENTRIES'] = '0'
+    os.environ['RATE_LIMIT'] = '0'
+    sys.path.insert(0, SRC)
+    from app import app
+
+    scale = scale_for(args.characters)
+    with app.app_context():
+        seed(scale)
+
+    scenarios = [scenario for scenario in SCENARIOS if scenario[0] in ASYNC_SCENARIOS]
+    runs = {}
+    for mode, (target, worker_class) in MODES.items():
+        server, port = start_gunicorn(args.database, args.workers, target, worker_class)
+        try:
+            # same request mix for both modes
+            ctx = Context(scale, random.Random(1))
+            runs[mode] = run_http(port, ctx, args.requests, args.concurrency, scenarios)
+        finally:
+            server.terminate()
+            server.wait()
+
+    results = {}
+    for name, *_ in scenarios:
+        sync, async_ = runs['sync'][name], runs['async'][name]
+        results[name] = {
+            'rule': sync['rule'],
+            'sync': sync,
+            'async': async_,
+            'rps_ratio': round(async_['rps'] / sync['rps'], 2) if sync['rps'] else None,
+            'p99_ratio': round(async_['p99_ms'] / sync['p99_ms'], 2) if sync['p99_ms'] else None,
+        }
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'database': args.database.split(':', 1)[0],
+        'workers': args.workers,
+        'concurrency': args.concurrency,
+        'scale': scale,
+        'scenarios': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
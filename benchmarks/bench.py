@@ -0,0 +1,301 @@
+"""
+Benchmarks every route of src/app.py against a seeded database.
+
+    python benchmarks/bench.py --characters 10000 --mode client
+    python benchmarks/bench.py --characters 100000 --mode gunicorn --workers 4 --concurrency 32
+
+`client` drives the Flask test client in-process and also counts the SQL
+statements each request issues. `gunicorn` starts a real server on the
+same database and drives it over HTTP from a thread pool. Both print a
+JSON report with p50/p95/p99 latency, throughput and queries per request
+for every scenario, tagged with the git commit so runs can be compared.
+The request mix is generated from a fixed seed.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from seed import SRC, scale_for, seed
+
+ROOT = os.path.dirname(SRC)
+
+
+class Context:
+    """Random ids within the seeded ranges plus the favorites created by
+    write scenarios, so the delete scenarios can remove them again."""
+
+    def __init__(self, scale, rng):
+        self.scale = scale
+        self.rng = rng
+        self.token = rng.randrange(16 ** 6)
+        self.serial = 0
+        self.created = {'fav_character': [], 'fav_planet': [], 'fav_film': []}
+
+    def id(self, kind):
+        return self.rng.randint(1, self.scale[kind + 's'])
+
+    def name(self, prefix):
+        self.serial += 1
+        return f'{prefix} {self.token:x}-{self.serial}'
+
+    def take(self, kind, fallback):
+        return self.created[kind].pop() if self.created[kind] else fallback
+
+
+def favorite_post(kind):
+    def build(ctx):
+        user, target = ctx.id('user'), ctx.id(kind)
+        ctx.created['fav_' + kind].append((user, target))
+        return f'/user/{user}/favorites/{kind}/{target}', None
+    return build
+
+
+def favorite_delete(kind):
+    def build(ctx):
+        user, target = ctx.take('fav_' + kind, (ctx.id('user'), ctx.id(kind)))
+        return f'/user/{user}/favorites/{kind}/{target}', None
+    return build
+
+
+# (scenario name, method, url rule it exercises, builder of (url, body))
+SCENARIOS = [
+    ('sitemap', 'GET', '/', lambda ctx: ('/', None)),
+    ('hello', 'GET', '/user', lambda ctx: ('/user', None)),
+    ('users', 'GET', '/users', lambda ctx: ('/users', None)),
+    ('users_page_500', 'GET', '/users', lambda ctx: (f'/users?limit=500&after={ctx.id("user") // 2}', None)),
+    ('user', 'GET', '/user/<int:id>', lambda ctx: (f'/user/{ctx.id("user")}', None)),
+    ('characters', 'GET', '/characters', lambda ctx: ('/characters', None)),
+    ('characters_page_500', 'GET', '/characters', lambda ctx: (f'/characters?limit=500&after={ctx.id("character")}', None)),
+    ('characters_ndjson_tail', 'GET', '/characters', lambda ctx: (f'/characters?format=ndjson&after={max(ctx.scale["characters"] - 1000, 0)}', None)),
+    ('characters_filtered', 'GET', '/characters', lambda ctx: ('/characters?gender=female&eye_color=blue,brown&fields=full_name,eye_color', None)),
+    ('planets_sorted', 'GET', '/planets', lambda ctx: ('/planets?sort=-population_count&population_count_min=1000&limit=100', None)),
+    ('character', 'GET', '/character/<int:id>', lambda ctx: (f'/character/{ctx.id("character")}', None)),
+    ('planets', 'GET', '/planets', lambda ctx: ('/planets', None)),
+    ('planet', 'GET', '/planet/<int:id>', lambda ctx: (f'/planet/{ctx.id("planet")}', None)),
+    ('films', 'GET', '/films', lambda ctx: ('/films', None)),
+    ('film', 'GET', '/film/<int:id>', lambda ctx: (f'/film/{ctx.id("film")}', None)),
+    ('favorites', 'GET', '/user/<int:id>/favorites', lambda ctx: (f'/user/{ctx.id("user")}/favorites', None)),
+    ('top_characters', 'GET', '/top/<kind>', lambda ctx: ('/top/characters?limit=20', None)),
+    ('costars', 'GET', '/character/<int:id>/costars', lambda ctx: (f'/character/{ctx.id("character")}/costars?limit=20', None)),
+    ('path', 'GET', '/character/<int:id>/path/<int:other_id>', lambda ctx: (f'/character/{ctx.id("character")}/path/{ctx.id("character")}', None)),
+    ('film_natives', 'GET', '/film/<int:id>/natives', lambda ctx: (f'/film/{ctx.id("film")}/natives', None)),
+    ('search_title', 'GET', '/search', lambda ctx: (f'/search?q=character {ctx.id("character")}', None)),
+    ('search_prefix', 'GET', '/search', lambda ctx: ('/search?q=rebel spa', None)),
+    ('cache_stats', 'GET', '/cache/stats', lambda ctx: ('/cache/stats', None)),
+    ('post_user', 'POST', '/user', lambda ctx: ('/user', {
+        'user_name': ctx.name('u')[:20], 'email': ctx.name('e') + '@example.com', 'password': 'x'})),
+    ('post_character', 'POST', '/character', lambda ctx: ('/character', {
+        'full_name': ctx.name('Character'), 'gender': 'male', 'home_planet': ctx.id('planet')})),
+    ('post_planet', 'POST', '/planet', lambda ctx: ('/planet', {
+        'name': ctx.name('Planet'), 'climate': 'arid'})),
+    ('post_film', 'POST', '/film', lambda ctx: ('/film', {
+        'title': ctx.name('Film'), 'episode': '0',
+        'feature_char': [ctx.id('character') for _ in range(20)],
+        'feature_planet': [ctx.id('planet') for _ in range(5)]})),
+    ('post_characters_batch', 'POST', '/characters/batch', lambda ctx: ('/characters/batch', [
+        {'full_name': ctx.name('Batch'), 'home_planet': ctx.id('planet')} for _ in range(100)])),
+    ('post_planets_batch', 'POST', '/planets/batch', lambda ctx: ('/planets/batch', [
+        {'name': ctx.name('Batch')} for _ in range(100)])),
+    ('post_films_batch', 'POST', '/films/batch', lambda ctx: ('/films/batch', [
+        {'title': ctx.name('Batch'), 'episode': '0', 'feature_char': [ctx.id('character')]} for _ in range(20)])),
+    ('post_favorites_batch', 'POST', '/user/<int:user_id>/favorites/batch', lambda ctx: (f'/user/{ctx.id("user")}/favorites/batch', {
+        'characters': [ctx.id('character') for _ in range(20)],
+        'planets': [ctx.id('planet') for _ in range(5)]})),
+    ('post_favorite_character', 'POST', '/user/<int:user_id>/favorites/character/<character_id>', favorite_post('character')),
+    ('post_favorite_planet', 'POST', '/user/<int:user_id>/favorites/planet/<planet_id>', favorite_post('planet')),
+    ('post_favorite_film', 'POST', '/user/<int:user_id>/favorites/film/<film_id>', favorite_post('film')),
+    ('put_user', 'PUT', '/user/<int:id>', lambda ctx: (f'/user/{ctx.id("user")}', {'password': 'y'})),
+    ('put_character', 'PUT', '/character/<int:id>', lambda ctx: (f'/character/{ctx.id("character")}', {'eye_color': 'red'})),
+    ('put_planet', 'PUT', '/planet/<int:id>', lambda ctx: (f'/planet/{ctx.id("planet")}', {'climate': 'humid'})),
+    ('put_film', 'PUT', '/film/<int:id>', lambda ctx: (f'/film/{ctx.id("film")}', {'director': 'Someone'})),
+    ('delete_favorite_character', 'DELETE', '/user/<int:user_id>/favorites/character/<int:id>', favorite_delete('character')),
+    ('delete_favorite_planet', 'DELETE', '/user/<int:user_id>/favorites/planet/<int:id>', favorite_delete('planet')),
+    ('delete_favorite_film', 'DELETE', '/user/<int:user_id>/favorites/film/<int:id>', favorite_delete('film')),
+    ('delete_favorite_by_reg', 'DELETE', '/favorites/character/<int:reg_id>', lambda ctx: (f'/favorites/character/{ctx.rng.randint(1, ctx.scale["users"] * 15)}', None)),
+    ('delete_user', 'DELETE', '/user/<int:id>', lambda ctx: (f'/user/{ctx.id("user")}', None)),
+    ('delete_character', 'DELETE', '/character/<int:id>', lambda ctx: (f'/character/{ctx.id("character")}', None)),
+    ('delete_planet', 'DELETE', '/planet/<int:id>', lambda ctx: (f'/planet/{ctx.id("planet")}', None)),
+    ('delete_film', 'DELETE', '/film/<int:id>', lambda ctx: (f'/film/{ctx.id("film")}', None)),
+]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+def summarize(rule, method, latencies, elapsed, errors, queries):
+    return {
+        'rule': rule,
+        'method': method,
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'rps': round(len(latencies) / elapsed, 1),
+        'queries_per_request': None if queries is None else round(sum(queries) / len(queries), 2),
+    }
+
+
+def run_client(app, ctx, requests):
+    from sqlalchemy import event
+    from models import db
+
+    statements = []
+
+    def count(*args):
+        statements.append(None)
+
+    client = app.test_client()
+    results = {}
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count)
+    for name, method, rule, build in SCENARIOS:
+        latencies, queries, errors = [], [], 0
+        started = time.perf_counter()
+        for _ in range(requests):
+            url, body = build(ctx)
+            statements.clear()
+            t0 = time.perf_counter()
+            response = client.open(url, method=method, json=body)
+            response.get_data()
+            latencies.append(time.perf_counter() - t0)
+            queries.append(len(statements))
+            errors += response.status_code >= 500
+        results[name] = summarize(rule, method, latencies,
+                                  time.perf_counter() - started, errors, queries)
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(database, workers, target='wsgi', worker_class='sync'):
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=database)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', target, '--chdir', SRC, '-k', worker_class,
+         '-b', f'127.0.0.1:{port}', '-w', str(workers), '--log-level', 'warning'],
+        env=env, cwd=ROOT)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return server, port
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+
+def run_http(port, ctx, requests, concurrency, scenarios=SCENARIOS):
+    def send(request):
+        method, url, body = request
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        payload = None if body is None else json.dumps(body)
+        headers = {} if body is None else {'Content-Type': 'application/json'}
+        t0 = time.perf_counter()
+        conn.request(method, url, body=payload, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        conn.close()
+        return time.perf_counter() - t0, response.status
+
+    results = {}
+    with ThreadPoolExecutor(concurrency) as pool:
+        for name, method, rule, build in scenarios:
+            batch = [(method, *build(ctx)) for _ in range(requests)]
+            started = time.perf_counter()
+            outcomes = list(pool.map(send, batch))
+            results[name] = summarize(
+                rule, method, [latency for latency, _ in outcomes],
+                time.perf_counter() - started,
+                sum(status >= 500 for _, status in outcomes), None)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def uncovered_rules(app):
+    covered = {(rule, method) for _, method, rule, _ in SCENARIOS}
+    return sorted(f'{method} {rule.rule}' for rule in app.url_map.iter_rules()
+                  for method in rule.methods - {'HEAD', 'OPTIONS'}
+                  if not rule.rule.startswith(('/admin', '/static'))
+                  and (rule.rule, method) not in covered)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--characters', type=int, default=10000)
+    parser.add_argument('--database', default='sqlite:////tmp/bench.db')
+    parser.add_argument('--mode', choices=['client', 'gunicorn'], default='client')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--cache', action='store_true',
+                        help='keep the response cache on (off by default to measure the database path)')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database
+    if not args.cache:
+        os.environ['CACHE_MAX_ENTRIES'] = '0'
+    # one client sending every request would be throttled
+    os.environ['RATE_LIMIT'] = '0'
+    sys.path.insert(0, SRC)
+    from app import app
+
+    scale = scale_for(args.characters)
+    with app.app_context():
+        seed(scale)
+
+    ctx = Context(scale, random.Random(1))
+    if args.mode == 'client':
+        results = run_client(app, ctx, args.requests)
+    else:
+        server, port = start_gunicorn(args.database, args.workers)
+        try:
+            results = run_http(port, ctx, args.requests, args.concurrency)
+        finally:
+            server.terminate()
+            server.wait()
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'database': args.database.split(':', 1)[0],
+        'mode': args.mode,
+        'workers': args.workers if args.mode == 'gunicorn' else 1,
+        'concurrency': args.concurrency if args.mode == 'gunicorn' else 1,
+        'cache': args.cache,
+        'scale': scale,
+        'uncovered_routes': uncovered_rules(app),
+        'scenarios': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
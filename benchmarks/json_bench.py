@@ -0,0 +1,103 @@
+"""
+Measures the JSON encoder's share of every read endpoint.
+
+    python benchmarks/json_bench.py --characters 10000 --requests 200
+
+Each GET scenario from bench.py is replayed through the Flask test
+client, once with Flask's stdlib provider and once with the orjson
+provider from src/json_provider.py, with the response cache off. The
+JSON report gives, per endpoint, the mean time spent encoding and the
+mean request time under both providers, and how much faster each got.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from seed import SRC, scale_for, seed
+from bench import SCENARIOS, Context
+
+SKIPPED = {'sitemap', 'hello'}
+
+
+def timed(provider, spent):
+    # wrap the provider's encoding entry points to collect their time
+    for name in ['dumps', 'response']:
+        method = getattr(provider, name)
+
+        def wrapper(*args, _method=method, **kwargs):
+            t0 = time.perf_counter()
+            result = _method(*args, **kwargs)
+            spent.append(time.perf_counter() - t0)
+            return result
+        setattr(provider, name, wrapper)
+    return provider
+
+
+def measure(app, provider, scale, requests):
+    client = app.test_client()
+    results = {}
+    for name, method, rule, build in SCENARIOS:
+        if method != 'GET' or name in SKIPPED:
+            continue
+        ctx = Context(scale, random.Random(1))
+        spent = []
+        app.json = timed(provider, spent)
+        started = time.perf_counter()
+        for _ in range(requests):
+            url, _ = build(ctx)
+            client.get(url).get_data()
+        elapsed = time.perf_counter() - started
+        results[name] = {'encode_ms': sum(spent) * 1000 / requests,
+                         'request_ms': elapsed * 1000 / requests}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--characters', type=int, default=10000)
+    parser.add_argument('--database', default='sqlite:////tmp/bench.db')
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database
+    os.environ['CACHE_MAX_ENTRIES'] = '0'
+    os.environ['RATE_LIMIT'] = '0'
+    sys.path.insert(0, SRC)
+    from flask.json.provider import DefaultJSONProvider
+    from json_provider import OrjsonProvider, orjson
+    from app import app
+
+    if orjson is None:
+        sys.exit('orjson is not installed, nothing to compare')
+    scale = scale_for(args.characters)
+    with app.app_context():
+        seed(scale)
+
+    stdlib = measure(app, DefaultJSONProvider(app), scale, args.requests)
+    fast = measure(app, OrjsonProvider(app), scale, args.requests)
+    results = {}
+    for name in stdlib:
+        before, after = stdlib[name], fast[name]
+        results[name] = {
+            'stdlib_encode_ms': round(before['encode_ms'], 3),
+            'orjson_encode_ms': round(after['encode_ms'], 3),
+            'encode_speedup': round(before['encode_ms'] / after['encode_ms'], 2) if after['encode_ms'] else None,
+            'stdlib_request_ms': round(before['request_ms'], 3),
+            'orjson_request_ms': round(after['request_ms'], 3),
+            'request_speedup': round(before['request_ms'] / after['request_ms'], 2),
+        }
+
+    output = json.dumps({'scale': scale, 'requests': args.requests, 'endpoints': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
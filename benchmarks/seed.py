@@ -0,0 +1,150 @@
+"""
+Seeds a database with a synthetic catalog for the benchmarks.
+
+    python benchmarks/seed.py --characters 100000 --database sqlite:////tmp/bench.db
+
+Rows go in through the models in src/models.py with chunked executemany
+into freshly created tables, so ids run from 1 to N in insertion order.
+Popularity is skewed towards low ids so favorites and appearances have a
+realistic long tail. The generator is seeded, so the same scale always
+produces the same data.
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+CHUNK_SIZE = 10000
+
+GENDERS = ['male', 'female', 'n/a', 'hermaphrodite', None]
+COLORS = ['blue', 'brown', 'yellow', 'red', 'black', 'green', 'white', 'hazel', None]
+SKIN_TONES = ['fair', 'light', 'dark', 'green', 'grey', 'metal', None]
+CLIMATES = ['arid', 'temperate', 'tropical', 'frozen', 'murky', 'windy', None]
+TERRAINS = ['desert', 'grasslands', 'mountains', 'jungle', 'tundra', 'swamp', 'ocean', None]
+CRAWL = ('It is a period of civil war. Rebel spaceships, striking from a hidden base, '
+         'have won their first victory against the evil Galactic Empire. ')
+
+
+def scale_for(characters):
+    return {
+        'characters': characters,
+        'planets': max(characters // 20, 10),
+        'films': max(characters // 2000, 6),
+        'users': max(characters // 10, 10),
+        'favorites_per_user': 15,
+        'characters_per_film': 80,
+        'planets_per_film': 10,
+    }
+
+
+def skewed(rng, n):
+    # low ids are picked far more often than high ones
+    return int(n * rng.random() ** 3) + 1
+
+
+def pick_distinct(rng, n, k):
+    k = min(k, n)
+    picked = set()
+    while len(picked) < k:
+        picked.add(skewed(rng, n))
+    return picked
+
+
+def insert_chunked(db, model, rows):
+    from sqlalchemy import insert
+    rows = iter(rows)
+    total = 0
+    while True:
+        chunk = [row for _, row in zip(range(CHUNK_SIZE), rows)]
+        if not chunk:
+            return total
+        db.session.execute(insert(model), chunk)
+        total += len(chunk)
+
+
+def seed(scale, rng=None):
+    """Creates the schema and fills it. Needs an app context."""
+    from models import (db, User, Character, Planet, Film, Favorites_Characters,
+                        Favorites_Planets, Favorites_Films, Natives_Planets,
+                        Appearance_Characters, Appearance_Planets)
+    from search import reindex
+    from popularity import recount_favorites
+    rng = rng or random.Random(42)
+    db.drop_all()
+    db.create_all()
+
+    n_chars, n_planets = scale['characters'], scale['planets']
+    n_films, n_users = scale['films'], scale['users']
+    counts = {}
+    counts['user'] = insert_chunked(db, User, (
+        {'is_active': i % 50 != 0, 'user_name': f'user{i}',
+         'email': f'user{i}@example.com', 'password': 'secret'}
+        for i in range(1, n_users + 1)))
+    counts['planet'] = insert_chunked(db, Planet, (
+        {'name': f'Planet {i}', 'climate': rng.choice(CLIMATES),
+         'terrain': rng.choice(TERRAINS), 'population_count': rng.randrange(10 ** 9),
+         'gravity': f'{rng.randint(1, 3)} standard', 'diameter': rng.randrange(1000, 20000),
+         'water_surface': rng.randrange(100), 'orbital_period': rng.randrange(200, 600),
+         'rotation_period': rng.randrange(10, 40)}
+        for i in range(1, n_planets + 1)))
+    counts['character'] = insert_chunked(db, Character, (
+        {'full_name': f'Character {i}', 'birth_year': f'{rng.randrange(900)}BBY',
+         'gender': rng.choice(GENDERS), 'height_mts': rng.randrange(60, 260),
+         'weight_kg': rng.randrange(20, 200), 'skin_tone': rng.choice(SKIN_TONES),
+         'eye_color': rng.choice(COLORS), 'hair_color': rng.choice(COLORS)}
+        for i in range(1, n_chars + 1)))
+    start = datetime.date(1977, 5, 25)
+    counts['film'] = insert_chunked(db, Film, (
+        {'title': f'Episode {i}', 'episode': str(i),
+         'director': f'Director {i % 7}', 'producer': f'Producer {i % 5}',
+         'release_date': start + datetime.timedelta(days=700 * i),
+         'opening_crawl': CRAWL * rng.randint(2, 6)}
+        for i in range(1, n_films + 1)))
+
+    counts['natives_planets'] = insert_chunked(db, Natives_Planets, (
+        {'character_id': i, 'planet_id': skewed(rng, n_planets)}
+        for i in range(1, n_chars + 1)))
+    counts['appearance_characters'] = insert_chunked(db, Appearance_Characters, (
+        {'film_id': film, 'character_id': character}
+        for film in range(1, n_films + 1)
+        for character in pick_distinct(rng, n_chars, scale['characters_per_film'])))
+    counts['appearance_planets'] = insert_chunked(db, Appearance_Planets, (
+        {'film_id': film, 'planet_id': planet}
+        for film in range(1, n_films + 1)
+        for planet in pick_distinct(rng, n_planets, scale['planets_per_film'])))
+
+    per_user = scale['favorites_per_user']
+    for model, column, n in [(Favorites_Characters, 'character_id', n_chars),
+                             (Favorites_Planets, 'planet_id', n_planets),
+                             (Favorites_Films, 'film_id', n_films)]:
+        counts[model.__tablename__] = insert_chunked(db, model, (
+            {'user_id': user, column: target}
+            for user in range(1, n_users + 1)
+            for target in pick_distinct(rng, n, rng.randint(0, 2 * per_user))))
+    db.session.commit()
+    recount_favorites()
+    counts['search_document'] = sum(reindex().values())
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--characters', type=int, default=10000)
+    parser.add_argument('--database', default='sqlite:////tmp/bench.db')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database
+    sys.path.insert(0, SRC)
+    from app import app
+
+    started = time.perf_counter()
+    with app.app_context():
+        counts = seed(scale_for(args.characters))
+    print(f'seeded {counts} in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
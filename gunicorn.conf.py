@@ -0,0 +1,25 @@
+# Picked up by `gunicorn -c gunicorn.conf.py` (see Procfile).
+import os
+import shutil
+
+
+def on_starting(server):
+    # stale samples from a previous run would be summed into /metrics
+    path = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    # load the traversal index before the worker takes requests; the
+    # async app has no traversal routes
+    if hasattr(worker.wsgi, 'extensions'):
+        from graph import preload_graph
+        preload_graph(worker.wsgi)
@@ -0,0 +1,46 @@
+"""association table indexes
+
+Revision ID: 3f1c9d2b7a40
+Revises: b2c8e4f1a6d3
+Create Date: 2026-10-18 10:12:44.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9d2b7a40'
+down_revision = 'b2c8e4f1a6d3'
+branch_labels = None
+depends_on = None
+
+
+# (table, owner column, target column)
+ASSOCIATIONS = [
+    ('favorite_characters', 'user_id', 'character_id'),
+    ('favorite_planets', 'user_id', 'planet_id'),
+    ('favorite_films', 'user_id', 'film_id'),
+    ('natives_planets', 'character_id', 'planet_id'),
+    ('appearance_characters', 'character_id', 'film_id'),
+    ('appearance_planets', 'planet_id', 'film_id'),
+]
+
+
+def upgrade():
+    for table, owner, target in ASSOCIATIONS:
+        # keep the oldest row of every duplicated pair so the unique index
+        # can be built
+        op.execute(
+            f'DELETE FROM {table} WHERE id NOT IN '
+            f'(SELECT min_id FROM (SELECT MIN(id) AS min_id FROM {table} '
+            f'GROUP BY {owner}, {target}) AS keep)')
+        op.create_index(f'uq_{table}_{owner}_{target}',
+                        table, [owner, target], unique=True)
+        op.create_index(f'ix_{table}_{target}', table, [target])
+
+
+def downgrade():
+    for table, owner, target in reversed(ASSOCIATIONS):
+        op.drop_index(f'ix_{table}_{target}', table_name=table)
+        op.drop_index(f'uq_{table}_{owner}_{target}', table_name=table)
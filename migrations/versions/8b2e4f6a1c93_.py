@@ -0,0 +1,39 @@
+"""catalog filter and sort indexes
+
+Revision ID: 8b2e4f6a1c93
+Revises: 3f1c9d2b7a40
+Create Date: 2026-10-18 14:05:31.274816
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e4f6a1c93'
+down_revision = '3f1c9d2b7a40'
+branch_labels = None
+depends_on = None
+
+
+# filterable and sortable columns of each catalog table, indexed together
+# with id so filtered and sorted pages are keyset range scans
+COLUMNS = {
+    'character': ['gender', 'eye_color', 'hair_color', 'skin_tone', 'birth_year',
+                  'height_mts', 'weight_kg'],
+    'planet': ['climate', 'terrain', 'gravity', 'population_count', 'diameter',
+               'water_surface', 'orbital_period', 'rotation_period'],
+    'film': ['episode', 'director', 'producer', 'release_date'],
+}
+
+
+def upgrade():
+    for table, columns in COLUMNS.items():
+        for column in columns:
+            op.create_index(f'ix_{table}_{column}_id', table, [column, 'id'])
+
+
+def downgrade():
+    for table, columns in reversed(COLUMNS.items()):
+        for column in reversed(columns):
+            op.drop_index(f'ix_{table}_{column}_id', table_name=table)
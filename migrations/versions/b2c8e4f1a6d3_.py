@@ -0,0 +1,103 @@
+"""catalog tables
+
+Revision ID: b2c8e4f1a6d3
+Revises: a5cffa318ac2
+Create Date: 2026-10-18 09:02:17.441093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2c8e4f1a6d3'
+down_revision = 'a5cffa318ac2'
+branch_labels = None
+depends_on = None
+
+
+# (table, owner table, target table) of the association tables
+ASSOCIATIONS = [
+    ('favorite_characters', 'user', 'character'),
+    ('favorite_planets', 'user', 'planet'),
+    ('favorite_films', 'user', 'film'),
+    ('natives_planets', 'character', 'planet'),
+    ('appearance_characters', 'character', 'film'),
+    ('appearance_planets', 'planet', 'film'),
+]
+
+
+def upgrade():
+    # databases created with db.create_all() already have some of these
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    user_columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('user')}
+    if 'user_name' not in user_columns:
+        op.add_column('user', sa.Column('user_name', sa.String(length=20), nullable=True))
+        op.execute("UPDATE \"user\" SET user_name = 'user_' || id")
+        with op.batch_alter_table('user', schema=None) as batch_op:
+            batch_op.alter_column('user_name', existing_type=sa.String(length=20), nullable=False)
+            batch_op.create_unique_constraint('uq_user_user_name', ['user_name'])
+
+    if 'character' not in existing:
+        op.create_table('character',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('full_name', sa.String(length=50), nullable=False),
+        sa.Column('birth_year', sa.String(length=10), nullable=True),
+        sa.Column('gender', sa.String(length=10), nullable=True),
+        sa.Column('height_mts', sa.Integer(), nullable=True),
+        sa.Column('weight_kg', sa.Integer(), nullable=True),
+        sa.Column('skin_tone', sa.String(length=20), nullable=True),
+        sa.Column('eye_color', sa.String(length=20), nullable=True),
+        sa.Column('hair_color', sa.String(length=20), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('full_name')
+        )
+    if 'planet' not in existing:
+        op.create_table('planet',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('climate', sa.String(length=20), nullable=True),
+        sa.Column('terrain', sa.String(length=20), nullable=True),
+        sa.Column('population_count', sa.Integer(), nullable=True),
+        sa.Column('gravity', sa.String(length=20), nullable=True),
+        sa.Column('diameter', sa.Integer(), nullable=True),
+        sa.Column('water_surface', sa.Integer(), nullable=True),
+        sa.Column('orbital_period', sa.Integer(), nullable=True),
+        sa.Column('rotation_period', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+        )
+    if 'film' not in existing:
+        op.create_table('film',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=50), nullable=False),
+        sa.Column('episode', sa.String(length=10), nullable=False),
+        sa.Column('director', sa.String(length=20), nullable=True),
+        sa.Column('producer', sa.String(length=20), nullable=True),
+        sa.Column('release_date', sa.Date(), nullable=True),
+        sa.Column('opening_crawl', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('title')
+        )
+    for table, owner, target in ASSOCIATIONS:
+        if table in existing:
+            continue
+        op.create_table(table,
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column(f'{owner}_id', sa.Integer(), nullable=False),
+        sa.Column(f'{target}_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint([f'{owner}_id'], [f'{owner}.id'], ),
+        sa.ForeignKeyConstraint([f'{target}_id'], [f'{target}.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    for table, _, _ in reversed(ASSOCIATIONS):
+        op.drop_table(table)
+    op.drop_table('film')
+    op.drop_table('planet')
+    op.drop_table('character')
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_user_user_name', type_='unique')
+        batch_op.drop_column('user_name')
@@ -0,0 +1,49 @@
+"""full-text search documents
+
+Revision ID: c4d7e2a95b18
+Revises: 8b2e4f6a1c93
+Create Date: 2026-10-18 16:42:09.583120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d7e2a95b18'
+down_revision = '8b2e4f6a1c93'
+branch_labels = None
+depends_on = None
+
+
+# doc_id = id * 4 + kind code, as in src/search.py
+BACKFILL = [
+    'SELECT id * 4 + 1, full_name, NULL FROM character',
+    'SELECT id * 4 + 2, name, NULL FROM planet',
+    'SELECT id * 4 + 3, title, opening_crawl FROM film',
+]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute(
+            'CREATE TABLE search_document ('
+            ' doc_id bigint PRIMARY KEY, title text NOT NULL, body text,'
+            " document tsvector GENERATED ALWAYS AS (setweight(to_tsvector('english', title), 'A')"
+            " || setweight(to_tsvector('english', coalesce(body, '')), 'B')) STORED)")
+        for select in BACKFILL:
+            op.execute(f'INSERT INTO search_document (doc_id, title, body) {select}')
+        # built after the backfill, which is much faster than maintaining it
+        op.execute('CREATE INDEX ix_search_document_document ON search_document USING gin (document)')
+    elif dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE search_document"
+                   " USING fts5(title, body, tokenize='porter unicode61', prefix='2 3 4')")
+        op.execute("INSERT INTO search_document (search_document, rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+        for select in BACKFILL:
+            op.execute(f'INSERT INTO search_document (rowid, title, body) {select}')
+
+
+def downgrade():
+    if op.get_bind().dialect.name in ('postgresql', 'sqlite'):
+        op.execute('DROP TABLE search_document')
@@ -0,0 +1,40 @@
+"""favorite counters
+
+Revision ID: e1a6b3c8d527
+Revises: c4d7e2a95b18
+Create Date: 2026-10-18 18:20:47.306215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1a6b3c8d527'
+down_revision = 'c4d7e2a95b18'
+branch_labels = None
+depends_on = None
+
+
+# catalog table -> (favorite table, its column pointing at the catalog row)
+FAVORITES = {
+    'character': ('favorite_characters', 'character_id'),
+    'planet': ('favorite_planets', 'planet_id'),
+    'film': ('favorite_films', 'film_id'),
+}
+
+
+def upgrade():
+    for table, (favorites, column) in FAVORITES.items():
+        op.add_column(table, sa.Column('favorite_count', sa.Integer(),
+                                       server_default='0', nullable=False))
+        op.execute(f'UPDATE {table} SET favorite_count = (SELECT count(*) FROM {favorites}'
+                   f' WHERE {favorites}.{column} = {table}.id)')
+        op.create_index(f'ix_{table}_favorite_count_id', table, ['favorite_count', 'id'])
+
+
+def downgrade():
+    for table in reversed(FAVORITES):
+        op.drop_index(f'ix_{table}_favorite_count_id', table_name=table)
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('favorite_count')
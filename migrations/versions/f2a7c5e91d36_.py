@@ -0,0 +1,44 @@
+"""one-letter search prefixes
+
+Revision ID: f2a7c5e91d36
+Revises: e1a6b3c8d527
+Create Date: 2026-10-18 21:05:33.418652
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a7c5e91d36'
+down_revision = 'e1a6b3c8d527'
+branch_labels = None
+depends_on = None
+
+
+# doc_id = id * 4 + kind code, as in src/search.py
+BACKFILL = [
+    'SELECT id * 4 + 1, full_name, NULL FROM character',
+    'SELECT id * 4 + 2, name, NULL FROM planet',
+    'SELECT id * 4 + 3, title, opening_crawl FROM film',
+]
+
+
+def rebuild(prefix):
+    # FTS5 prefix indexes are fixed when the table is created
+    op.execute('DROP TABLE search_document')
+    op.execute("CREATE VIRTUAL TABLE search_document"
+               f" USING fts5(title, body, tokenize='porter unicode61', prefix='{prefix}')")
+    op.execute("INSERT INTO search_document (search_document, rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+    for select in BACKFILL:
+        op.execute(f'INSERT INTO search_document (rowid, title, body) {select}')
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        rebuild('1 2 3 4')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        rebuild('2 3 4')
@@ -1,61 +1,165 @@
 import os
+import re
+from flask import g
 from flask_admin import Admin
 from models import db, User, Character, Planet, Film, Favorites_Characters, Favorites_Planets, Favorites_Films, Natives_Planets, Appearance_Characters, Appearance_Planets
 from flask_admin.contrib.sqla import ModelView
-
-
-class User_MV(ModelView):
-    column_auto_selected_related = True
-    column_list = ['id', 'is_active', 'user_name', 'email',
-                   'password', 'fav_char', 'fav_planet', 'fav_film']
-
-
-class Character_MV(ModelView):
-    column_auto_selected = True
-    column_list = ['id', 'full_name', 'birth_year', 'gender', 'height_mts', 'weight_kg',
-                   'skin_tone', 'eye_color', 'hair_color', 'favorite_by', 'home_planet', 'appearance']
-
-
-class Planet_MV(ModelView):
-    column_auto_selected = True
+from flask_admin.contrib.sqla.ajax import QueryAjaxModelLoader
+from sqlalchemy.orm import selectinload, undefer
+from cache import invalidate
+from namespaces import character_namespaces, planet_namespaces, film_namespaces, link_namespaces
+from search import KIND_OF, get_backend, search_documents, index_documents, remove_documents
+
+
+class Search_Loader(QueryAjaxModelLoader):
+    # dropdown lookups through the full-text search index instead of an
+    # ILIKE '%term%' scan; plain ILIKE where there is no search backend
+    def __init__(self, name, model, fields):
+        super().__init__(name, db.session, model, fields=fields, page_size=20)
+
+    def get_list(self, term, offset=0, limit=20):
+        terms = re.findall(r'\w+', term)
+        if get_backend() is None or not terms:
+            return super().get_list(term, offset, limit)
+        results, _ = search_documents(terms, [KIND_OF[self.model]], limit, offset or 0)
+        ids = [result['id'] for result in results]
+        found = {row.id: row for row in self.get_query().filter(self.model.id.in_(ids))}
+        return [found[id] for id in ids if id in found]
+
+
+class User_Loader(QueryAjaxModelLoader):
+    # user_name prefix as a range on its unique index
+    def __init__(self, name):
+        super().__init__(name, db.session, User, fields=['user_name'], page_size=20)
+
+    def get_list(self, term, offset=0, limit=20):
+        return self.get_query().filter(
+            User.user_name >= term, User.user_name < term + '\uffff').order_by(
+            User.user_name).offset(offset or 0).limit(limit).all()
+
+
+class Listing_MV(ModelView):
+    # No COUNT(*) over the whole table per page, related collections shown
+    # as deferred count columns and the rest loaded with the page
+    simple_list_pager = True
+    column_auto_select_related = True
+    column_counts = []
+    list_options = ()
+
+    def get_query(self):
+        return super().get_query().options(
+            *(undefer(getattr(self.model, count)) for count in self.column_counts),
+            *self.list_options)
+
+
+class Searchable_MV(Listing_MV):
+    # keep search documents and cached pages in step with edits made
+    # through the admin; `namespaces` is the entity's helper in namespaces.py
+    namespaces = None
+
+    def after_model_change(self, form, model, is_created):
+        index_documents(self.model, [model.id])
+        self.session.commit()
+        invalidate(*self.namespaces(model.id))
+
+    def on_model_delete(self, model):
+        # the links go with the row, so the pages embedding it are found first
+        g.stale_namespaces = self.namespaces(model.id)
+
+    def after_model_delete(self, model):
+        remove_documents(self.model, [model.id])
+        self.session.commit()
+        invalidate('graph', *g.pop('stale_namespaces'))
+
+
+class Link_MV(Listing_MV):
+    # the traversal index of graph.py reloads after edits to the links, and
+    # the detail pages of both ends, old and new, embed them
+    def on_model_change(self, form, model, is_created):
+        g.stale_namespaces = link_namespaces(model)
+
+    def after_model_change(self, form, model, is_created):
+        invalidate('graph', *g.pop('stale_namespaces'))
+
+    def on_model_delete(self, model):
+        g.stale_namespaces = link_namespaces(model)
+
+    def after_model_delete(self, model):
+        invalidate('graph', *g.pop('stale_namespaces'))
+
+
+class User_MV(Listing_MV):
+    column_counts = ['fav_char_count', 'fav_planet_count', 'fav_film_count']
+    column_list = ['id', 'is_active', 'user_name', 'email', 'password', *column_counts]
+    column_sortable_list = ['id', 'user_name', 'email']
+    form_excluded_columns = ['fav_char', 'fav_planet', 'fav_film']
+
+
+class Character_MV(Searchable_MV):
+    namespaces = staticmethod(character_namespaces)
+    column_counts = ['appearance_count']
+    list_options = (selectinload(Character.home_planet).joinedload(Natives_Planets.planet),)
+    column_list = ['id', 'full_name', 'birth_year', 'gender', 'height_mts', 'weight_kg', 'skin_tone',
+                   'eye_color', 'hair_color', 'favorite_count', 'home_planet', *column_counts]
+    column_sortable_list = ['id', 'full_name', 'birth_year', 'gender', 'height_mts', 'weight_kg',
+                            'skin_tone', 'eye_color', 'hair_color', 'favorite_count']
+    form_excluded_columns = ['favorite_count', 'favorite_by', 'home_planet', 'appearance']
+
+
+class Planet_MV(Searchable_MV):
+    namespaces = staticmethod(planet_namespaces)
+    column_counts = ['natives_count', 'appearance_count']
     column_list = ['id', 'name', 'climate', 'terrain', 'population_count', 'gravity', 'diameter',
-                   'water_surface', 'orbital_period', 'rotation_period', 'favorite_by', 'natives', 'appearance']
+                   'water_surface', 'orbital_period', 'rotation_period', 'favorite_count', *column_counts]
+    column_sortable_list = ['id', 'name', 'climate', 'terrain', 'population_count', 'gravity', 'diameter',
+                            'water_surface', 'orbital_period', 'rotation_period', 'favorite_count']
+    form_excluded_columns = ['favorite_count', 'favorite_by', 'natives', 'appearance']
 
 
-class Film_MV(ModelView):
-    column_auto_selected = True
+class Film_MV(Searchable_MV):
+    namespaces = staticmethod(film_namespaces)
+    column_counts = ['feature_char_count', 'feature_planet_count']
     column_list = ['id', 'title', 'episode', 'director', 'producer', 'release_date',
-                   'opening_crawl', 'favorite_by', 'feature_char', 'feature_planet']
+                   'opening_crawl', 'favorite_count', *column_counts]
+    column_sortable_list = ['id', 'title', 'episode', 'director', 'producer', 'release_date',
+                            'favorite_count']
+    form_excluded_columns = ['favorite_count', 'favorite_by', 'feature_char', 'feature_planet']
 
 
-class Favorites_Characters_MV(ModelView):
-    column_auto_selected = True
+class Favorites_Characters_MV(Listing_MV):
     column_list = ['id', 'user_id', 'user', 'character_id', 'character']
+    form_ajax_refs = {'user': User_Loader('user'),
+                      'character': Search_Loader('character', Character, ['full_name'])}
 
 
-class Favorites_Planets_MV(ModelView):
-    column_auto_selected = True
+class Favorites_Planets_MV(Listing_MV):
     column_list = ['id', 'user_id', 'user', 'planet_id', 'planet']
+    form_ajax_refs = {'user': User_Loader('user'),
+                      'planet': Search_Loader('planet', Planet, ['name'])}
 
 
-class Favorites_Films_MV(ModelView):
-    column_auto_selected = True
+class Favorites_Films_MV(Listing_MV):
     column_list = ['id', 'user_id', 'user', 'film_id', 'film']
+    form_ajax_refs = {'user': User_Loader('user'),
+                      'film': Search_Loader('film', Film, ['title'])}
 
 
-class Natives_Planets_MV(ModelView):
-    column_auto_selected = True
+class Natives_Planets_MV(Link_MV):
     column_list = ['id', 'character_id', 'character', 'planet_id', 'planet']
+    form_ajax_refs = {'character': Search_Loader('character', Character, ['full_name']),
+                      'planet': Search_Loader('planet', Planet, ['name'])}
 
 
-class Appearance_Characters_MV(ModelView):
-    column_auto_selected = True
+class Appearance_Characters_MV(Link_MV):
     column_list = ['id', 'character_id', 'character', 'film_id', 'film']
+    form_ajax_refs = {'character': Search_Loader('character', Character, ['full_name']),
+                      'film': Search_Loader('film', Film, ['title'])}
 
 
-class Appearance_Planets_MV(ModelView):
-    column_auto_selected = True
+class Appearance_Planets_MV(Link_MV):
     column_list = ['id', 'planet_id', 'planet', 'film_id', 'film']
+    form_ajax_refs = {'planet': Search_Loader('planet', Planet, ['name']),
+                      'film': Search_Loader('film', Film, ['title'])}
 
 
 def setup_admin(app):
@@ -1,18 +1,35 @@
 """
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
+import heapq
 import os
 from flask import Flask, request, jsonify, url_for
 from flask_migrate import Migrate
 from flask_swagger import swagger
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
+from sqlalchemy.exc import IntegrityError, TimeoutError as PoolTimeoutError
+from utils import APIException, generate_sitemap, page_args, paginate, field_args, wants_ndjson, stream_ndjson
 from admin import setup_admin
-from models import db, User, Character, Planet, Film, Favorites_Characters, Favorites_Planets, Favorites_Films, Natives_Planets, Appearance_Characters, Appearance_Planets
+from json_provider import setup_json
+from replicas import setup_replicas, replica_engines
+from instrumentation import setup_instrumentation
+from metrics import setup_metrics, render_metrics
+from pool import engine_options, pool_stats
+from cache import setup_cache, cached, conditional, invalidate, get_cache
+from search import setup_search, get_backend, search_args, search_documents, index_documents, remove_documents
+from popularity import setup_popularity, bump_favorite_counts, top_favorited
+from importer import setup_importer
+from exporter import setup_exporter
+from ratelimit import setup_rate_limit
+from graph import MAX_DEGREES, setup_graph, get_graph, graph_links_added, graph_node_removed
+from namespaces import character_namespaces, planet_namespaces, film_namespaces, user_namespaces
+from batch import MAX_BATCH_SIZE, prepare_records, check_references, id_list, existing_ids, insert_rows, insert_links, error, created
+from models import db, columns, User, Character, Planet, Film, Favorites_Characters, Favorites_Planets, Favorites_Films, Natives_Planets, Appearance_Characters, Appearance_Planets
 # from models import Person
 
 app = Flask(__name__)
 app.url_map.strict_slashes = False
+setup_json(app)
 
 db_url = os.getenv("DATABASE_URL")
 if db_url is not None:
@@ -21,11 +38,23 @@ if db_url is not None:
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'])
 
 MIGRATE = Migrate(app, db)
 db.init_app(app)
 CORS(app)
 setup_admin(app)
+setup_cache(app)
+setup_search(app)
+setup_popularity(app)
+setup_importer(app)
+setup_exporter(app)
+setup_graph(app)
+setup_rate_limit(app)
+setup_replicas(app, db)
+setup_instrumentation(app, db)
+setup_metrics(app, db, get_cache)
 
 # Handle/serialize errors like a JSON object
 
@@ -34,6 +63,12 @@ setup_admin(app)
 def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
+
+@app.errorhandler(PoolTimeoutError)
+def handle_pool_timeout(error):
+    # the pool counted it already
+    return jsonify({'msg': 'Database busy, retry later'}), 503, {'Retry-After': '1'}
+
 # generate sitemap with all your endpoints
 
 
@@ -52,21 +87,41 @@ def handle_hello():
     return jsonify(response_body), 200
 
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return render_metrics()
+
+
+@app.route('/db/pool', methods=['GET'])
+def get_pool_stats():
+    stats = pool_stats(db.engine)
+    replicas = replica_engines(app)
+    if replicas:
+        stats['replicas'] = [pool_stats(engine) for engine in replicas]
+    return jsonify({'msg': 'ok', 'GETTED': stats}), 200
+
+
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify({'msg': 'ok', 'GETTED': get_cache().stats()}), 200
+
+
 # GETs
 
 @app.route('/users', methods=['GET'])
+@conditional('users')
 def get_users():
-    users_query = User.query.all()
-    users_serialized = []
-    for user in users_query:
-        if user.is_active is False:
-            pass
-        else:
-            users_serialized.append(user.serialize())
-    return jsonify({'msg': 'ok', 'GETTED': users_serialized}), 200
+    keys = field_args(User)
+    active_users = db.session.query(*columns(User, keys)).filter(User.is_active.is_(True))
+    if wants_ndjson():
+        return stream_ndjson(active_users, User, keys)
+    users_query, next_cursor = paginate(active_users, User)
+    users_serialized = [dict(zip(keys, row)) for row in users_query]
+    return jsonify({'msg': 'ok', 'GETTED': users_serialized, 'next_cursor': next_cursor}), 200
 
 
 @app.route('/user/<int:id>')
+@conditional('user:{id}')
 def get_user_by(id):
     user = User.query.get(id)
     if user is None:
@@ -76,16 +131,23 @@ def get_user_by(id):
 
 
 @app.route('/characters', methods=['GET'])
+@conditional('characters')
+@cached('characters')
 def get_characters():
-    characters_query = Character.query.all()
-    character_serialized = list(
-        map(lambda character: character.serialize(), characters_query))
-    return jsonify({'msg': 'ok', 'GETTED': character_serialized}), 200
+    keys = field_args(Character)
+    characters = db.session.query(*columns(Character, keys))
+    if wants_ndjson():
+        return stream_ndjson(characters, Character, keys)
+    characters_query, next_cursor = paginate(characters, Character)
+    character_serialized = [dict(zip(keys, row)) for row in characters_query]
+    return jsonify({'msg': 'ok', 'GETTED': character_serialized, 'next_cursor': next_cursor}), 200
 
 
 @app.route('/character/<int:id>', methods=['GET'])
+@conditional('character:{id}')
+@cached('character:{id}')
 def get_character_by(id):
-    character = Character.query.get(id)
+    character = Character.query.options(*Character.detail_options()).get(id)
     if character is None:
         return jsonify({'msg': 'Character not found'}), 404
     character_serialized = character.serialize()
@@ -109,16 +171,23 @@ def get_character_by(id):
 
 
 @app.route('/planets', methods=['GET'])
+@conditional('planets')
+@cached('planets')
 def get_planets():
-    planets_query = Planet.query.all()
-    planets_serialized = list(
-        map(lambda planet: planet.serialize(), planets_query))
-    return jsonify({'msg': 'ok', 'GETTED': planets_serialized}), 200
+    keys = field_args(Planet)
+    planets = db.session.query(*columns(Planet, keys))
+    if wants_ndjson():
+        return stream_ndjson(planets, Planet, keys)
+    planets_query, next_cursor = paginate(planets, Planet)
+    planets_serialized = [dict(zip(keys, row)) for row in planets_query]
+    return jsonify({'msg': 'ok', 'GETTED': planets_serialized, 'next_cursor': next_cursor}), 200
 
 
 @app.route('/planet/<int:id>', methods=['GET'])
+@conditional('planet:{id}')
+@cached('planet:{id}')
 def get_planet_by(id):
-    planet = Planet.query.get(id)
+    planet = Planet.query.options(*Planet.detail_options()).get(id)
     if planet is None:
         return jsonify({'msg': 'Planet not found'}), 404
     planet_serialized = planet.serialize()
@@ -142,15 +211,23 @@ def get_planet_by(id):
 
 
 @app.route('/films', methods=['GET'])
+@conditional('films')
+@cached('films')
 def get_films():
-    films_query = Film.query.all()
-    films_serialized = list(map(lambda film: film.serialize(), films_query))
-    return jsonify({'msg': 'ok', 'GETTED': films_serialized}), 200
+    keys = field_args(Film)
+    films = db.session.query(*columns(Film, keys))
+    if wants_ndjson():
+        return stream_ndjson(films, Film, keys)
+    films_query, next_cursor = paginate(films, Film)
+    films_serialized = [dict(zip(keys, row)) for row in films_query]
+    return jsonify({'msg': 'ok', 'GETTED': films_serialized, 'next_cursor': next_cursor}), 200
 
 
 @app.route('/film/<int:id>', methods=['GET'])
+@conditional('film:{id}')
+@cached('film:{id}')
 def get_film_by(id):
-    film = Film.query.get(id)
+    film = Film.query.options(*Film.detail_options()).get(id)
     if film is None:
         return jsonify({'msg': 'Film not found'}), 404
     film_serialized = film.serialize()
@@ -173,29 +250,124 @@ def get_film_by(id):
     return jsonify({'msg': 'ok', 'GETTED': film_serialized}), 200
 
 
+FAVORITE_KINDS = {
+    'characters': (Favorites_Characters, Character, 'Character'),
+    'planets': (Favorites_Planets, Planet, 'Planet'),
+    'films': (Favorites_Films, Film, 'Film'),
+}
+
+
 @app.route('/user/<int:id>/favorites', methods=['GET'])
+@conditional('favorites:{id}', 'characters', 'planets', 'films')
 def get_favorites_user(id):
+    only = request.args.get('only')
+    kinds = list(FAVORITE_KINDS) if only is None else only.split(',')
+    for kind in kinds:
+        if kind not in FAVORITE_KINDS:
+            return jsonify({'msg': f'only must be any of: {", ".join(FAVORITE_KINDS)}'}), 400
+
     user = User.query.get(id)
     if user is None:
         return jsonify({'msg': f'User_id:{id}, not found'}), 404
 
-    fav_char = []
-    for favorite in user.fav_char:
-        fav_char.append(
-            {'reg_id': favorite.id, 'Character': favorite.character.serialize()})
-    fav_planet = []
-    for favorite in user.fav_planet:
-        fav_planet.append(
-            {'reg_id': favorite.id, 'Planet': favorite.planet.serialize()})
-    fav_film = []
-    for favorite in user.fav_film:
-        fav_film.append(
-            {'reg_id': favorite.id, 'Film': favorite.film.serialize()})
-    favorites = [fav_char, fav_planet, fav_film]
+    # one joined select per requested kind instead of a lookup per favorite
+    favorites = []
+    for kind, (fav_model, model, label) in FAVORITE_KINDS.items():
+        if kind not in kinds:
+            continue
+        rows = db.session.query(fav_model.id, model).join(model).filter(
+            fav_model.user_id == id).order_by(fav_model.id).all()
+        favorites.append(
+            [{'reg_id': reg_id, label: item.serialize()} for reg_id, item in rows])
 
     return jsonify({'msg': 'ok', 'GETTED': favorites}), 200
 
 
+@app.route('/top/<kind>', methods=['GET'])
+@conditional('top:{kind}')
+@cached('top:{kind}')
+def get_top(kind):
+    if kind not in FAVORITE_KINDS:
+        return jsonify({'msg': f'kind must be any of: {", ".join(FAVORITE_KINDS)}'}), 404
+    model = FAVORITE_KINDS[kind][1]
+    limit, _ = page_args()
+    # read in order from ix_<table>_favorite_count_id
+    top = top_favorited(model, field_args(model), limit)
+    return jsonify({'msg': 'ok', 'GETTED': top}), 200
+
+
+# Graph traversals, answered from the in-memory index of graph.py
+
+def rows_by_id(model, ids, keys):
+    rows = db.session.query(*columns(model, keys)).filter(model.id.in_(ids))
+    return {row.id: dict(zip(keys, row)) for row in rows}
+
+
+@app.route('/character/<int:id>/costars', methods=['GET'])
+@conditional('graph', 'characters')
+def get_character_costars(id):
+    if not existing_ids(Character, [id]):
+        return jsonify({'msg': f'Character_id:{id}, not found'}), 404
+    limit, _ = page_args()
+    keys = field_args(Character)
+    shared = heapq.nsmallest(limit, get_graph().costars(id).items(),
+                             key=lambda item: (-item[1], item[0]))
+    found = rows_by_id(Character, [costar for costar, _ in shared], keys)
+    costars = [dict(found[costar], shared_films=count)
+               for costar, count in shared if costar in found]
+    return jsonify({'msg': 'ok', 'GETTED': costars}), 200
+
+
+@app.route('/character/<int:id>/path/<int:other_id>', methods=['GET'])
+@conditional('graph', 'characters', 'films')
+def get_character_path(id, other_id):
+    found = existing_ids(Character, [id, other_id])
+    missing = [i for i in (id, other_id) if i not in found]
+    if missing:
+        return jsonify({'msg': f'Character_id:{missing[0]}, not found'}), 404
+    try:
+        max_degrees = int(request.args.get('max_degrees', 6))
+    except ValueError:
+        raise APIException('max_degrees must be an integer')
+    if not 1 <= max_degrees <= MAX_DEGREES:
+        raise APIException(f'max_degrees must be between 1 and {MAX_DEGREES}')
+
+    path = get_graph().path(id, other_id, max_degrees)
+    if path is None:
+        return jsonify({'msg': f'No path of at most {max_degrees} shared films'}), 404
+    # the ids alternate character, film, character, ...
+    characters = rows_by_id(Character, path[::2], ['id', 'full_name'])
+    films = rows_by_id(Film, path[1::2], ['id', 'title', 'episode'])
+    steps = [{'character': characters.get(step)} if index % 2 == 0 else {'film': films.get(step)}
+             for index, step in enumerate(path)]
+    return jsonify({'msg': 'ok', 'GETTED': {'degrees': len(path) // 2, 'path': steps}}), 200
+
+
+@app.route('/film/<int:id>/natives', methods=['GET'])
+@conditional('graph', 'characters')
+def get_film_natives(id):
+    if not existing_ids(Film, [id]):
+        return jsonify({'msg': f'Film_id:{id}, not found'}), 404
+    limit, after = page_args()
+    keys = field_args(Character)
+    natives = get_graph().film_natives(id)
+    page = sorted(native for native in natives if native > after)[:limit + 1]
+    found = rows_by_id(Character, page[:limit], keys)
+    characters = [dict(found[native], planet_ids=sorted(natives[native]))
+                  for native in page[:limit] if native in found]
+    next_cursor = page[limit - 1] if len(page) > limit else None
+    return jsonify({'msg': 'ok', 'GETTED': characters, 'next_cursor': next_cursor}), 200
+
+
+@app.route('/search', methods=['GET'])
+@conditional('characters', 'planets', 'films')
+def get_search():
+    if get_backend() is None:
+        return jsonify({'msg': f'Search is not available on {db.engine.dialect.name}'}), 501
+    results, next_cursor = search_documents(*search_args())
+    return jsonify({'msg': 'ok', 'GETTED': results, 'next_cursor': next_cursor}), 200
+
+
 # POSTs
 
 @app.route('/user', methods=['POST'])
@@ -216,11 +388,12 @@ def post_user():
     new_user.is_active = True
     db.session.add(new_user)
     db.session.commit()
+    invalidate('users')
 
     return jsonify({'msg': 'ok', 'POSTED': new_user.serialize()}), 200
 
 
-@app.route('/user/<int:user_id>/favorites/character/<character_id>', methods=['POST'])
+@app.route('/user/<int:user_id>/favorites/character/<int:character_id>', methods=['POST'])
 def post_favorites_characters(user_id, character_id):
     user = User.query.get(user_id)
     if user is None or user.is_active is False:
@@ -229,21 +402,24 @@ def post_favorites_characters(user_id, character_id):
     if character is None:
         return jsonify({'msg': f'Character_id:{character_id}, not found'}), 404
 
-    favorited = Favorites_Characters.query.filter_by(
-        user_id=user_id, character_id=character_id).first()
-    if favorited:
-        return jsonify({'msg': f'Character: {character_id} already favorited'}), 400
-
     new_fav_char = Favorites_Characters()
     new_fav_char.user_id = user_id
     new_fav_char.character_id = character_id
     db.session.add(new_fav_char)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # uq_favorite_characters_user_id_character_id already holds this pair
+        db.session.rollback()
+        return jsonify({'msg': f'Character: {character_id} already favorited'}), 400
+    bump_favorite_counts(Character, {new_fav_char.character_id: 1})
     db.session.commit()
 
+    invalidate(f'character:{character_id}', f'favorites:{user_id}', 'top:characters')
     return jsonify({'msg': 'ok', 'POSTED': f'reg_id:{new_fav_char.id}, {new_fav_char}'}), 200
 
 
-@app.route('/user/<int:user_id>/favorites/planet/<planet_id>', methods=['POST'])
+@app.route('/user/<int:user_id>/favorites/planet/<int:planet_id>', methods=['POST'])
 def post_favorites_planets(user_id, planet_id):
     user = User.query.get(user_id)
     if user is None or user.is_active is False:
@@ -253,21 +429,24 @@ def post_favorites_planets(user_id, planet_id):
     if planet is None:
         return jsonify({'msg': f'Planet_id: {planet_id}, not found'}), 404
 
-    favorited = Favorites_Planets.query.filter_by(
-        user_id=user_id, planet_id=planet_id).first()
-    if favorited:
-        return jsonify({'msg': f'Planet: {planet_id} already favorited'}), 400
-
     new_fav_planet = Favorites_Planets()
     new_fav_planet.user_id = user_id
     new_fav_planet.planet_id = planet_id
     db.session.add(new_fav_planet)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # uq_favorite_planets_user_id_planet_id already holds this pair
+        db.session.rollback()
+        return jsonify({'msg': f'Planet: {planet_id} already favorited'}), 400
+    bump_favorite_counts(Planet, {new_fav_planet.planet_id: 1})
     db.session.commit()
 
+    invalidate(f'planet:{planet_id}', f'favorites:{user_id}', 'top:planets')
     return jsonify({'msg': 'ok', 'POSTED': f'reg_id:{new_fav_planet.id}, {new_fav_planet}'}), 200
 
 
-@app.route('/user/<int:user_id>/favorites/film/<film_id>', methods=['POST'])
+@app.route('/user/<int:user_id>/favorites/film/<int:film_id>', methods=['POST'])
 def post_favorites_films(user_id, film_id):
 
     user = User.query.get(user_id)
@@ -278,17 +457,20 @@ def post_favorites_films(user_id, film_id):
     if film is None:
         return jsonify({'msg': f'film_id:{film_id}, not fount'}), 404
 
-    favorited = Favorites_Films.query.filter_by(
-        user_id=user_id, film_id=film_id).first()
-    if favorited:
-        return jsonify({'msg': f'Film: {film_id} already favorited'}), 400
-
     new_fav_film = Favorites_Films()
     new_fav_film.user_id = user_id
     new_fav_film.film_id = film_id
     db.session.add(new_fav_film)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # uq_favorite_films_user_id_film_id already holds this pair
+        db.session.rollback()
+        return jsonify({'msg': f'Film: {film_id} already favorited'}), 400
+    bump_favorite_counts(Film, {new_fav_film.film_id: 1})
     db.session.commit()
 
+    invalidate(f'film:{film_id}', f'favorites:{user_id}', 'top:films')
     return jsonify({'msg': 'ok', 'POSTED': f'reg_id:{new_fav_film.id}, {new_fav_film}'}), 200
 
 
@@ -300,39 +482,40 @@ def post_character():
 
     new_character = Character()
 
-    required_fields = ['full_name']
-    for field in required_fields:
+    for field in Character.required_fields:
         if field not in body:
             return jsonify({'msg': f'Missing field: {field}, required!'}), 400
         else:
             setattr(new_character, field, body[field])
 
-    extra_fields = ['birth_year', 'gender', 'height_mts',
-                    'weight_kg', 'skin_tone', 'eye_color', 'hair_color']
     fields_missing = []
-    for field in extra_fields:
+    for field in Character.extra_fields:
         if field in body:
             setattr(new_character, field, body[field])
         else:
             fields_missing.append(field)
 
-    db.session.add(new_character)
-    
-    if 'home_planet' not in body:
-        fields_missing.append('appearance')
-    elif type(body['home_planet']) is not int:
+    home_planet = body.get('home_planet')
+    if home_planet is None:
+        fields_missing.append('home_planet')
+    elif type(home_planet) is not int:
         return jsonify({'mgs': 'home_planet must be a planet_id'}), 400
-    
-    if Planet.query.get(body['home_planet']) is None:
-        return jsonify({'mgs': f'planet_id:{body['home_planet']} not found'}), 400
-    else:
-        new_reg_app_planet = Natives_Planets()
-        new_reg_app_planet.character_id = new_character.id
-        new_reg_app_planet.planet_id = body['home_planet']
-        db.session.add(new_reg_app_planet)
-            
+    elif not existing_ids(Planet, [home_planet]):
+        return jsonify({'mgs': f'planet_id:{home_planet} not found', 'Missing_ids': {'home_planet': [home_planet]}}), 400
+
+    # flush once so the native row is written with the real character_id
+    db.session.add(new_character)
+    db.session.flush()
+    if home_planet is not None:
+        insert_links(Natives_Planets, [
+                     {'character_id': new_character.id, 'planet_id': home_planet}])
+    index_documents(Character, [new_character.id])
     db.session.commit()
 
+    invalidate(*character_namespaces(new_character.id))
+    if home_planet is not None:
+        graph_links_added(Natives_Planets, [
+            {'character_id': new_character.id, 'planet_id': home_planet}])
     return jsonify({'msg': 'ok', 'Filds_Missing': fields_missing, 'POSTED': new_character.serialize()}), 200
 
 
@@ -344,25 +527,25 @@ def post_planet():
 
     new_planet = Planet()
 
-    required_fields = ['name']
-    for field in required_fields:
+    for field in Planet.required_fields:
         if field not in body:
             return jsonify({'msg': f'Missing field: {field}, required!'}), 400
         else:
             setattr(new_planet, field, body[field])
 
-    extra_fields = ['climate', 'terrain', 'population_count', 'gravity',
-                    'diameter', 'water_surface', 'orbital_period', 'rotation_period']
     fields_missing = []
-    for field in extra_fields:
+    for field in Planet.extra_fields:
         if field in body:
             setattr(new_planet, field, body[field])
         else:
             fields_missing.append(field)
 
     db.session.add(new_planet)
+    db.session.flush()
+    index_documents(Planet, [new_planet.id])
     db.session.commit()
 
+    invalidate('planets', 'top:planets')
     return jsonify({'msg': 'ok', 'Filds_Missing': fields_missing, 'POSTED': new_planet.serialize()}), 200
 
 
@@ -374,51 +557,181 @@ def post_film():
 
     new_film = Film()
 
-    required_fields = ['title', 'episode']
-    for field in required_fields:
+    for field in Film.required_fields:
         if field not in body:
             return jsonify({'msg': f'Missing field: {field}, required!'}), 400
         else:
             setattr(new_film, field, body[field])
 
-    extra_fields = ['director', 'producer', 'release_date', 'opening_crawl']
     fields_missing = []
-    for field in extra_fields:
+    for field in Film.extra_fields:
         if field in body:
             setattr(new_film, field, body[field])
         else:
             fields_missing.append(field)
-    db.session.add(new_film)
 
-    feature_list=['feature_char','feature_planet']
-    for feat in feature_list:
+    # one IN query per referenced table instead of a lookup per id
+    features = {'feature_char': Character, 'feature_planet': Planet}
+    feature_ids = {}
+    missing_ids = {}
+    for feat, model in features.items():
         if feat not in body:
             fields_missing.append(feat)
-        elif type(body[feat]) is not list :
+        elif type(body[feat]) is not list or id_list(body[feat]) is None:
             return jsonify({'mgs': f'{feat} must be a list of ids'}), 400
+        feature_ids[feat] = id_list(body.get(feat))
+        found = existing_ids(model, feature_ids[feat])
+        missing = [id for id in feature_ids[feat] if id not in found]
+        if missing:
+            missing_ids[feat] = missing
+    if missing_ids:
+        return jsonify({'msg': 'Referenced ids not found', 'Missing_ids': missing_ids}), 400
 
-    for app in body['feature_planet']:
-        if Planet.query.get(app) is None:
-            return jsonify({'msg':f'Planet_id: {app} not found'}), 400
-        else:
-            new_reg = Appearance_Planets()
-            new_reg.planet_id = app
-            new_reg.film_id = new_film.id
-            db.session.add(new_reg)
-    
-    for app in body['feature_char']:
-        if Character.query.get(app) is None:
-            return jsonify({'msg':f'Character_id: {app} not found'}), 400
-        else:
-            new_reg = Appearance_Characters()
-            new_reg.character_id = app
-            new_reg.film_id = new_film.id
-            db.session.add(new_reg)        
-
+    db.session.add(new_film)
+    db.session.flush()
+    feature_char = [{'film_id': new_film.id, 'character_id': id} for id in feature_ids['feature_char']]
+    feature_planet = [{'film_id': new_film.id, 'planet_id': id} for id in feature_ids['feature_planet']]
+    insert_links(Appearance_Characters, feature_char)
+    insert_links(Appearance_Planets, feature_planet)
+    index_documents(Film, [new_film.id])
     db.session.commit()
 
+    invalidate(*film_namespaces(new_film.id))
+    graph_links_added(Appearance_Characters, feature_char)
+    graph_links_added(Appearance_Planets, feature_planet)
     return jsonify({'msg': 'ok', 'Filds_Missing': fields_missing, 'POSTED': new_film.serialize()}), 200
 
+# Batch POSTs
+
+def batch_records():
+    body = request.get_json(silent=True)
+    if not isinstance(body, list) or len(body) == 0:
+        raise APIException('Body must be a non empty list of records')
+    if len(body) > MAX_BATCH_SIZE:
+        raise APIException(f'Batch limited to {MAX_BATCH_SIZE} records')
+    return body
+
+
+@app.route('/characters/batch', methods=['POST'])
+def post_characters_batch():
+    records = batch_records()
+    rows, results = prepare_records(records, Character, 'full_name')
+    rows = check_references(records, rows, results, {'home_planet': Planet})
+
+    ids = insert_rows(Character, [row for _, row in rows], ['full_name'])
+    natives = []
+    for (index, _), id in zip(rows, ids):
+        results[index] = created(index, id)
+        for planet_id in id_list(records[index].get('home_planet')):
+            natives.append({'character_id': id, 'planet_id': planet_id})
+    insert_links(Natives_Planets, natives)
+    index_documents(Character, ids)
+    db.session.commit()
+
+    invalidate('characters', 'top:characters', *{f'planet:{native["planet_id"]}' for native in natives})
+    graph_links_added(Natives_Planets, natives)
+    return jsonify({'msg': 'ok', 'POSTED': results}), 200
+
+
+@app.route('/planets/batch', methods=['POST'])
+def post_planets_batch():
+    records = batch_records()
+    rows, results = prepare_records(records, Planet, 'name')
+
+    ids = insert_rows(Planet, [row for _, row in rows], ['name'])
+    for (index, _), id in zip(rows, ids):
+        results[index] = created(index, id)
+    index_documents(Planet, ids)
+    db.session.commit()
+
+    invalidate('planets', 'top:planets')
+    return jsonify({'msg': 'ok', 'POSTED': results}), 200
+
+
+@app.route('/films/batch', methods=['POST'])
+def post_films_batch():
+    records = batch_records()
+    rows, results = prepare_records(records, Film, 'title')
+    rows = check_references(records, rows, results, {
+                            'feature_char': Character, 'feature_planet': Planet})
+
+    ids = insert_rows(Film, [row for _, row in rows], ['title'])
+    feature_char = []
+    feature_planet = []
+    for (index, _), id in zip(rows, ids):
+        results[index] = created(index, id)
+        for character_id in id_list(records[index].get('feature_char')):
+            feature_char.append({'film_id': id, 'character_id': character_id})
+        for planet_id in id_list(records[index].get('feature_planet')):
+            feature_planet.append({'film_id': id, 'planet_id': planet_id})
+    insert_links(Appearance_Characters, feature_char)
+    insert_links(Appearance_Planets, feature_planet)
+    index_documents(Film, ids)
+    db.session.commit()
+
+    invalidate('films', 'top:films',
+               *{f'character:{app["character_id"]}' for app in feature_char},
+               *{f'planet:{app["planet_id"]}' for app in feature_planet})
+    graph_links_added(Appearance_Characters, feature_char)
+    graph_links_added(Appearance_Planets, feature_planet)
+    return jsonify({'msg': 'ok', 'POSTED': results}), 200
+
+
+@app.route('/user/<int:user_id>/favorites/batch', methods=['POST'])
+def post_favorites_batch(user_id):
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not set(body) <= set(FAVORITE_KINDS):
+        return jsonify({'msg': f'Body must map any of: {", ".join(FAVORITE_KINDS)} to lists of ids'}), 400
+    if sum(len(ids) for ids in body.values() if isinstance(ids, list)) > MAX_BATCH_SIZE:
+        return jsonify({'msg': f'Batch limited to {MAX_BATCH_SIZE} records'}), 400
+
+    user = User.query.get(user_id)
+    if user is None or user.is_active is False:
+        return jsonify({'msg': f'User_id:{user_id}, not found'}), 404
+
+    results = {}
+    namespaces = [f'favorites:{user_id}']
+    # the favorites are inserted as the statements run, so a concurrent
+    # request favoriting one of the ids fails them before the commit
+    try:
+        for kind, (fav_model, model, label) in FAVORITE_KINDS.items():
+            if kind not in body:
+                continue
+            ids = id_list(body[kind])
+            if ids is None:
+                db.session.rollback()
+                return jsonify({'msg': f'{kind} must be a list of ids'}), 400
+            column = getattr(fav_model, f'{label.lower()}_id')
+            found = existing_ids(model, ids)
+            favorited = {id for id, in db.session.query(column).filter(
+                fav_model.user_id == user_id, column.in_(ids))}
+
+            results[kind] = []
+            new_ids = []
+            for index, id in enumerate(ids):
+                if id not in found:
+                    results[kind].append(error(index, f'{label}_id:{id}, not found'))
+                elif id in favorited:
+                    results[kind].append(error(index, f'{label}: {id} already favorited'))
+                else:
+                    results[kind].append(None)
+                    new_ids.append((index, id))
+            reg_ids = insert_rows(fav_model, [
+                {'user_id': user_id, column.key: id} for _, id in new_ids], ['user_id', column.key])
+            for (index, id), reg_id in zip(new_ids, reg_ids):
+                results[kind][index] = created(index, reg_id)
+                namespaces.append(f'{label.lower()}:{id}')
+            if new_ids:
+                bump_favorite_counts(model, {id: 1 for _, id in new_ids})
+                namespaces.append(f'top:{kind}')
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'msg': 'Favorites changed while saving, retry the batch'}), 409
+
+    invalidate(*namespaces)
+    return jsonify({'msg': 'ok', 'POSTED': results}), 200
+
 # PUTs
 
 
@@ -437,6 +750,7 @@ def put_user_by(id):
     if 'password' in body:
         user.password = body['password']
     db.session.commit()
+    invalidate('users', f'user:{id}', *user_namespaces(id))
     updated_user_serialized = user.serialize()
     return jsonify({'msg': 'ok', 'PUT': updated_user_serialized}), 200
 
@@ -451,8 +765,7 @@ def put_character_by(id):
     if character is None:
         return jsonify({'msg': f'Character_id:{id}, not found'}), 404
 
-    fields = ['full_name', 'birth_year', 'gender', 'height_mts',
-              'weight_kg', 'skin_tone', 'eye_color', 'hair_color']
+    fields = Character.required_fields + Character.extra_fields
     fields_not_edited = []
     for field in fields:
         if field in body:
@@ -460,7 +773,9 @@ def put_character_by(id):
         else:
             fields_not_edited.append(field)
 
+    index_documents(Character, [id])
     db.session.commit()
+    invalidate(*character_namespaces(id))
 
     return jsonify({'msg': 'ok', 'Filds_not_edited': fields_not_edited, 'PUT': character.serialize()}), 200
 
@@ -475,8 +790,7 @@ def put_planet_by(id):
     if planet is None:
         return jsonify({'msg': f'planet_id:{id}, not found'}), 404
 
-    fields = ['name', 'climate', 'terrain', 'population_count', 'gravity',
-              'diameter', 'water_surface', 'orbital_period', 'rotation_period']
+    fields = Planet.required_fields + Planet.extra_fields
     fields_not_edited = []
     for field in fields:
         if field in body:
@@ -484,7 +798,9 @@ def put_planet_by(id):
         else:
             fields_not_edited.append(field)
 
+    index_documents(Planet, [id])
     db.session.commit()
+    invalidate(*planet_namespaces(id))
 
     return jsonify({'msg': 'ok', 'Filds_not_edited': fields_not_edited, 'PUT': planet.serialize()}), 200
 
@@ -499,8 +815,7 @@ def put_film_by(id):
     if film is None:
         return jsonify({'msg': f'Film_id:{id}, not found'}), 404
 
-    fields = ['title', 'episode', 'director',
-              'producer', 'release_date', 'opening_crawl']
+    fields = Film.required_fields + Film.extra_fields
     fields_not_edited = []
     for field in fields:
         if field in body:
@@ -508,7 +823,9 @@ def put_film_by(id):
         else:
             fields_not_edited.append(field)
 
+    index_documents(Film, [id])
     db.session.commit()
+    invalidate(*film_namespaces(id))
 
     return jsonify({'msg': 'ok', 'Filds_not_edited': fields_not_edited, 'PUT': film.serialize()}), 200
 
@@ -522,6 +839,7 @@ def delete_user_by(id):
         return jsonify({'msg': f'User_id:{id}, not found'}), 404
     not user.is_active
     db.session.commit()
+    invalidate('users', f'user:{id}')
     return jsonify({'msg': 'ok', 'DELETED': f'USER: {user.user_name}'}), 200
 
 
@@ -530,8 +848,12 @@ def delete_character_by(id):
     character = Character.query.get(id)
     if character is None:
         return jsonify({'msg': f'Character_id:{id}, not found'}), 404
+    namespaces = character_namespaces(id)
     db.session.delete(character)
+    remove_documents(Character, [id])
     db.session.commit()
+    invalidate(*namespaces)
+    graph_node_removed(Character, id)
     return jsonify({'msg': 'ok', 'DELETED': f'Character: {character.full_name}'}), 200
 
 
@@ -540,8 +862,12 @@ def delete_planet_by(id):
     planet = Planet.query.get(id)
     if planet is None:
         return jsonify({'msg': f'Planet_id:{id}, not found'}), 404
+    namespaces = planet_namespaces(id)
     db.session.delete(planet)
+    remove_documents(Planet, [id])
     db.session.commit()
+    invalidate(*namespaces)
+    graph_node_removed(Planet, id)
     return jsonify({'msg': 'ok', 'DELETED': f'Planet: {planet.name}'}), 200
 
 
@@ -551,8 +877,12 @@ def delete_film_by(id):
     if film is None:
         return jsonify({'msg': f'Film_id:{id}, not found'}), 404
 
+    namespaces = film_namespaces(id)
     db.session.delete(film)
+    remove_documents(Film, [id])
     db.session.commit()
+    invalidate(*namespaces)
+    graph_node_removed(Film, id)
     return jsonify({'msg': 'ok', 'DELETE': f'Film: Episode {film.episode}'}), 200
 
 
@@ -564,7 +894,10 @@ def delete_user_fav_char(reg_id):
     if favorite is None:
         return jsonify({'msg': f'Registre of Favorite_Characters: {reg_id} not found'}), 404
     db.session.delete(favorite)
+    bump_favorite_counts(Character, {favorite.character_id: -1})
     db.session.commit()
+    invalidate(f'character:{favorite.character_id}',
+               f'favorites:{favorite.user_id}', 'top:characters')
     return jsonify({'msg': 'ok', 'DELETED': f'Registre of Favorites_Characters: {reg_id}'}), 200
 
 
@@ -585,7 +918,9 @@ def delete_favorite_character_by(user_id, id):
         return jsonify({'msg': f'Favorite register not found for user_id:{user_id} {user.user_name} and character_id:{id} {character.full_name}'}), 404
 
     db.session.delete(fav_char)
+    bump_favorite_counts(Character, {id: -1})
     db.session.commit()
+    invalidate(f'character:{id}', f'favorites:{user_id}', 'top:characters')
 
     return jsonify({'msg': 'Favorite register deleted successfully', 'DELETED': f'Favorites_Characters_id: {fav_char.id}'}), 200
 
@@ -606,7 +941,9 @@ def delete_favorite_planet_by(user_id, id):
         return jsonify({'msg': f'Favorite register not found for user_id:{user_id} {user.user_name} and planet_id:{id} {planet.name}'}), 404
 
     db.session.delete(fav_planet)
+    bump_favorite_counts(Planet, {id: -1})
     db.session.commit()
+    invalidate(f'planet:{id}', f'favorites:{user_id}', 'top:planets')
 
     return jsonify({'msg': 'Favorite register deleted successfully', 'DELETED': f'Favorites_Planets_id: {fav_planet.id}'}), 200
 
@@ -627,7 +964,9 @@ def delete_favorite_film_by(user_id, id):
         return jsonify({'msg': f'Favorite register not found for user_id:{user_id} {user.user_name} and film_id:{id} Episode {film.episode}'}), 404
 
     db.session.delete(fav_film)
+    bump_favorite_counts(Film, {id: -1})
     db.session.commit()
+    invalidate(f'film:{id}', f'favorites:{user_id}', 'top:films')
 
     return jsonify({'msg': 'Favorite register deleted successfully', 'DELETED': f'Favorites_Films_id: {fav_film.id}'}), 200
 
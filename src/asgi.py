@@ -0,0 +1,205 @@
+"""
+Async serving mode for the read endpoints.
+
+The same GET routes as app.py, served by Starlette over SQLAlchemy's
+AsyncSession, so one worker keeps many requests in flight while they
+wait on the database:
+
+    gunicorn -k uvicorn.workers.UvicornWorker asgi:app --chdir ./src/ -w 4
+    uvicorn asgi:app --app-dir src --workers 4
+
+DATABASE_URL is shared with the sync app and mapped to its async driver
+(asyncpg for Postgres, aiosqlite for SQLite). Responses carry the same
+JSON as the sync endpoints; writes, the admin, the response cache and the
+replica routing stay on the Flask app, so route only reads here.
+"""
+import datetime
+import decimal
+import json
+import os
+import uuid
+from contextlib import asynccontextmanager
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.http import http_date
+from utils import APIException, STREAM_CHUNK_SIZE, page_args, listing, parse_fields
+from pool import engine_options
+from json_provider import orjson
+from models import columns, User, Character, Planet, Film, Favorites_Characters, Favorites_Planets, Favorites_Films
+
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+
+def async_url(uri):
+    url = make_url(uri.replace('postgres://', 'postgresql://'))
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+database_url = async_url(os.getenv('DATABASE_URL', 'sqlite:////tmp/test.db'))
+engine = create_async_engine(database_url, **engine_options(database_url))
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+
+def json_default(o):
+    # same conversions as Flask's default JSON provider
+    if isinstance(o, datetime.date):
+        return http_date(o)
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+
+def dumps(payload):
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload, default=json_default, option=(
+                orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SORT_KEYS)).decode()
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(payload, default=json_default, sort_keys=True, separators=(',', ':'))
+
+
+def jsonify(payload, status_code=200, headers=None):
+    return Response(dumps(payload) + '\n', status_code, headers, media_type='application/json')
+
+
+async def paginate(session, request, query, model):
+    limit, _ = page_args(request.query_params)
+    queries, cursor_of = listing(query, model, request.query_params)
+    rows = []
+    for query in queries:
+        rows += (await session.execute(query.limit(limit + 1 - len(rows)))).all()
+        if len(rows) > limit:
+            break
+    next_cursor = cursor_of(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def stream_ndjson(request, query, model, keys):
+    queries, _ = listing(query, model, request.query_params)
+
+    async def generate():
+        async with Session() as session:
+            for query in queries:
+                rows = await session.stream(query.execution_options(yield_per=STREAM_CHUNK_SIZE))
+                async for chunk in rows.partitions():
+                    yield ''.join(dumps(dict(zip(keys, row))) + '\n' for row in chunk)
+
+    return StreamingResponse(generate(), media_type='application/x-ndjson')
+
+
+def list_endpoint(model, *criteria):
+    async def endpoint(request):
+        keys = parse_fields(model, request.query_params.get('fields'))
+        query = select(*columns(model, keys)).where(*criteria)
+        if request.query_params.get('format') == 'ndjson':
+            return stream_ndjson(request, query, model, keys)
+        async with Session() as session:
+            rows, next_cursor = await paginate(session, request, query, model)
+        return jsonify({'msg': 'ok', 'GETTED': [dict(zip(keys, row)) for row in rows],
+                        'next_cursor': next_cursor})
+    return endpoint
+
+
+# response key -> (collection on the model, row on the association)
+DETAILS = {
+    Character: [('favorite_by', 'favorite_by', 'user'),
+                ('home_planet', 'home_planet', 'planet'),
+                ('appearances', 'appearance', 'film')],
+    Planet: [('favorite_by', 'favorite_by', 'user'),
+             ('natives', 'natives', 'character'),
+             ('appearances', 'appearance', 'film')],
+    Film: [('favorite_by', 'favorite_by', 'user'),
+           ('feature_char', 'feature_char', 'character'),
+           ('feature_planet', 'feature_planet', 'planet')],
+}
+
+
+def detail_endpoint(model, not_found, msg_key='msg'):
+    async def endpoint(request):
+        async with Session() as session:
+            item = await session.get(model, request.path_params['id'],
+                                     options=model.detail_options())
+        if item is None:
+            return jsonify({'msg': not_found}, 404)
+        serialized = item.serialize()
+        for key, collection, target in DETAILS[model]:
+            serialized[key] = [getattr(link, target).serialize()
+                               for link in getattr(item, collection)]
+        return jsonify({msg_key: 'ok', 'GETTED': serialized})
+    return endpoint
+
+
+async def get_user_by(request):
+    id = request.path_params['id']
+    async with Session() as session:
+        user = await session.get(User, id)
+    if user is None:
+        return jsonify({'msg': f'User_id:{id}, not found'}, 404)
+    return jsonify({'msg': 'ok', 'GETTED': user.serialize()})
+
+
+FAVORITE_KINDS = {
+    'characters': (Favorites_Characters, Character, 'Character'),
+    'planets': (Favorites_Planets, Planet, 'Planet'),
+    'films': (Favorites_Films, Film, 'Film'),
+}
+
+
+async def get_favorites_user(request):
+    id = request.path_params['id']
+    only = request.query_params.get('only')
+    kinds = list(FAVORITE_KINDS) if only is None else only.split(',')
+    for kind in kinds:
+        if kind not in FAVORITE_KINDS:
+            return jsonify({'msg': f'only must be any of: {", ".join(FAVORITE_KINDS)}'}, 400)
+
+    async with Session() as session:
+        if await session.get(User, id) is None:
+            return jsonify({'msg': f'User_id:{id}, not found'}, 404)
+        favorites = []
+        for kind, (fav_model, model, label) in FAVORITE_KINDS.items():
+            if kind not in kinds:
+                continue
+            rows = await session.execute(select(fav_model.id, model).join(model).where(
+                fav_model.user_id == id).order_by(fav_model.id))
+            favorites.append(
+                [{'reg_id': reg_id, label: item.serialize()} for reg_id, item in rows])
+    return jsonify({'msg': 'ok', 'GETTED': favorites})
+
+
+async def handle_invalid_usage(request, error):
+    return jsonify(error.to_dict(), error.status_code)
+
+
+async def handle_pool_timeout(request, error):
+    return jsonify({'msg': 'Database busy, retry later'}, 503, {'Retry-After': '1'})
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await engine.dispose()
+
+
+app = Starlette(
+    routes=[
+        Route('/users', list_endpoint(User, User.is_active.is_(True))),
+        Route('/user/{id:int}', get_user_by),
+        Route('/user/{id:int}/favorites', get_favorites_user),
+        Route('/characters', list_endpoint(Character)),
+        Route('/character/{id:int}', detail_endpoint(Character, 'Character not found')),
+        Route('/planets', list_endpoint(Planet)),
+        Route('/planet/{id:int}', detail_endpoint(Planet, 'Planet not found', msg_key='mgs')),
+        Route('/films', list_endpoint(Film)),
+        Route('/film/{id:int}', detail_endpoint(Film, 'Film not found')),
+    ],
+    exception_handlers={APIException: handle_invalid_usage,
+                        PoolTimeoutError: handle_pool_timeout},
+    lifespan=lifespan,
+)
@@ -0,0 +1,181 @@
+"""
+Helpers for the bulk write endpoints (/characters/batch, /planets/batch,
+/films/batch and /user/<id>/favorites/batch).
+
+Records are validated up front, a record with a value of the wrong type for
+its column getting an error of its own, every referenced id is resolved with IN
+queries, and the valid rows are inserted with one executemany per table
+inside the request's transaction.
+"""
+import datetime
+from sqlalchemy import insert, tuple_
+from models import db
+
+MAX_BATCH_SIZE = 1000
+# keeps IN lists under the bound-parameter limits of every backend
+IN_CHUNK_SIZE = 500
+
+
+def existing_values(column, values):
+    values = list(set(values))
+    found = set()
+    for start in range(0, len(values), IN_CHUNK_SIZE):
+        chunk = values[start:start + IN_CHUNK_SIZE]
+        found.update(value for value, in db.session.query(
+            column).filter(column.in_(chunk)))
+    return found
+
+
+def existing_ids(model, ids):
+    return existing_values(model.id, ids)
+
+
+def checked_value(column, value):
+    """`value` once it passes the column's null and length rules, which
+    the importer applies to file values too."""
+    if value is None:
+        if not column.nullable:
+            raise ValueError(f'{column.key} must not be null')
+        return None
+    length = getattr(column.type, 'length', None)
+    if length is not None and len(value) > length:
+        raise ValueError(f'{column.key} is limited to {length} characters')
+    return value
+
+
+def column_value(column, value):
+    """`value` from a JSON record as the column stores it. Unlike
+    utils.parse_value, which reads query-string text, it takes no
+    conversions between JSON types."""
+    python_type = column.type.python_type
+    if value is None:
+        return checked_value(column, value)
+    if python_type is datetime.date:
+        try:
+            return datetime.date.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'{column.key} expects YYYY-MM-DD dates')
+    # bool is an int in Python but not a number in a record
+    if type(value) is not python_type:
+        raise ValueError(f'{column.key} expects {python_type.__name__} values')
+    return checked_value(column, value)
+
+
+def record_values(record, model, fields):
+    return {field: column_value(getattr(model, field), record.get(field))
+            for field in fields}
+
+
+def prepare_records(records, model, unique_field):
+    """Checks each record for the model's required fields and for
+    clashes on `unique_field`, both inside the batch and in the table.
+
+    Returns (rows, results): rows holds (index, values) for every valid
+    record and results has an error dict at the index of each invalid one,
+    a value of the wrong type for its column included.
+    """
+    results = [None] * len(records)
+    candidates = [record.get(unique_field) for record in records
+                  if isinstance(record, dict) and isinstance(record.get(unique_field), str)]
+    taken = existing_values(getattr(model, unique_field), candidates)
+
+    rows = []
+    fields = model.required_fields + model.extra_fields
+    for index, record in enumerate(records):
+        if not isinstance(record, dict):
+            results[index] = error(index, 'record must be an object')
+            continue
+        missing = [field for field in model.required_fields if field not in record]
+        if missing:
+            results[index] = error(index, f'Missing field: {missing[0]}, required!')
+            continue
+        value = record[unique_field]
+        if not isinstance(value, str):
+            results[index] = error(index, f'{unique_field} must be a string')
+            continue
+        try:
+            values = record_values(record, model, fields)
+        except ValueError as e:
+            results[index] = error(index, str(e))
+            continue
+        if value in taken:
+            results[index] = error(index, f'{unique_field}: {value} already exists')
+            continue
+        taken.add(value)
+        rows.append((index, values))
+    return rows, results
+
+
+def id_list(value):
+    if value is None:
+        return []
+    if type(value) is int:
+        return [value]
+    if isinstance(value, list) and all(type(id) is int for id in value):
+        return list(dict.fromkeys(value))
+    return None
+
+
+def check_references(records, rows, results, references):
+    """Resolves the ids named by `references` ({field: model}) with one IN
+    query per model and drops the rows that point at missing ids. A field
+    may hold a single id or a list of ids."""
+    wanted = {field: set() for field in references}
+    for index, _ in rows:
+        for field in references:
+            wanted[field].update(id_list(records[index].get(field)) or ())
+    found = {field: existing_ids(model, wanted[field])
+             for field, model in references.items()}
+
+    valid = []
+    for index, row in rows:
+        for field in references:
+            ids = id_list(records[index].get(field))
+            if ids is None:
+                results[index] = error(index, f'{field} must be an id or a list of ids')
+                break
+            missing = [id for id in ids if id not in found[field]]
+            if missing:
+                results[index] = error(index, f'{field} ids not found: {missing}')
+                break
+        else:
+            valid.append((index, row))
+    return valid
+
+
+def insert_rows(model, rows, keys):
+    """Inserts row dicts with a single executemany and returns their new
+    ids in order, read back through the unique `keys` columns.
+
+    Ordered INSERT ... RETURNING degrades to one statement per row on
+    SQLite and is missing on MySQL, while a lookup by unique key stays one
+    query per IN chunk everywhere.
+    """
+    if not rows:
+        return []
+    db.session.execute(insert(model), rows)
+
+    columns = [getattr(model, key) for key in keys]
+    match = columns[0] if len(columns) == 1 else tuple_(*columns)
+    wanted = [tuple(row[key] for key in keys) for row in rows]
+    ids = {}
+    for start in range(0, len(wanted), IN_CHUNK_SIZE):
+        chunk = wanted[start:start + IN_CHUNK_SIZE]
+        if len(columns) == 1:
+            chunk = [value for value, in chunk]
+        for id, *values in db.session.query(model.id, *columns).filter(match.in_(chunk)):
+            ids[tuple(values)] = id
+    return [ids[value] for value in wanted]
+
+
+def insert_links(model, rows):
+    if rows:
+        db.session.execute(insert(model), rows)
+
+
+def error(index, msg):
+    return {'index': index, 'status': 'error', 'msg': msg}
+
+
+def created(index, id):
+    return {'index': index, 'status': 'created', 'id': id}
@@ -0,0 +1,236 @@
+"""
+Response cache for the read-only catalog endpoints.
+
+Entries hold the final serialized response bytes and are grouped by
+namespace ('characters', 'character:3', ...) so write handlers can drop
+every cached variant (query string) of an entity at once.
+
+Backends:
+- LRUCache: in-process, bounded by CACHE_MAX_ENTRIES and CACHE_TTL
+- RedisCache: shared between workers, enabled with CACHE_REDIS_URL
+  (needs the optional `redis` package, any Redis-protocol server works)
+
+The same namespaces carry version counters that write handlers bump, and
+GET views answer If-None-Match from them without touching the database.
+Local counters are per process, so their ETags also expire every
+CACHE_TTL seconds; run with CACHE_REDIS_URL when serving from several
+workers.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from flask import request, current_app, make_response
+from utils import wants_ndjson
+
+
+class LRUCache:
+    def __init__(self, max_entries=1024, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._namespaces = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, namespace, variant):
+        key = (namespace, variant)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, namespace, variant, value):
+        key = (namespace, variant)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            self._namespaces.setdefault(namespace, set()).add(variant)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, *namespaces):
+        with self._lock:
+            for namespace in namespaces:
+                for variant in self._namespaces.pop(namespace, ()):
+                    self._entries.pop((namespace, variant), None)
+
+    def _drop(self, key):
+        del self._entries[key]
+        variants = self._namespaces[key[0]]
+        variants.discard(key[1])
+        if not variants:
+            del self._namespaces[key[0]]
+
+    def stats(self):
+        return {
+            'backend': 'lru',
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class RedisCache:
+    # one hash per namespace: field = variant, value = response bytes
+    prefix = 'cache:'
+
+    def __init__(self, client, ttl=60):
+        self.client = client
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, namespace, variant):
+        value = self.client.hget(self.prefix + namespace, variant)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, namespace, variant, value):
+        pipe = self.client.pipeline()
+        pipe.hset(self.prefix + namespace, variant, value)
+        pipe.expire(self.prefix + namespace, self.ttl)
+        pipe.execute()
+
+    def invalidate(self, *namespaces):
+        if namespaces:
+            self.client.delete(*[self.prefix + ns for ns in namespaces])
+
+    def stats(self):
+        return {
+            'backend': 'redis',
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.client.info('stats').get('evicted_keys', 0),
+        }
+
+
+class LocalVersions:
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.token = uuid.uuid4().hex[:8]
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def bump(self, *namespaces):
+        with self._lock:
+            for namespace in namespaces:
+                self._versions[namespace] = self._versions.get(namespace, 0) + 1
+
+    def version(self, namespace):
+        return self._versions.get(namespace, 0)
+
+    def etag(self, namespaces):
+        versions = '.'.join(str(self._versions.get(ns, 0)) for ns in namespaces)
+        return f'{self.token}.{int(time.time() // self.ttl)}.{versions}'
+
+
+class RedisVersions:
+    prefix = 'version:'
+
+    def __init__(self, client):
+        self.client = client
+        # survives worker restarts, changes if the counters are ever lost
+        self.client.set(self.prefix + 'epoch', uuid.uuid4().hex[:8], nx=True)
+
+    def bump(self, *namespaces):
+        if namespaces:
+            pipe = self.client.pipeline(transaction=False)
+            for namespace in namespaces:
+                pipe.incr(self.prefix + namespace)
+            pipe.execute()
+
+    def version(self, namespace):
+        return int(self.client.get(self.prefix + namespace) or 0)
+
+    def etag(self, namespaces):
+        keys = [self.prefix + 'epoch'] + [self.prefix + ns for ns in namespaces]
+        values = self.client.mget(keys)
+        return '.'.join((v or b'0').decode() for v in values)
+
+
+def get_cache():
+    return current_app.extensions['response_cache']
+
+
+def get_versions():
+    return current_app.extensions['response_versions']
+
+
+def conditional(*namespaces):
+    """Tags 200 responses with an ETag built from the version counters of
+    `namespaces` and answers a matching If-None-Match with 304 before the
+    view runs."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            etag = get_versions().etag(
+                [ns.format(**kwargs) for ns in namespaces])
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+                response.set_etag(etag)
+                return response
+            response = make_response(view(**kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
+
+
+def cached(namespace):
+    """Caches successful JSON responses of a GET view under `namespace`,
+    formatted with the view arguments, e.g. 'character:{id}'."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if wants_ndjson():
+                return view(**kwargs)
+            cache = get_cache()
+            ns = namespace.format(**kwargs)
+            variant = request.query_string.decode()
+            body = cache.get(ns, variant)
+            if body is not None:
+                return current_app.response_class(body, mimetype='application/json')
+            response = make_response(view(**kwargs))
+            if response.status_code == 200:
+                cache.set(ns, variant, response.get_data())
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidate(*namespaces):
+    get_cache().invalidate(*namespaces)
+    get_versions().bump(*namespaces)
+
+
+def setup_cache(app):
+    ttl = int(os.getenv('CACHE_TTL', 60))
+    redis_url = os.getenv('CACHE_REDIS_URL')
+    if redis_url:
+        import redis
+        client = redis.Redis.from_url(redis_url)
+        cache = RedisCache(client, ttl=ttl)
+        versions = RedisVersions(client)
+    else:
+        cache = LRUCache(int(os.getenv('CACHE_MAX_ENTRIES', 1024)), ttl=ttl)
+        versions = LocalVersions(ttl=ttl)
+    app.extensions['response_cache'] = cache
+    app.extensions['response_versions'] = versions
@@ -0,0 +1,328 @@
+"""
+In-memory index of the character-film-planet graph formed by the
+appearance and natives link tables, for the traversal endpoints:
+
+    GET /character/<id>/costars          characters sharing films with it
+    GET /character/<id>/path/<other_id>  fewest shared films between two
+    GET /film/<id>/natives               natives of the film's planets
+
+Each link table is held in both directions as adjacency lists in
+compressed sparse row form: one array('i') of offsets indexed by id and
+one of neighbour ids, about 8 bytes per link and 4 per id. Changes since
+the last rebuild of an adjacency live in a small overlay of per-id
+arrays and are folded back in once it exceeds GRAPH_OVERLAY_LIMIT ids.
+
+The index is loaded when a gunicorn worker starts (see gunicorn.conf.py)
+or else on first use. The write handlers in app.py apply their link
+changes to it after committing. Each of those changes and any other
+change to the links (the admin, `flask import`) bumps the 'graph'
+version namespace of the response cache; a process whose index was not
+the one that made the latest change reloads it before answering. Run
+with CACHE_REDIS_URL when serving from several workers so they see each
+other's versions at once.
+
+Without Redis each process only sees its own versions, so every
+GRAPH_RECHECK_SECONDS (30, 0 to turn off) a request first compares the
+row count and highest id of each link table with those the index was
+loaded at, and drops the index and bumps the version when they moved:
+links added or deleted by other workers, `flask import` or the admin of
+another process. A link edited in place there is only seen through the
+versions.
+"""
+import os
+import threading
+import time
+from array import array
+from collections import Counter
+from flask import current_app
+from sqlalchemy import select, func
+from cache import get_versions, invalidate
+from models import db, Character, Planet, Film, Natives_Planets, Appearance_Characters, Appearance_Planets
+
+# link model -> (left column, right column), in the order of its unique
+# index so the loading query reads the index instead of sorting
+LINKS = {
+    Appearance_Characters: ('character_id', 'film_id'),
+    Appearance_Planets: ('planet_id', 'film_id'),
+    Natives_Planets: ('character_id', 'planet_id'),
+}
+NODE_COLUMNS = {Character: 'character_id', Planet: 'planet_id', Film: 'film_id'}
+OVERLAY_LIMIT = int(os.getenv('GRAPH_OVERLAY_LIMIT', 10000))
+LOAD_CHUNK_SIZE = 10000
+MAX_DEGREES = 12
+RECHECK_SECONDS = float(os.getenv('GRAPH_RECHECK_SECONDS', 30))
+EMPTY = array('i')
+
+
+class Adjacency:
+    """Sorted neighbour ids per id, built from the arrays of the two ends
+    of each link; targets must be ascending among links of one source."""
+
+    def __init__(self, sources, targets):
+        self.rows = self.build(sources, targets)
+        self.overlay = {}
+
+    @staticmethod
+    def build(sources, targets):
+        # counting sort by source, which keeps the order of the targets
+        size = max(sources, default=-1) + 2
+        offsets = array('i', bytes(4 * size))
+        for source in sources:
+            offsets[source + 1] += 1
+        for id in range(1, size):
+            offsets[id] += offsets[id - 1]
+        ordered = array('i', bytes(4 * len(targets)))
+        free = offsets[:-1]
+        for source, target in zip(sources, targets):
+            ordered[free[source]] = target
+            free[source] += 1
+        return offsets, ordered
+
+    def __getitem__(self, source):
+        changed = self.overlay.get(source)
+        if changed is not None:
+            return changed
+        # one read of the pair, which compact() swaps as a whole
+        offsets, targets = self.rows
+        if 0 <= source < len(offsets) - 1:
+            return targets[offsets[source]:offsets[source + 1]]
+        return EMPTY
+
+    def add(self, source, target):
+        current = self[source]
+        if target not in current:
+            self.set(source, sorted([*current, target]))
+
+    def remove(self, source, target):
+        current = self[source]
+        if target in current:
+            self.set(source, [id for id in current if id != target])
+
+    def set(self, source, targets):
+        self.overlay[source] = array('i', targets)
+        if len(self.overlay) > OVERLAY_LIMIT:
+            self.compact()
+
+    def compact(self):
+        sources, targets = array('i'), array('i')
+        for id in range(max(len(self.rows[0]) - 1, max(self.overlay) + 1)):
+            neighbours = self[id]
+            sources.extend([id] * len(neighbours))
+            targets.extend(neighbours)
+        self.rows = self.build(sources, targets)
+        self.overlay = {}
+
+
+class Link:
+    """One link table in both directions."""
+
+    def __init__(self, model):
+        # one pass over the unique index through the DBAPI cursor, which
+        # is several times faster than ORM rows at a million links
+        quote = db.engine.dialect.identifier_preparer.quote
+        left, right = (quote(column) for column in LINKS[model])
+        cursor = db.session.connection().connection.dbapi_connection.cursor()
+        cursor.execute(f'SELECT {left}, {right} FROM {quote(model.__tablename__)} ORDER BY {left}, {right}')
+        lefts, rights = array('i'), array('i')
+        while rows := cursor.fetchmany(LOAD_CHUNK_SIZE):
+            for pair in rows:
+                lefts.append(pair[0])
+                rights.append(pair[1])
+        cursor.close()
+        self.forward = Adjacency(lefts, rights)
+        self.backward = Adjacency(rights, lefts)
+
+    def add(self, left, right):
+        self.forward.add(left, right)
+        self.backward.add(right, left)
+
+    def remove(self, left, right):
+        self.forward.remove(left, right)
+        self.backward.remove(right, left)
+
+    def drop(self, adjacency, id):
+        # removes every link of `id`, a node on the side `adjacency` maps from
+        other = self.backward if adjacency is self.forward else self.forward
+        for neighbour in adjacency[id]:
+            other.remove(neighbour, id)
+        adjacency.set(id, [])
+
+
+def link_signature():
+    """(row count, highest id) of every link table, in one statement
+    that reads the end of each primary key and a count of its smallest
+    index."""
+    columns = []
+    for model in LINKS:
+        columns.append(select(func.count()).select_from(model).scalar_subquery())
+        columns.append(select(func.max(model.id)).scalar_subquery())
+    return tuple(db.session.execute(select(*columns)).one())
+
+
+class Graph:
+    def __init__(self, version):
+        self.version = version
+        # read first, in the loading transaction, so a change committed
+        # while loading shows up at the next recheck
+        self.signature = link_signature()
+        self.checked = time.monotonic()
+        self.links = {model: Link(model) for model in LINKS}
+        appearances = self.links[Appearance_Characters]
+        self.films_of = appearances.forward
+        self.characters_in = appearances.backward
+        self.planets_in = self.links[Appearance_Planets].backward
+        self.natives_of = self.links[Natives_Planets].backward
+
+    def changed_elsewhere(self):
+        """Whether the link tables moved since the last check, at most
+        once every RECHECK_SECONDS."""
+        if not RECHECK_SECONDS or time.monotonic() - self.checked < RECHECK_SECONDS:
+            return False
+        self.checked = time.monotonic()
+        return link_signature() != self.signature
+
+    def add_links(self, model, rows):
+        left, right = LINKS[model]
+        link = self.links[model]
+        for row in rows:
+            link.add(row[left], row[right])
+
+    def remove_node(self, model, id):
+        column = NODE_COLUMNS[model]
+        for link_model, (left, right) in LINKS.items():
+            link = self.links[link_model]
+            if left == column:
+                link.drop(link.forward, id)
+            if right == column:
+                link.drop(link.backward, id)
+
+    def costars(self, id):
+        """Counter of character id -> films shared with character `id`."""
+        shared = Counter()
+        for film in self.films_of[id]:
+            shared.update(self.characters_in[film])
+        shared.pop(id, None)
+        return shared
+
+    def path(self, start, goal, max_degrees):
+        """The ids [character, film, character, ..., character] of a
+        shortest chain of shared films from `start` to `goal`, searching
+        from both ends, or None if there is none within `max_degrees`
+        films."""
+        if start == goal:
+            return [start]
+        # character -> (film, character it was reached from), per side
+        parents = ({start: None}, {goal: None})
+        expanded = (set(), set())
+        frontiers = [[start], [goal]]
+        for _ in range(max_degrees):
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            reached, other = parents[side], parents[1 - side]
+            frontier = []
+            for character in frontiers[side]:
+                for film in self.films_of[character]:
+                    if film in expanded[side]:
+                        continue
+                    expanded[side].add(film)
+                    for costar in self.characters_in[film]:
+                        if costar in reached:
+                            continue
+                        reached[costar] = (film, character)
+                        if costar in other:
+                            return chain(parents[0], costar)[::-1] + chain(parents[1], costar)[1:]
+                        frontier.append(costar)
+            if not frontier:
+                return None
+            frontiers[side] = frontier
+        return None
+
+    def film_natives(self, id):
+        """character id -> ids of the film's planets it is native to."""
+        natives = {}
+        for planet in self.planets_in[id]:
+            for character in self.natives_of[planet]:
+                natives.setdefault(character, []).append(planet)
+        return natives
+
+
+def chain(parents, character):
+    ids = [character]
+    while parents[character] is not None:
+        film, character = parents[character]
+        ids += [film, character]
+    return ids
+
+
+def get_graph():
+    """The index, reloaded first if a change it did not make has bumped
+    the 'graph' version since."""
+    state = current_app.extensions['graph']
+    version = get_versions().version('graph')
+    graph = state['graph']
+    if graph is None or graph.version != version:
+        with state['lock']:
+            graph = state['graph']
+            if graph is None or graph.version != version:
+                graph = state['graph'] = Graph(version)
+                # the loading queries must not hold the session's
+                # transaction open for the rest of the request
+                db.session.rollback()
+    return graph
+
+
+def recheck_graph():
+    """Drops the index and bumps the 'graph' version when the link tables
+    moved without it, before the request so that ETags built from the
+    version change too."""
+    state = current_app.extensions['graph']
+    graph = state['graph']
+    if graph is not None and graph.changed_elsewhere():
+        with state['lock']:
+            if state['graph'] is graph:
+                state['graph'] = None
+        invalidate('graph')
+
+
+def update_graph(apply):
+    """Applies a committed link change to the loaded index with
+    apply(graph) and bumps the 'graph' version. An index that had missed
+    other changes is left stale, to be reloaded on its next use."""
+    state = current_app.extensions['graph']
+    versions = get_versions()
+    with state['lock']:
+        graph = state['graph']
+        seen = versions.version('graph')
+        versions.bump('graph')
+        if graph is None:
+            return
+        if graph.version != seen:
+            state['graph'] = None
+            return
+        apply(graph)
+        graph.version = seen + 1
+        # the change is in, so it must not trigger a reload at the next
+        # recheck; a change committed by another process just before it
+        # is missed until the tables move again
+        if RECHECK_SECONDS:
+            graph.signature = link_signature()
+
+
+def graph_links_added(model, rows):
+    if rows:
+        update_graph(lambda graph: graph.add_links(model, rows))
+
+
+def graph_node_removed(model, id):
+    update_graph(lambda graph: graph.remove_node(model, id))
+
+
+def preload_graph(app):
+    with app.app_context():
+        get_graph()
+        db.session.remove()
+
+
+def setup_graph(app):
+    app.extensions['graph'] = {'graph': None, 'lock': threading.Lock()}
+    if RECHECK_SECONDS:
+        app.before_request(recheck_graph)
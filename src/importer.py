@@ -0,0 +1,341 @@
+"""
+Bulk loads of the catalog from CSV or NDJSON files:
+
+    flask import planets planets.csv
+    flask import characters characters.ndjson
+    flask import natives natives.csv
+    flask import all ./dump
+
+Catalog rows are upserted on their unique name (planet name, character
+full_name, film title), so importing a file twice leaves the tables as
+after the first time. Link rows name both ends, e.g. a natives row is
+{"character": "Luke Skywalker", "planet": "Tatooine"}; the names are
+resolved through in-memory maps of the target tables and links that
+already exist are left alone. Rows that fail to parse or name an unknown
+row are skipped and reported.
+
+PostgreSQL loads each chunk with COPY into a temporary table and one
+INSERT ... SELECT ... ON CONFLICT from it; SQLite uses an executemany of
+INSERT ... ON CONFLICT. Every chunk commits on its own, so an
+interrupted import can simply be run again; the secondary indexes a load
+into an empty table drops are created again when it fails, or at the
+start of the next run when it was killed. Search documents of the
+imported rows are rewritten at the end, and link imports bump the
+version that makes servers reload their traversal index (graph.py).
+"""
+import csv
+import datetime
+import io
+import itertools
+import json
+import os
+import time
+import click
+from flask.cli import AppGroup
+from sqlalchemy import inspect, select
+from cache import invalidate
+from batch import checked_value
+from namespaces import character_namespaces, planet_namespaces, film_namespaces
+from search import REINDEX_CHUNK_SIZE, get_backend, index_documents
+from models import db, Character, Planet, Film, Natives_Planets, Appearance_Characters, Appearance_Planets
+
+# kind -> (model, unique column), in load order
+CATALOG = {
+    'planets': (Planet, 'name'),
+    'characters': (Character, 'full_name'),
+    'films': (Film, 'title'),
+}
+# kind -> (link model, {file field: (target model, its unique column)});
+# each file field is stored in the <field>_id column
+LINKS = {
+    'natives': (Natives_Planets, {'character': (Character, 'full_name'), 'planet': (Planet, 'name')}),
+    'character-appearances': (Appearance_Characters, {'character': (Character, 'full_name'), 'film': (Film, 'title')}),
+    'planet-appearances': (Appearance_Planets, {'planet': (Planet, 'name'), 'film': (Film, 'title')}),
+}
+DETAIL_NAMESPACES = {Character: 'character', Planet: 'planet', Film: 'film'}
+# what an update to existing rows makes stale, as for the API's writes
+NAMESPACES = {Character: character_namespaces, Planet: planet_namespaces, Film: film_namespaces}
+FORMATS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', 20000))
+MAX_REPORTED = 10
+
+
+def file_format(path, format=None):
+    format = format or FORMATS.get(os.path.splitext(path)[1].lower())
+    if format is None:
+        raise click.ClickException(f'{path}: pass --format, the extension is not one of {", ".join(FORMATS)}')
+    return format
+
+
+def read_records(path, format):
+    """Yields (line, record) from a CSV file with a header row or an
+    NDJSON file with one object per line."""
+    with open(path, newline='') as f:
+        if format == 'csv':
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record
+            return
+        for line, text in enumerate(f, 1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError:
+                record = None
+            yield line, record
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def key_map(model, key):
+    return {name: id for name, id in db.session.execute(select(getattr(model, key), model.id))}
+
+
+def drop_secondary_indexes(model):
+    """Loading an empty table and building its indexes once afterwards is
+    several times faster than maintaining them row by row. The unique
+    indexes stay, ON CONFLICT needs them."""
+    indexes = [index for index in model.__table__.indexes if not index.unique]
+    for index in indexes:
+        index.drop(db.session.connection())
+    db.session.commit()
+    return indexes
+
+
+def create_indexes(indexes):
+    for index in indexes:
+        index.create(db.session.connection())
+    db.session.commit()
+
+
+def restore_indexes(model):
+    """Creates the secondary indexes of `model` that a run killed before
+    it could recreate them left missing."""
+    present = {index['name'] for index in inspect(db.session.connection()).get_indexes(model.__tablename__)}
+    create_indexes([index for index in model.__table__.indexes
+                    if not index.unique and index.name not in present])
+
+
+class Progress:
+    def __init__(self, kind, path):
+        self.kind, self.path = kind, path
+        self.loaded = self.skipped = 0
+        self.started = time.perf_counter()
+
+    def skip(self, line, msg):
+        if self.skipped < MAX_REPORTED:
+            click.echo(f'{self.path}:{line}: {msg}, skipped', err=True)
+        self.skipped += 1
+
+    def chunk(self, rows):
+        self.loaded += rows
+        click.echo(f'{self.kind}: {self.loaded} rows', err=True)
+
+    def done(self):
+        click.echo(f'{self.kind}: {self.loaded} rows loaded, {self.skipped} skipped'
+                   f' in {time.perf_counter() - self.started:.1f}s')
+
+
+def upsert_sql(table, columns, conflict, update, source):
+    quote = db.engine.dialect.identifier_preparer.quote
+    action = 'DO NOTHING' if not update else 'DO UPDATE SET ' + ', '.join(
+        f'{quote(column)} = excluded.{quote(column)}' for column in update)
+    return (f'INSERT INTO {quote(table.name)} ({", ".join(quote(column) for column in columns)})'
+            f' {source} ON CONFLICT ({", ".join(quote(column) for column in conflict)}) {action}')
+
+
+def upsert(model, rows, columns, conflict, update):
+    """Upserts `rows`, lists of values for `columns`, through the DBAPI
+    cursor: SQLAlchemy's per-row parameter handling would cost more than
+    the inserts themselves."""
+    table = model.__table__
+    dialect = db.engine.dialect
+    if dialect.name not in ('postgresql', 'sqlite'):
+        raise click.ClickException(f'Imports need PostgreSQL or SQLite, not {dialect.name}')
+    # one row per conflict key, which ON CONFLICT DO UPDATE requires
+    positions = [columns.index(column) for column in conflict]
+    rows = list({tuple(row[i] for i in positions): row for row in rows}.values())
+    cursor = db.session.connection().connection.dbapi_connection.cursor()
+    quote = dialect.identifier_preparer.quote
+    names = ', '.join(quote(column) for column in columns)
+
+    if hasattr(cursor, 'copy_expert'):
+        # psycopg2: COPY into a temporary table, upsert from there
+        staging = quote(f'import_{table.name}')
+        cursor.execute(f'CREATE TEMP TABLE {staging} ON COMMIT DROP AS'
+                       f' SELECT {names} FROM {quote(table.name)} WITH NO DATA')
+        # empty values were read as None, which unquoted empty CSV fields
+        # load as NULL
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(f'COPY {staging} ({names}) FROM STDIN WITH (FORMAT csv)', buffer)
+        cursor.execute(upsert_sql(table, columns, conflict, update, f'SELECT {names} FROM {staging}'))
+        return
+    placeholder = '?' if dialect.paramstyle == 'qmark' else '%s'
+    values = f'VALUES ({", ".join([placeholder] * len(columns))})'
+    cursor.executemany(upsert_sql(table, columns, conflict, update, values), rows)
+
+
+def converters(model, fields):
+    """field -> function turning a non-empty file value into its column
+    value or raising ValueError. Dates are passed on as ISO strings."""
+    def converter(field):
+        python_type = getattr(model, field).type.python_type
+        if python_type is str:
+            return str
+        parse = python_type
+        if python_type is datetime.date:
+            def parse(value):
+                return datetime.date.fromisoformat(value).isoformat()
+
+        def convert(value):
+            try:
+                return parse(value)
+            except (TypeError, ValueError):
+                raise ValueError(f'{field} expects {python_type.__name__} values')
+        return convert
+    return {field: converter(field) for field in fields}
+
+
+def parse_record(model, convert, record):
+    """The model fields of `record` as column values; raises ValueError
+    naming the first problem. Nulls and lengths follow the rules of the
+    batch endpoints."""
+    if not isinstance(record, dict):
+        raise ValueError('not a JSON object')
+    row = {}
+    for field, converter in convert.items():
+        if field in record:
+            value = record[field]
+            value = None if value == '' or value is None else converter(value)
+            row[field] = checked_value(getattr(model, field), value)
+    for field in model.required_fields:
+        if row.get(field) is None:
+            raise ValueError(f'missing {field}')
+    return row
+
+
+def import_catalog(kind, path, format, maps):
+    model, key = CATALOG[kind]
+    fields = model.required_fields + model.extra_fields
+    convert = converters(model, fields)
+    existing = maps.pop(model, None) or key_map(model, key)
+    progress = Progress(kind, path)
+    keys = {}
+    restore_indexes(model)
+    deferred = [] if existing else drop_secondary_indexes(model)
+
+    try:
+        for chunk in chunked(read_records(path, format), IMPORT_CHUNK_SIZE):
+            rows = []
+            for line, record in chunk:
+                try:
+                    rows.append(parse_record(model, convert, record))
+                except ValueError as e:
+                    progress.skip(line, str(e))
+            if not rows:
+                continue
+            # fields no record of the chunk carries keep their stored values
+            columns = [field for field in fields if any(field in row for row in rows)]
+            for row in rows:
+                keys[row[key]] = None
+            upsert(model, [[row.get(column) for column in columns] for row in rows],
+                   columns, [key], [column for column in columns if column != key])
+            db.session.commit()
+            progress.chunk(len(rows))
+    finally:
+        # also when a chunk fails, whose rows the rollback discards
+        db.session.rollback()
+        create_indexes(deferred)
+    maps[model] = ids = key_map(model, key)
+    if get_backend() is not None:
+        for id_chunk in chunked((ids[name] for name in keys), REINDEX_CHUNK_SIZE):
+            index_documents(model, id_chunk)
+            db.session.commit()
+    invalidate(kind, f'top:{kind}', *NAMESPACES[model](*(existing[name] for name in keys if name in existing)))
+    progress.done()
+
+
+def import_links(kind, path, format, maps):
+    model, ends = LINKS[kind]
+    for target, key in ends.values():
+        if target not in maps:
+            maps[target] = key_map(target, key)
+    columns = [f'{field}_id' for field in ends]
+    details = [DETAIL_NAMESPACES[target] for target, _ in ends.values()]
+    progress = Progress(kind, path)
+    namespaces = set()
+    restore_indexes(model)
+    empty = db.session.query(model.id).first() is None
+    deferred = drop_secondary_indexes(model) if empty else []
+
+    try:
+        for chunk in chunked(read_records(path, format), IMPORT_CHUNK_SIZE):
+            rows = []
+            for line, record in chunk:
+                if not isinstance(record, dict):
+                    progress.skip(line, 'not a JSON object')
+                    continue
+                row = []
+                for field, (target, _) in ends.items():
+                    id = maps[target].get(record.get(field))
+                    if id is None:
+                        progress.skip(line, f'{field} not found: {record.get(field)!r}')
+                        break
+                    row.append(id)
+                else:
+                    rows.append(row)
+            if not rows:
+                continue
+            upsert(model, rows, columns, columns, [])
+            db.session.commit()
+            progress.chunk(len(rows))
+            for detail, ids in zip(details, zip(*rows)):
+                namespaces.update(f'{detail}:{id}' for id in set(ids))
+    finally:
+        db.session.rollback()
+        create_indexes(deferred)
+    invalidate('graph', *namespaces)
+    progress.done()
+
+
+import_cli = AppGroup('import', help='Bulk load the catalog from CSV or NDJSON files.')
+
+
+def add_import_command(kind, load):
+    @import_cli.command(kind, help=f'Load {kind} from PATH (.csv or .ndjson).')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', type=click.Choice(['csv', 'ndjson']), help='Override the extension.')
+    def command(path, format):
+        load(kind, path, file_format(path, format), {})
+
+
+for kind in CATALOG:
+    add_import_command(kind, import_catalog)
+for kind in LINKS:
+    add_import_command(kind, import_links)
+
+
+@import_cli.command('all')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+def import_all_command(directory):
+    """Load every <kind>.csv or <kind>.ndjson file of DIRECTORY, catalog
+    tables first."""
+    maps = {}
+    for kind in [*CATALOG, *LINKS]:
+        for extension, format in FORMATS.items():
+            path = os.path.join(directory, kind + extension)
+            if os.path.exists(path):
+                load = import_catalog if kind in CATALOG else import_links
+                load(kind, path, format, maps)
+                break
+
+
+def setup_importer(app):
+    app.cli.add_command(import_cli)
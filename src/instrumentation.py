@@ -0,0 +1,84 @@
+"""
+Opt-in per-request SQL instrumentation.
+
+Enable with SQL_INSTRUMENTATION=1. Every request then gets a
+Server-Timing header with its statement count and database time, and
+requests over SLOW_REQUEST_MS or SLOW_REQUEST_QUERIES are logged with
+their SQL_TOP_STATEMENTS slowest statements. Statements slower than
+SLOW_QUERY_MS are logged on their own. When disabled nothing is hooked,
+so there is no per-request cost.
+"""
+import heapq
+import os
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from utils import truthy
+from replicas import replica_engines
+
+
+class Settings:
+    def __init__(self):
+        self.slow_request_ms = float(os.getenv('SLOW_REQUEST_MS', 500))
+        self.slow_request_queries = int(os.getenv('SLOW_REQUEST_QUERIES', 50))
+        self.slow_query_ms = float(os.getenv('SLOW_QUERY_MS', 100))
+        self.top_statements = int(os.getenv('SQL_TOP_STATEMENTS', 3))
+
+
+def instrument_engine(app, engine, settings):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = (time.perf_counter() - conn.info['query_start'].pop()) * 1000
+        if elapsed > settings.slow_query_ms:
+            app.logger.warning('slow query %.1fms: %s', elapsed, statement)
+        if not has_request_context() or 'sql_count' not in g:
+            return
+        g.sql_count += 1
+        g.sql_time += elapsed
+        entry = (elapsed, statement)
+        if len(g.sql_slowest) < settings.top_statements:
+            heapq.heappush(g.sql_slowest, entry)
+        elif entry > g.sql_slowest[0]:
+            heapq.heapreplace(g.sql_slowest, entry)
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        # a failed statement never reaches after_cursor_execute
+        if context.connection is not None and context.connection.info.get('query_start'):
+            context.connection.info['query_start'].pop()
+
+
+def setup_instrumentation(app, db):
+    if not truthy(os.getenv('SQL_INSTRUMENTATION', '')):
+        return
+    settings = Settings()
+    with app.app_context():
+        for engine in [db.engine, *replica_engines(app)]:
+            instrument_engine(app, engine, settings)
+
+    @app.before_request
+    def start_sql_stats():
+        g.request_start = time.perf_counter()
+        g.sql_count = 0
+        g.sql_time = 0.0
+        g.sql_slowest = []
+
+    @app.after_request
+    def report_sql_stats(response):
+        if 'sql_count' not in g:
+            return response
+        total = (time.perf_counter() - g.request_start) * 1000
+        response.headers.add(
+            'Server-Timing', f'db;dur={g.sql_time:.2f};desc="{g.sql_count} queries"')
+        response.headers.add('Server-Timing', f'app;dur={total:.2f}')
+        if total > settings.slow_request_ms or g.sql_count > settings.slow_request_queries:
+            slowest = '\n'.join(f'  {elapsed:.1f}ms {statement}'
+                                for elapsed, statement in sorted(g.sql_slowest, reverse=True))
+            app.logger.warning('slow request %s %s: %.1fms, %d queries, %.1fms in db\n%s',
+                               request.method, request.path, total,
+                               g.sql_count, g.sql_time, slowest)
+        return response
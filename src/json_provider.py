@@ -0,0 +1,63 @@
+"""
+JSON provider for the Flask app.
+
+With orjson installed, jsonify and every other app.json call encode
+through it, which is several times faster than the stdlib encoder on
+the large list endpoints. The output is the same JSON: keys stay sorted,
+dates and datetimes keep Flask's HTTP date format, and Decimal, UUID,
+dataclasses and __html__ objects convert as before. The one difference
+is that non-ASCII characters come out as UTF-8 instead of \\u escapes.
+Anything orjson rejects, such as integers beyond 64 bits or non-string
+keys, goes through the stdlib encoder instead.
+
+Without orjson, or with JSON_PROVIDER=stdlib, Flask's default provider
+is used unchanged.
+"""
+import os
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    def options(self, indent=False):
+        # dates are left to self.default so they keep Flask's format
+        option = orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def encode(self, obj, indent=False):
+        return orjson.dumps(obj, default=self.default, option=self.options(indent))
+
+    def dumps(self, obj, **kwargs):
+        if set(kwargs) - {'separators'}:
+            return super().dumps(obj, **kwargs)
+        try:
+            return self.encode(obj).decode()
+        except orjson.JSONEncodeError:
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        try:
+            body = self.encode(obj, indent)
+        except orjson.JSONEncodeError:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
+
+
+def setup_json(app):
+    if orjson is not None and os.getenv('JSON_PROVIDER', 'orjson') != 'stdlib':
+        app.json = OrjsonProvider(app)
@@ -0,0 +1,101 @@
+"""
+Prometheus metrics, served in text exposition format from /metrics.
+
+Under gunicorn, point PROMETHEUS_MULTIPROC_DIR at a writable directory:
+each worker then keeps its samples in mmap'd files there and /metrics
+aggregates all of them. gunicorn.conf.py wipes the directory on start
+and drops the files of workers that exit.
+"""
+import os
+import time
+from flask import g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry,
+                               Counter, Gauge, Histogram, generate_latest, multiprocess)
+from sqlalchemy import event
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time spent answering a request',
+    ['route', 'method', 'status'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+DB_CHECKOUTS = Counter(
+    'db_pool_checkouts_total', 'Connections checked out of the pool')
+DB_CHECKED_OUT = Gauge(
+    'db_pool_checked_out', 'Connections currently checked out',
+    multiprocess_mode='livesum')
+DB_CONNECTIONS = Counter(
+    'db_pool_connects_total', 'New database connections opened by the pool')
+DB_CHECKOUT_WAIT = Histogram(
+    'db_pool_checkout_wait_seconds', 'Time from asking the pool for a connection to getting one',
+    buckets=(.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 2.5, 5, 10, 30))
+DB_CHECKOUT_TIMEOUTS = Counter(
+    'db_pool_checkout_timeouts_total', 'Checkouts that gave up after DB_POOL_TIMEOUT seconds')
+CACHE_LOOKUPS = Counter(
+    'response_cache_lookups_total', 'Response cache lookups', ['result'])
+CACHE_EVICTIONS = Counter(
+    'response_cache_evictions_total', 'Response cache entries evicted for space')
+RATE_LIMITED = Counter(
+    'rate_limited_requests_total', 'Requests refused with 429 by the rate limiter')
+
+
+def instrument_pool(engine):
+    @event.listens_for(engine, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        DB_CHECKOUTS.inc()
+        DB_CHECKED_OUT.inc()
+
+    @event.listens_for(engine, 'checkin')
+    def checkin(dbapi_connection, connection_record):
+        DB_CHECKED_OUT.dec()
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        DB_CONNECTIONS.inc()
+
+
+class CacheStats:
+    """Turns the cache's running totals into counter increments."""
+
+    def __init__(self):
+        self.seen = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def record(self, cache):
+        for name, counter in [('hits', CACHE_LOOKUPS.labels('hit')),
+                              ('misses', CACHE_LOOKUPS.labels('miss')),
+                              ('evictions', CACHE_EVICTIONS)]:
+            value = getattr(cache, name, 0)
+            if value > self.seen[name]:
+                counter.inc(value - self.seen[name])
+            self.seen[name] = value
+
+
+def render_metrics():
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+
+
+def setup_metrics(app, db, get_cache=None):
+    # imported here: replicas builds its engines with pool.py, which
+    # imports the metrics above
+    from replicas import replica_engines
+    with app.app_context():
+        for engine in [db.engine, *replica_engines(app)]:
+            instrument_pool(engine)
+    cache_stats = CacheStats()
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        if 'metrics_start' in g:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            REQUEST_LATENCY.labels(route, request.method, response.status_code).observe(
+                time.perf_counter() - g.metrics_start)
+        if get_cache is not None:
+            cache_stats.record(get_cache())
+        return response
@@ -1,12 +1,21 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import String, Boolean, Integer, ForeignKey, Date, Text
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy import String, Boolean, Integer, ForeignKey, Date, Text, Index, func, select
+from sqlalchemy.orm import Mapped, mapped_column, relationship, selectinload, column_property
+from replicas import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+def columns(model, keys):
+    # labelled columns for a projection of `keys` from serialized_fields,
+    # so list endpoints can select plain rows instead of whole instances
+    return [getattr(model, model.serialized_fields[key]).label(key) for key in keys]
 
 
 class User(db.Model):
     __tablename__ = 'user'
+    # response key -> attribute, shared by serialize() and projections
+    serialized_fields = {'id': 'id', 'user_name': 'user_name', 'email': 'email'}
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     is_active: Mapped[bool] = mapped_column(Boolean(), nullable=False)
     user_name: Mapped[str] = mapped_column(
@@ -25,15 +34,23 @@ class User(db.Model):
         return f'User: {self.user_name}'
 
     def serialize(self):
-        return {
-            'id': self.id,
-            'user_name': self.user_name,
-            'email': self.email,
-        }
+        return {key: getattr(self, attr) for key, attr in self.serialized_fields.items()}
 
 
 class Character(db.Model):
     __tablename__ = 'character'
+    required_fields = ['full_name']
+    extra_fields = ['birth_year', 'gender', 'height_mts',
+                    'weight_kg', 'skin_tone', 'eye_color', 'hair_color']
+    serialized_fields = {field: field for field in ['id', *required_fields, *extra_fields]}
+    # whitelists for ?field=a,b filters, ?field_min=/_max= ranges and
+    # ?sort=; each filterable column has a (column, id) index
+    filter_fields = ['gender', 'eye_color', 'hair_color', 'skin_tone', 'birth_year']
+    range_fields = ['height_mts', 'weight_kg']
+    sort_fields = ['id', 'full_name', *filter_fields, *range_fields]
+    __table_args__ = (Index('ix_character_favorite_count_id', 'favorite_count', 'id'),
+                      *(Index(f'ix_character_{field}_id', field, 'id')
+                        for field in [*filter_fields, *range_fields]))
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     full_name: Mapped[str] = mapped_column(
         String(50), unique=True, nullable=False)
@@ -44,6 +61,9 @@ class Character(db.Model):
     skin_tone: Mapped[str] = mapped_column(String(20), nullable=True)
     eye_color: Mapped[str] = mapped_column(String(20), nullable=True)
     hair_color: Mapped[str] = mapped_column(String(20), nullable=True)
+    # kept by the favorite handlers, see popularity.py
+    favorite_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, server_default='0')
     favorite_by: Mapped[list['Favorites_Characters']] = relationship(
         back_populates='character', cascade='all, delete-orphan')
     home_planet: Mapped[list['Natives_Planets']] = relationship(
@@ -51,26 +71,35 @@ class Character(db.Model):
     appearance: Mapped[list['Appearance_Characters']] = relationship(
         back_populates='character', cascade='all, delete-orphan')
 
+    @classmethod
+    def detail_options(cls):
+        # one SELECT per collection, each joined to its target row
+        return (
+            selectinload(cls.favorite_by).joinedload(Favorites_Characters.user),
+            selectinload(cls.home_planet).joinedload(Natives_Planets.planet),
+            selectinload(cls.appearance).joinedload(Appearance_Characters.film),
+        )
+
     def __str__(self):
         return f'Character: {self.full_name}'
 
     def serialize(self):
-
-        return {
-            'id': self.id,
-            'full_name': self.full_name,
-            'birth_year': self.birth_year,
-            'gender': self.gender,
-            'height_mts': self.height_mts,
-            'weight_kg': self.weight_kg,
-            'skin_tone': self.skin_tone,
-            'eye_color': self.eye_color,
-            'hair_color': self.hair_color
-        }
+        return {key: getattr(self, attr) for key, attr in self.serialized_fields.items()}
 
 
 class Planet(db.Model):
     __tablename__ = 'planet'
+    required_fields = ['name']
+    extra_fields = ['climate', 'terrain', 'population_count', 'gravity',
+                    'diameter', 'water_surface', 'orbital_period', 'rotation_period']
+    serialized_fields = {field: field for field in ['id', *required_fields, *extra_fields]}
+    filter_fields = ['climate', 'terrain', 'gravity']
+    range_fields = ['population_count', 'diameter', 'water_surface',
+                    'orbital_period', 'rotation_period']
+    sort_fields = ['id', 'name', *filter_fields, *range_fields]
+    __table_args__ = (Index('ix_planet_favorite_count_id', 'favorite_count', 'id'),
+                      *(Index(f'ix_planet_{field}_id', field, 'id')
+                        for field in [*filter_fields, *range_fields]))
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(
         String(50), unique=True, nullable=False)
@@ -82,6 +111,8 @@ class Planet(db.Model):
     water_surface: Mapped[int] = mapped_column(Integer, nullable=True)
     orbital_period: Mapped[int] = mapped_column(Integer, nullable=True)
     rotation_period: Mapped[int] = mapped_column(Integer, nullable=True)
+    favorite_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, server_default='0')
     favorite_by: Mapped[list['Favorites_Planets']] = relationship(
         back_populates='planet', cascade='all, delete-orphan')
     natives: Mapped[list['Natives_Planets']] = relationship(
@@ -89,26 +120,34 @@ class Planet(db.Model):
     appearance: Mapped[list['Appearance_Planets']] = relationship(
         back_populates='planet', cascade='all, delete-orphan')
 
+    @classmethod
+    def detail_options(cls):
+        return (
+            selectinload(cls.favorite_by).joinedload(Favorites_Planets.user),
+            selectinload(cls.natives).joinedload(Natives_Planets.character),
+            selectinload(cls.appearance).joinedload(Appearance_Planets.film),
+        )
+
     def __str__(self):
         return f'Planet: {self.name}'
 
     def serialize(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'climate':  self.climate,
-            'terrain': self.terrain,
-            'population_count': self.population_count,
-            'gravity': self.gravity,
-            'diameter': self.diameter,
-            'water_surface': self.water_surface,
-            'orbital_period': self.orbital_period,
-            'rotation_period': self.rotation_period
-        }
+        return {key: getattr(self, attr) for key, attr in self.serialized_fields.items()}
 
 
 class Film(db.Model):
     __tablename__ = 'film'
+    required_fields = ['title', 'episode']
+    extra_fields = ['director', 'producer', 'release_date', 'opening_crawl']
+    serialized_fields = {'id': 'id', 'title': 'title', 'episode': 'episode',
+                         'director': 'director', 'prodicer': 'producer',
+                         'release_date': 'release_date', 'opening_crawl': 'opening_crawl'}
+    filter_fields = ['episode', 'director', 'producer']
+    range_fields = ['release_date']
+    sort_fields = ['id', 'title', *filter_fields, *range_fields]
+    __table_args__ = (Index('ix_film_favorite_count_id', 'favorite_count', 'id'),
+                      *(Index(f'ix_film_{field}_id', field, 'id')
+                        for field in [*filter_fields, *range_fields]))
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     title: Mapped[str] = mapped_column(
         String(50), unique=True, nullable=False)
@@ -117,6 +156,8 @@ class Film(db.Model):
     producer: Mapped[str] = mapped_column(String(20), nullable=True)
     release_date: Mapped[int] = mapped_column(Date, nullable=True)
     opening_crawl: Mapped[str] = mapped_column(Text, nullable=True)
+    favorite_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, server_default='0')
     favorite_by: Mapped[list['Favorites_Films']] = relationship(
         back_populates='film', cascade='all, delete-orphan')
     feature_char: Mapped[list['Appearance_Characters']] = relationship(
@@ -124,25 +165,31 @@ class Film(db.Model):
     feature_planet: Mapped[list['Appearance_Planets']] = relationship(
         back_populates='film', cascade='all, delete-orphan')
 
+    @classmethod
+    def detail_options(cls):
+        return (
+            selectinload(cls.favorite_by).joinedload(Favorites_Films.user),
+            selectinload(cls.feature_char).joinedload(
+                Appearance_Characters.character),
+            selectinload(cls.feature_planet).joinedload(
+                Appearance_Planets.planet),
+        )
+
     def __str__(self):
         return f'Episode: {self.episode}'
 
     def serialize(self):
-        return {
-            'id': self.id,
-            'title': self.title,
-            'episode': self.episode,
-            'director': self.director,
-            'prodicer': self.producer,
-            'release_date': self.release_date,
-            'opening_crawl': self.opening_crawl
-        }
+        return {key: getattr(self, attr) for key, attr in self.serialized_fields.items()}
 
 # favorites
 
 
 class Favorites_Characters(db.Model):
     __tablename__ = 'favorite_characters'
+    __table_args__ = (
+        Index('uq_favorite_characters_user_id_character_id', 'user_id', 'character_id', unique=True),
+        Index('ix_favorite_characters_character_id', 'character_id'),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey('user.id'), nullable=False)
     user: Mapped[User] = relationship(back_populates='fav_char')
@@ -156,6 +203,10 @@ class Favorites_Characters(db.Model):
 
 class Favorites_Planets(db.Model):
     __tablename__ = 'favorite_planets'
+    __table_args__ = (
+        Index('uq_favorite_planets_user_id_planet_id', 'user_id', 'planet_id', unique=True),
+        Index('ix_favorite_planets_planet_id', 'planet_id'),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey('user.id'), nullable=False)
     user: Mapped[User] = relationship(back_populates='fav_planet')
@@ -169,6 +220,10 @@ class Favorites_Planets(db.Model):
 
 class Favorites_Films(db.Model):
     __tablename__ = 'favorite_films'
+    __table_args__ = (
+        Index('uq_favorite_films_user_id_film_id', 'user_id', 'film_id', unique=True),
+        Index('ix_favorite_films_film_id', 'film_id'),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey('user.id'), nullable=False)
     user: Mapped[User] = relationship(back_populates='fav_film')
@@ -183,6 +238,10 @@ class Favorites_Films(db.Model):
 
 class Natives_Planets(db.Model):
     __tablename__ = 'natives_planets'
+    __table_args__ = (
+        Index('uq_natives_planets_character_id_planet_id', 'character_id', 'planet_id', unique=True),
+        Index('ix_natives_planets_planet_id', 'planet_id'),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     character_id: Mapped[int] = mapped_column(
         ForeignKey('character.id'), nullable=False)
@@ -199,6 +258,10 @@ class Natives_Planets(db.Model):
 
 class Appearance_Characters(db.Model):
     __tablename__ = 'appearance_characters'
+    __table_args__ = (
+        Index('uq_appearance_characters_character_id_film_id', 'character_id', 'film_id', unique=True),
+        Index('ix_appearance_characters_film_id', 'film_id'),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     character_id: Mapped[int] = mapped_column(
         ForeignKey('character.id'), nullable=False)
@@ -212,6 +275,10 @@ class Appearance_Characters(db.Model):
 
 class Appearance_Planets(db.Model):
     __tablename__ = 'appearance_planets'
+    __table_args__ = (
+        Index('uq_appearance_planets_planet_id_film_id', 'planet_id', 'film_id', unique=True),
+        Index('ix_appearance_planets_film_id', 'film_id'),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     planet_id: Mapped[int] = mapped_column(
         ForeignKey('planet.id'), nullable=False)
@@ -221,3 +288,25 @@ class Appearance_Planets(db.Model):
 
     def __str__(self):
         return f'{self.planet} appears in {self.film}'
+
+
+# Related counts for the admin list views: one correlated count per row
+# over the link table's index. Deferred, so only queries that undefer
+# them pay for it.
+
+
+def related_count(link, column, model):
+    return column_property(
+        select(func.count()).where(column == model.id).correlate_except(link).scalar_subquery(),
+        deferred=True)
+
+
+User.fav_char_count = related_count(Favorites_Characters, Favorites_Characters.user_id, User)
+User.fav_planet_count = related_count(Favorites_Planets, Favorites_Planets.user_id, User)
+User.fav_film_count = related_count(Favorites_Films, Favorites_Films.user_id, User)
+Character.appearance_count = related_count(
+    Appearance_Characters, Appearance_Characters.character_id, Character)
+Planet.natives_count = related_count(Natives_Planets, Natives_Planets.planet_id, Planet)
+Planet.appearance_count = related_count(Appearance_Planets, Appearance_Planets.planet_id, Planet)
+Film.feature_char_count = related_count(Appearance_Characters, Appearance_Characters.film_id, Film)
+Film.feature_planet_count = related_count(Appearance_Planets, Appearance_Planets.film_id, Film)
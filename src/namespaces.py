@@ -0,0 +1,67 @@
+"""
+Cache namespaces a write to an entity can make stale: its own list and
+detail pages plus the detail pages that embed it. Shared by the API
+routes, the admin views and the importer.
+"""
+from batch import IN_CHUNK_SIZE
+from models import db, Favorites_Characters, Favorites_Planets, Favorites_Films, Natives_Planets, Appearance_Characters, Appearance_Planets
+
+
+def linked_ids(column, key, ids):
+    # `column` of the link rows whose `key` is one of `ids`, an IN query
+    # per chunk so bulk writes stay under the bound-parameter limits
+    ids = list(ids)
+    found = set()
+    for start in range(0, len(ids), IN_CHUNK_SIZE):
+        found.update(value for value, in db.session.query(column).filter(
+            key.in_(ids[start:start + IN_CHUNK_SIZE])).distinct())
+    return sorted(found)
+
+
+def character_namespaces(*ids):
+    planets = linked_ids(Natives_Planets.planet_id, Natives_Planets.character_id, ids)
+    films = linked_ids(Appearance_Characters.film_id, Appearance_Characters.character_id, ids)
+    return (['characters', 'top:characters'] + [f'character:{id}' for id in ids]
+            + [f'planet:{planet_id}' for planet_id in planets]
+            + [f'film:{film_id}' for film_id in films])
+
+
+def planet_namespaces(*ids):
+    natives = linked_ids(Natives_Planets.character_id, Natives_Planets.planet_id, ids)
+    films = linked_ids(Appearance_Planets.film_id, Appearance_Planets.planet_id, ids)
+    return (['planets', 'top:planets'] + [f'planet:{id}' for id in ids]
+            + [f'character:{character_id}' for character_id in natives]
+            + [f'film:{film_id}' for film_id in films])
+
+
+def film_namespaces(*ids):
+    characters = linked_ids(Appearance_Characters.character_id, Appearance_Characters.film_id, ids)
+    planets = linked_ids(Appearance_Planets.planet_id, Appearance_Planets.film_id, ids)
+    return (['films', 'top:films'] + [f'film:{id}' for id in ids]
+            + [f'character:{character_id}' for character_id in characters]
+            + [f'planet:{planet_id}' for planet_id in planets])
+
+
+def user_namespaces(id):
+    characters = db.session.query(
+        Favorites_Characters.character_id).filter_by(user_id=id)
+    planets = db.session.query(
+        Favorites_Planets.planet_id).filter_by(user_id=id)
+    films = db.session.query(Favorites_Films.film_id).filter_by(user_id=id)
+    return ([f'character:{character_id}' for character_id, in characters]
+            + [f'planet:{planet_id}' for planet_id, in planets]
+            + [f'film:{film_id}' for film_id, in films])
+
+
+def link_namespaces(link):
+    # both ends' detail pages for a natives or appearance row. Before a
+    # flush the id columns still hold the ends an edit repoints away from
+    # and the relationships the new ones, so both are covered
+    namespaces = []
+    for column in link.__table__.columns:
+        if column.foreign_keys:
+            detail = column.key.removesuffix('_id')
+            end = getattr(link, detail)
+            ids = {getattr(link, column.key), end.id if end is not None else None}
+            namespaces += [f'{detail}:{id}' for id in sorted(ids - {None})]
+    return namespaces
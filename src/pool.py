@@ -0,0 +1,93 @@
+"""
+Connection pool settings for the SQLAlchemy engines, read from the
+environment:
+
+- DB_POOL_SIZE (5), DB_MAX_OVERFLOW (10): connections kept per worker
+  and burst connections on top of them
+- DB_POOL_TIMEOUT (10): seconds a request waits for a connection before
+  it gets a 503
+- DB_POOL_RECYCLE (1800): seconds before a connection is replaced
+- DB_POOL_PRE_PING (on): test connections on checkout, so a failover
+  costs one reconnect instead of a failed request
+- DB_EXTERNAL_POOLER (off): behind PgBouncer or similar, open a fresh
+  connection per checkout (NullPool) and disable server-side prepared
+  statement caches, which do not survive transaction pooling
+
+Every gunicorn worker owns its own pool, so the database sees up to
+workers x (pool_size + max_overflow) connections. The pools time each
+checkout up to the moment they hand out a connection, including the wait
+for one to be checked in or opened, into db_pool_checkout_wait_seconds,
+and count the checkouts that time out.
+"""
+import os
+import time
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool, AsyncAdaptedQueuePool
+from metrics import DB_CHECKOUT_WAIT, DB_CHECKOUT_TIMEOUTS
+from utils import truthy
+
+checkout_timeouts = 0
+
+
+class TimedCheckout:
+    # _do_get is where QueuePool waits on its queue, no event wraps it
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            record_checkout_timeout()
+            raise
+        finally:
+            DB_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+
+class TimedQueuePool(TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def engine_options(uri):
+    url = make_url(uri)
+    options = {'pool_pre_ping': truthy(os.getenv('DB_POOL_PRE_PING', '1'))}
+
+    if truthy(os.getenv('DB_EXTERNAL_POOLER', '')):
+        options['poolclass'] = NullPool
+        if url.drivername == 'postgresql+psycopg':
+            options['connect_args'] = {'prepare_threshold': None}
+        elif url.drivername == 'postgresql+asyncpg':
+            options['connect_args'] = {'statement_cache_size': 0,
+                                       'prepared_statement_cache_size': 0}
+        return options
+
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # in-memory SQLite lives in a single connection, nothing to size
+        return options
+    options.update({
+        'poolclass': TimedAsyncQueuePool if url.get_dialect().is_async else TimedQueuePool,
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+    })
+    return options
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {'pid': os.getpid(), 'pool': type(pool).__name__,
+             'checkout_timeouts': checkout_timeouts}
+    for name in ['size', 'checkedin', 'checkedout', 'overflow']:
+        if hasattr(pool, name):
+            stats[name] = getattr(pool, name)()
+    return stats
+
+
+def record_checkout_timeout():
+    global checkout_timeouts
+    checkout_timeouts += 1
+    DB_CHECKOUT_TIMEOUTS.inc()
@@ -0,0 +1,71 @@
+"""
+Favorite counters for characters, planets and films.
+
+favorite_count on each catalog row is kept equal to its number of
+favorites by the favorite handlers, in the same transaction as the
+favorite rows, and read back in order from a (favorite_count, id) index
+by /top/<kind>. `flask favorites recount` recomputes every counter from
+the favorite tables, for rows changed outside the API such as user
+deletes through the admin.
+"""
+import click
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, func, select, update
+from cache import invalidate
+from models import db, columns, Character, Planet, Film, Favorites_Characters, Favorites_Planets, Favorites_Films
+
+# kind -> (model, favorite table, its column pointing at the model)
+COUNTED = {
+    'characters': (Character, Favorites_Characters, 'character_id'),
+    'planets': (Planet, Favorites_Planets, 'planet_id'),
+    'films': (Film, Favorites_Films, 'film_id'),
+}
+
+
+def bump_favorite_counts(model, deltas):
+    """Adds deltas, a mapping of id -> change, to the favorite_count of
+    `model` rows, in id order so concurrent batches lock rows alike."""
+    if not deltas:
+        return
+    table = model.__table__
+    db.session.execute(
+        update(table).where(table.c.id == bindparam('target')).values(
+            favorite_count=table.c.favorite_count + bindparam('delta')),
+        [{'target': id, 'delta': delta} for id, delta in sorted(deltas.items()) if delta])
+
+
+def top_favorited(model, keys, limit):
+    rows = db.session.query(*columns(model, keys), model.favorite_count).order_by(
+        model.favorite_count.desc(), model.id.desc()).limit(limit)
+    return [dict(zip(keys, row), favorite_count=row.favorite_count) for row in rows]
+
+
+def recount_favorites():
+    # one correlated count per row through the favorite table's index on
+    # the target column; only rows that drifted are written
+    changed = {}
+    for kind, (model, fav_model, column) in COUNTED.items():
+        count = select(func.count()).where(
+            getattr(fav_model, column) == model.id).scalar_subquery()
+        result = db.session.execute(
+            update(model).where(model.favorite_count != count).values(favorite_count=count),
+            execution_options={'synchronize_session': False})
+        changed[kind] = result.rowcount
+    db.session.commit()
+    # /top/<kind> is the only page showing the counters
+    invalidate(*(f'top:{kind}' for kind, count in changed.items() if count))
+    return changed
+
+
+favorites_cli = AppGroup('favorites', help='Maintain the favorite counters.')
+
+
+@favorites_cli.command('recount')
+def recount_command():
+    """Recompute favorite_count from the favorite tables."""
+    for kind, count in recount_favorites().items():
+        click.echo(f'{kind}: {count} counters corrected')
+
+
+def setup_popularity(app):
+    app.cli.add_command(favorites_cli)
@@ -0,0 +1,224 @@
+"""
+Token-bucket rate limiting in front of every API route.
+
+Each request takes its route's cost in tokens (ROUTE_COSTS, 1 for
+detail lookups, more for list pages, NDJSON streams and batches) from
+the bucket of its client IP and, on /user/<id>/... routes, from the
+bucket of that user at that IP as well. The API has no authentication,
+so the id in the path is only what the client claims; a bucket per user
+alone would let anyone drain it from a few addresses and lock the real
+user out. Keyed with the IP, it holds each client to the slower user
+rate on a user's routes without one client's traffic counting against
+another's. Buckets refill continuously at their rate
+up to their burst size. A request that either bucket cannot pay for
+gets a 429 with Retry-After and takes nothing.
+
+Settings, read from the environment:
+
+- RATE_LIMIT (on): set to 0 to turn the limiter off
+- RATE_LIMIT_IP_RATE (20), RATE_LIMIT_IP_BURST (200): tokens per second
+  and bucket size per client IP
+- RATE_LIMIT_USER_RATE (5), RATE_LIMIT_USER_BURST (50): the same per user
+  and client IP
+- RATE_LIMIT_PROXY_HOPS (0): proxies in front of the app (1 on Render or
+  Heroku); the client IP is then read that many entries from the end of
+  X-Forwarded-For, which clients cannot forge past the proxy
+- RATE_LIMIT_REDIS_URL: keep the buckets in Redis (needs the optional
+  `redis` package), for workers spread over several hosts
+
+Without Redis the buckets live in a table in a memory-mapped file,
+RATE_LIMIT_FILE (under /dev/shm when it exists), that every worker on
+the host maps and updates under a file lock, a few microseconds per
+request. The table has RATE_LIMIT_SLOTS (65536) slots addressed by a
+hash of the bucket key; when the slots a key may use are all taken, the
+one idle the longest is reused for it.
+"""
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from flask import jsonify, request
+from metrics import RATE_LIMITED
+from utils import truthy
+
+# url rule -> tokens per request; other routes cost DEFAULT_COST
+ROUTE_COSTS = {
+    '/users': 5,
+    '/characters': 5,
+    '/planets': 5,
+    '/films': 5,
+    '/user/<int:id>/favorites': 2,
+    '/top/<kind>': 2,
+    '/search': 3,
+    '/character/<int:id>/costars': 2,
+    '/character/<int:id>/path/<int:other_id>': 3,
+    '/film/<int:id>/natives': 2,
+    '/characters/batch': 20,
+    '/planets/batch': 20,
+    '/films/batch': 20,
+    '/user/<int:user_id>/favorites/batch': 10,
+}
+DEFAULT_COST = 1
+# a whole table through ?format=ndjson
+NDJSON_COST = 50
+EXEMPT_PREFIXES = ('/admin', '/static', '/metrics')
+
+
+class SharedMemoryBuckets:
+    # slot: key hash (0 = free), tokens, time of the last update
+    slot = struct.Struct('<Qdd')
+    probes = 8
+
+    def __init__(self, path, slots):
+        self.slots = slots
+        size = slots * self.slot.size
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+        # lockf excludes other processes, even ones forked after this
+        # (flock would not), but not threads
+        self.lock = threading.Lock()
+
+    def find(self, key, now, rate, burst):
+        """(offset, key hash, tokens now) of the slot for `key`."""
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') | 1
+        start = digest % self.slots
+        victim, oldest = None, math.inf
+        for probe in range(self.probes):
+            offset = (start + probe) % self.slots * self.slot.size
+            found, tokens, updated = self.slot.unpack_from(self.map, offset)
+            if found == digest:
+                return offset, digest, min(burst, tokens + max(now - updated, 0) * rate)
+            if found == 0:
+                return offset, digest, burst
+            if updated < oldest:
+                victim, oldest = offset, updated
+        return victim, digest, burst
+
+    def take(self, buckets):
+        """Takes cost tokens from every (key, cost, rate, burst) bucket,
+        or from none; returns 0 or the seconds until all could pay."""
+        now = time.time()
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX)
+            try:
+                found = []
+                wait = 0
+                for key, cost, rate, burst in buckets:
+                    offset, digest, tokens = self.find(key, now, rate, burst)
+                    if tokens < cost:
+                        wait = max(wait, (cost - tokens) / rate)
+                    found.append((offset, digest, tokens, cost))
+                for offset, digest, tokens, cost in found:
+                    self.slot.pack_into(self.map, offset, digest, tokens if wait else tokens - cost, now)
+                return wait
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+
+class RedisBuckets:
+    prefix = 'ratelimit:'
+    # same algorithm on the server clock, one round trip per request
+    script = '''
+        local clock = redis.call('TIME')
+        local now = clock[1] + clock[2] / 1000000
+        local tokens, wait = {}, 0
+        for i, key in ipairs(KEYS) do
+            local cost, rate, burst = tonumber(ARGV[3 * i - 2]), tonumber(ARGV[3 * i - 1]), tonumber(ARGV[3 * i])
+            local state = redis.call('HMGET', key, 'tokens', 'updated')
+            tokens[i] = burst
+            if state[1] then
+                tokens[i] = math.min(burst, tonumber(state[1]) + math.max(now - tonumber(state[2]), 0) * rate)
+            end
+            if tokens[i] < cost then
+                wait = math.max(wait, (cost - tokens[i]) / rate)
+            end
+        end
+        for i, key in ipairs(KEYS) do
+            local cost, rate, burst = tonumber(ARGV[3 * i - 2]), tonumber(ARGV[3 * i - 1]), tonumber(ARGV[3 * i])
+            if wait == 0 then
+                tokens[i] = tokens[i] - cost
+            end
+            redis.call('HSET', key, 'tokens', tokens[i], 'updated', now)
+            -- gone once it would be full again
+            redis.call('PEXPIRE', key, math.ceil((burst - tokens[i]) / rate * 1000) + 1000)
+        end
+        return tostring(wait)
+    '''
+
+    def __init__(self, client):
+        self.take_script = client.register_script(self.script)
+
+    def take(self, buckets):
+        keys = [self.prefix + key for key, _, _, _ in buckets]
+        args = [value for _, cost, rate, burst in buckets for value in (cost, rate, burst)]
+        return float(self.take_script(keys=keys, args=args))
+
+
+def client_ip(req, hops):
+    if hops:
+        forwarded = req.headers.get('X-Forwarded-For', '').split(',')
+        if len(forwarded) >= hops:
+            return forwarded[-hops].strip()
+    return req.remote_addr
+
+
+def request_cost(req):
+    rule = req.url_rule.rule if req.url_rule else None
+    if rule in ROUTE_COSTS and req.args.get('format') == 'ndjson':
+        return NDJSON_COST
+    return ROUTE_COSTS.get(rule, DEFAULT_COST)
+
+
+def request_user(req):
+    # the user a /user/<id>/... route reads or writes for
+    args = req.view_args or {}
+    if 'user_id' in args:
+        return args['user_id']
+    if req.path.startswith('/user/'):
+        return args.get('id')
+    return None
+
+
+def setup_rate_limit(app):
+    if not truthy(os.getenv('RATE_LIMIT', '1')):
+        return
+    ip_limit = (float(os.getenv('RATE_LIMIT_IP_RATE', 20)), float(os.getenv('RATE_LIMIT_IP_BURST', 200)))
+    user_limit = (float(os.getenv('RATE_LIMIT_USER_RATE', 5)), float(os.getenv('RATE_LIMIT_USER_BURST', 50)))
+    hops = int(os.getenv('RATE_LIMIT_PROXY_HOPS', 0))
+    redis_url = os.getenv('RATE_LIMIT_REDIS_URL')
+    if redis_url:
+        import redis
+        buckets = RedisBuckets(redis.Redis.from_url(redis_url))
+    else:
+        directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        buckets = SharedMemoryBuckets(
+            os.getenv('RATE_LIMIT_FILE', os.path.join(directory, 'flask-rate-limit')),
+            int(os.getenv('RATE_LIMIT_SLOTS', 65536)))
+    app.extensions['rate_limit'] = buckets
+
+    @app.before_request
+    def limit_rate():
+        # the proxy resolves the request on every attribute access
+        req = request._get_current_object()
+        if req.method == 'OPTIONS' or req.path.startswith(EXEMPT_PREFIXES):
+            return
+        cost = request_cost(req)
+        ip = client_ip(req, hops)
+        # a cost above the burst could never be paid
+        requested = [(f'ip:{ip}', min(cost, ip_limit[1]), *ip_limit)]
+        user = request_user(req)
+        if user is not None:
+            # the user id is unauthenticated, see the module docstring
+            requested.append((f'user:{user}:{ip}', min(cost, user_limit[1]), *user_limit))
+        wait = buckets.take(requested)
+        if wait:
+            RATE_LIMITED.inc()
+            retry_after = max(math.ceil(wait), 1)
+            return jsonify({'msg': f'Too many requests, retry in {retry_after}s'}), 429, {'Retry-After': str(retry_after)}
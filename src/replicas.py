@@ -0,0 +1,115 @@
+"""
+Read-replica routing.
+
+Set DATABASE_REPLICA_URLS to a comma-separated list of replica URLs and
+GET/HEAD requests read from them round-robin, while every other request
+and every flush stays on the primary (DATABASE_URL).
+
+- Read-your-writes: a successful write sets a `db_primary_until` cookie
+  so that client keeps reading from the primary for
+  REPLICA_STICKY_SECONDS (5) and never sees its own write go missing.
+- Fallback: a replica that fails to connect or drops its connection is
+  taken out of rotation for REPLICA_RETRY_SECONDS (30). The failed read
+  is retried on the primary, and with no healthy replica left all reads
+  go to the primary. NDJSON streams (?format=ndjson) are not retried: their
+  queries run while the body is sent, after the 200, so a replica that
+  fails ends the body early and the client has to request it again.
+
+Cached responses and ETags can be computed from a replica that lags
+behind the primary; a write still invalidates them, but a read that
+races the replication delay may cache the old row until CACHE_TTL.
+"""
+import itertools
+import os
+import threading
+import time
+from flask import g, request, current_app, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from pool import engine_options
+
+STICKY_COOKIE = 'db_primary_until'
+
+
+class ReplicaRouter:
+    def __init__(self, urls, logger, retry_seconds=30):
+        self.logger = logger
+        self.engines = [create_engine(url, **engine_options(url)) for url in urls]
+        self.retry_seconds = retry_seconds
+        self._down_until = {engine: 0.0 for engine in self.engines}
+        self._cycle = itertools.cycle(self.engines)
+        self._lock = threading.Lock()
+        for engine in self.engines:
+            event.listen(engine, 'handle_error', self._on_error)
+
+    def pick(self):
+        now = time.monotonic()
+        with self._lock:
+            for _ in self.engines:
+                engine = next(self._cycle)
+                if self._down_until[engine] <= now:
+                    return engine
+        return None
+
+    def mark_down(self, engine):
+        self._down_until[engine] = time.monotonic() + self.retry_seconds
+        self.logger.warning('replica %s unavailable, reading from primary', engine.url)
+
+    def _on_error(self, context):
+        if context.is_disconnect or isinstance(context.sqlalchemy_exception, OperationalError):
+            self.mark_down(context.engine)
+
+
+class RoutingSession(Session):
+    """Sends reads issued during a replica-routed request to the replica
+    picked for that request; writes and flushes always use the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context():
+            engine = g.get('read_replica')
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def replica_engines(app):
+    router = app.extensions.get('replicas')
+    return router.engines if router is not None else []
+
+
+def setup_replicas(app, db):
+    urls = [url.strip().replace('postgres://', 'postgresql://')
+            for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    if not urls:
+        return
+    router = ReplicaRouter(urls, app.logger, float(os.getenv('REPLICA_RETRY_SECONDS', 30)))
+    app.extensions['replicas'] = router
+    sticky_seconds = float(os.getenv('REPLICA_STICKY_SECONDS', 5))
+
+    @app.before_request
+    def route_reads():
+        if request.method not in ('GET', 'HEAD'):
+            return
+        try:
+            if float(request.cookies.get(STICKY_COOKIE, 0)) > time.time():
+                return
+        except ValueError:
+            pass
+        g.read_replica = router.pick()
+
+    @app.after_request
+    def stick_to_primary(response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            until = time.time() + sticky_seconds
+            response.set_cookie(STICKY_COOKIE, f'{until:.3f}',
+                                max_age=int(sticky_seconds) + 1, httponly=True)
+        return response
+
+    @app.errorhandler(OperationalError)
+    def retry_on_primary(error):
+        if g.get('read_replica') is None:
+            raise error
+        g.read_replica = None
+        db.session.rollback()
+        return current_app.view_functions[request.endpoint](**request.view_args)
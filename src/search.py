@@ -0,0 +1,206 @@
+"""
+Full-text search over character names, planet names, film titles and
+film opening crawls, served from GET /search?q=.
+
+Every searchable row has one document in the search_document table,
+keyed by doc_id = id * 4 + kind code so a single integer key finds it
+for updates and deletes. Titles weigh more than crawl text.
+
+- PostgreSQL: a plain table with a generated, weighted tsvector column
+  under a GIN index, ranked with ts_rank_cd.
+- SQLite: an FTS5 table with the porter tokenizer and prefix indexes of
+  one to four characters, ranked with bm25.
+
+All terms must match, the last one as a prefix. A cheap count, which
+stops at SEARCH_MAX_CANDIDATES (2000), decides how much is ranked: up to
+that many matches are all ranked, but a query matching more, typically a
+prefix of one or two letters as typed, ranks only the first
+SEARCH_BROAD_CANDIDATES (500) matches in index order, doc_id order on
+SQLite, and pages through those; a longer query ranks every match again.
+Ranking costs about 2.5ms per thousand documents on SQLite, so at a
+million documents most queries answer in 3-7ms, while one-letter
+prefixes take about 11ms and several words ending in a short prefix
+about 15ms, spent intersecting the prefix's long document lists.
+
+The write handlers in app.py and the admin update documents in the same
+transaction as the rows. `flask search reindex` rebuilds the table from
+scratch, e.g. after bulk loads that bypass them. Other databases have no
+search: indexing is skipped and /search answers 501.
+"""
+import os
+import re
+import click
+from flask import request
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, text
+from utils import APIException, page_args
+from models import db, Character, Planet, Film
+
+# kind -> (code in doc_id, model, title column, body column)
+KINDS = {
+    'character': (1, Character, 'full_name', None),
+    'planet': (2, Planet, 'name', None),
+    'film': (3, Film, 'title', 'opening_crawl'),
+}
+KIND_OF = {model: kind for kind, (_, model, _, _) in KINDS.items()}
+CODES = {code: kind for kind, (code, _, _, _) in KINDS.items()}
+REINDEX_CHUNK_SIZE = 10000
+MAX_CANDIDATES = int(os.getenv('SEARCH_MAX_CANDIDATES', 2000))
+BROAD_CANDIDATES = int(os.getenv('SEARCH_BROAD_CANDIDATES', 500))
+
+
+class PostgresSearch:
+    create = [
+        'CREATE TABLE IF NOT EXISTS search_document ('
+        ' doc_id bigint PRIMARY KEY, title text NOT NULL, body text,'
+        " document tsvector GENERATED ALWAYS AS (setweight(to_tsvector('english', title), 'A')"
+        " || setweight(to_tsvector('english', coalesce(body, '')), 'B')) STORED)",
+        'CREATE INDEX IF NOT EXISTS ix_search_document_document'
+        ' ON search_document USING gin (document)',
+    ]
+    drop = 'DROP TABLE IF EXISTS search_document'
+    upsert = ('INSERT INTO search_document (doc_id, title, body) {select}'
+              ' ON CONFLICT (doc_id) DO UPDATE SET title = excluded.title, body = excluded.body')
+    delete = 'DELETE FROM search_document WHERE doc_id = :doc_id'
+    count = ('SELECT count(*) FROM'
+             " (SELECT 1 FROM search_document, to_tsquery('english', :q) AS query"
+             '  WHERE document @@ query {kinds} LIMIT :candidates) AS found')
+    search = ('SELECT doc_id, title, score FROM'
+              ' (SELECT doc_id, title, ts_rank_cd(document, query) AS score'
+              "  FROM search_document, to_tsquery('english', :q) AS query"
+              '  WHERE document @@ query {kinds} LIMIT :candidates) AS found'
+              ' ORDER BY score DESC, doc_id LIMIT :limit OFFSET :offset')
+
+    @staticmethod
+    def query(terms):
+        return ' & '.join(terms[:-1] + [terms[-1] + ':*'])
+
+
+class SqliteSearch:
+    create = ["CREATE VIRTUAL TABLE IF NOT EXISTS search_document"
+              " USING fts5(title, body, tokenize='porter unicode61', prefix='1 2 3 4')",
+              # rank with these weights, which FTS5 can order by directly
+              "INSERT INTO search_document (search_document, rank) VALUES ('rank', 'bm25(10.0, 1.0)')"]
+    drop = 'DROP TABLE IF EXISTS search_document'
+    upsert = 'INSERT OR REPLACE INTO search_document (rowid, title, body) {select}'
+    delete = 'DELETE FROM search_document WHERE rowid = :doc_id'
+    count = ('SELECT count(*) FROM (SELECT 1 FROM search_document'
+             ' WHERE search_document MATCH :q {kinds} LIMIT :candidates)')
+    search = ('SELECT doc_id, title, score FROM'
+              ' (SELECT rowid AS doc_id, title, -rank AS score FROM search_document'
+              '  WHERE search_document MATCH :q {kinds} LIMIT :candidates)'
+              ' ORDER BY score DESC, doc_id LIMIT :limit OFFSET :offset')
+
+    @staticmethod
+    def query(terms):
+        return ' '.join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+
+
+BACKENDS = {'postgresql': PostgresSearch, 'sqlite': SqliteSearch}
+
+
+def get_backend():
+    return BACKENDS.get(db.engine.dialect.name)
+
+
+def documents(model):
+    # the select feeding backend.upsert, straight from the table
+    code, _, title, body = KINDS[KIND_OF[model]]
+    quote = db.engine.dialect.identifier_preparer.quote
+    body = 'NULL' if body is None else quote(body)
+    return (f'SELECT id * 4 + {code}, {quote(title)}, {body}'
+            f' FROM {quote(model.__tablename__)} WHERE id IN :ids')
+
+
+def index_documents(model, ids):
+    """Writes the search documents of `model` rows `ids` from their
+    current column values, within the caller's transaction."""
+    backend = get_backend()
+    if backend is None or not ids:
+        return
+    # the select reads the table, so pending ORM changes must be in it
+    db.session.flush()
+    statement = text(backend.upsert.format(select=documents(model)))
+    db.session.execute(statement.bindparams(bindparam('ids', expanding=True)), {'ids': list(ids)})
+
+
+def remove_documents(model, ids):
+    backend = get_backend()
+    if backend is None or not ids:
+        return
+    code = KINDS[KIND_OF[model]][0]
+    db.session.execute(text(backend.delete), [{'doc_id': id * 4 + code} for id in ids])
+
+
+def reindex():
+    backend = get_backend()
+    db.session.execute(text(backend.drop))
+    for statement in backend.create:
+        db.session.execute(text(statement))
+    counts = {}
+    for kind, (_, model, _, _) in KINDS.items():
+        counts[kind] = 0
+        last_id = 0
+        while True:
+            ids = [id for id, in db.session.query(model.id).filter(
+                model.id > last_id).order_by(model.id).limit(REINDEX_CHUNK_SIZE)]
+            if not ids:
+                break
+            index_documents(model, ids)
+            counts[kind] += len(ids)
+            last_id = ids[-1]
+    db.session.commit()
+    return counts
+
+
+def search_args():
+    terms = re.findall(r'\w+', request.args.get('q', ''))
+    if not terms:
+        raise APIException('q must contain at least one word')
+    kinds = request.args.get('kind')
+    kinds = list(KINDS) if kinds is None else kinds.split(',')
+    if not set(kinds) <= set(KINDS):
+        raise APIException(f'kind must be any of: {", ".join(KINDS)}')
+    limit, _ = page_args()
+    try:
+        offset = int(request.args.get('cursor', 0))
+    except ValueError:
+        raise APIException('invalid cursor')
+    return terms, kinds, limit, max(offset, 0)
+
+
+def search_documents(terms, kinds, limit, offset):
+    """Ranked matches for all `terms` as (results, next_cursor); the
+    cursor is the offset of the next page."""
+    backend = get_backend()
+    kind_filter = ''
+    if len(kinds) < len(KINDS):
+        key = 'rowid' if backend is SqliteSearch else 'doc_id'
+        kind_filter = f'AND {key} % 4 IN ({", ".join(str(KINDS[kind][0]) for kind in kinds)})'
+    q = backend.query(terms)
+    matches = db.session.execute(text(backend.count.format(kinds=kind_filter)), {
+        'q': q, 'candidates': MAX_CANDIDATES + 1}).scalar()
+    # ranking every match of a broad prefix would cost far more than
+    # ranking the window of it the index returns first
+    candidates = MAX_CANDIDATES if matches <= MAX_CANDIDATES else BROAD_CANDIDATES
+    rows = db.session.execute(text(backend.search.format(kinds=kind_filter)), {
+        'q': q, 'limit': limit + 1, 'offset': offset, 'candidates': candidates}).all()
+    results = [{'kind': CODES[doc_id % 4], 'id': doc_id // 4, 'title': title,
+                'score': round(score, 6)} for doc_id, title, score in rows[:limit]]
+    return results, offset + limit if len(rows) > limit else None
+
+
+search_cli = AppGroup('search', help='Maintain the full-text search index.')
+
+
+@search_cli.command('reindex')
+def reindex_command():
+    """Rebuild the search index from the catalog tables."""
+    if get_backend() is None:
+        raise click.ClickException(f'No search backend for {db.engine.dialect.name}')
+    for kind, count in reindex().items():
+        click.echo(f'{kind}: {count} documents')
+
+
+def setup_search(app):
+    app.cli.add_command(search_cli)
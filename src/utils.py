@@ -1,4 +1,13 @@
-from flask import jsonify, url_for
+import base64
+import datetime
+import itertools
+import json
+from flask import jsonify, url_for, request, current_app, stream_with_context
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+STREAM_CHUNK_SIZE = 1000
 
 class APIException(Exception):
     status_code = 400
@@ -15,6 +24,145 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def truthy(value):
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+def page_args(args=None):
+    args = request.args if args is None else args
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+        after = int(args.get('after', 0))
+    except ValueError:
+        raise APIException('limit and after must be integers')
+    if limit < 1 or after < 0:
+        raise APIException('limit must be positive and after not negative')
+    return min(limit, MAX_PAGE_SIZE), after
+
+def parse_value(column, value):
+    try:
+        if column.type.python_type is datetime.date:
+            return datetime.date.fromisoformat(value)
+        return column.type.python_type(value)
+    except ValueError:
+        raise APIException(f'{column.key} expects {column.type.python_type.__name__} values')
+
+def filter_criteria(model, args):
+    # only whitelisted columns: ?gender=male,female matches any of the
+    # values, ?population_count_min=10&population_count_max=99 a range
+    criteria = []
+    for field in getattr(model, 'filter_fields', ()):
+        if field in args:
+            criteria.append(getattr(model, field).in_(args[field].split(',')))
+    for field in getattr(model, 'range_fields', ()):
+        column = getattr(model, field)
+        if f'{field}_min' in args:
+            criteria.append(column >= parse_value(column, args[f'{field}_min']))
+        if f'{field}_max' in args:
+            criteria.append(column <= parse_value(column, args[f'{field}_max']))
+    return criteria
+
+def encode_cursor(value, id):
+    if isinstance(value, datetime.date):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, id]).encode()).decode()
+
+def decode_cursor(column, cursor):
+    try:
+        value, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (None if value is None else parse_value(column, str(value))), int(id)
+    except (ValueError, TypeError, APIException):
+        raise APIException('invalid cursor')
+
+def listing(query, model, args):
+    # filters, order and keyset position for a list endpoint. Without
+    # ?sort= pages follow the primary key and ?after=<id>; with
+    # ?sort=field or ?sort=-field they follow (field, id), NULLs last as
+    # in a (field, id) index, and continue from the opaque ?cursor=.
+    # Returns the queries to read in turn, each an index range scan, and
+    # a function giving a row's cursor.
+    query = query.filter(*filter_criteria(model, args))
+    sort = args.get('sort')
+    if not sort:
+        _, after = page_args(args)
+        return [query.filter(model.id > after).order_by(model.id)], lambda row: row.id
+    field = sort.removeprefix('-')
+    if field not in getattr(model, 'sort_fields', ('id',)):
+        raise APIException(f'sort must be any of: {", ".join(getattr(model, "sort_fields", ("id",)))}')
+    column, descending = getattr(model, field), sort.startswith('-')
+    query = query.add_columns(column.label('sort_value'))
+    if descending:
+        query = query.order_by(column.desc().nulls_first(), model.id.desc())
+    else:
+        query = query.order_by(column.asc().nulls_last(), model.id)
+    cursor_of = lambda row: encode_cursor(row.sort_value, row.id)
+    if 'cursor' not in args:
+        return [query], cursor_of
+
+    # an OR across the NULL boundary would defeat the index, so the rest
+    # of the current region and the region after it are read separately
+    value, id = decode_cursor(column, args['cursor'])
+    if value is None and descending:
+        return [query.filter(column.is_(None), model.id < id),
+                query.filter(column.is_not(None))], cursor_of
+    if value is None:
+        return [query.filter(column.is_(None), model.id > id)], cursor_of
+    if descending:
+        return [query.filter(tuple_(column, model.id) < (value, id))], cursor_of
+    return [query.filter(tuple_(column, model.id) > (value, id)),
+            query.filter(column.is_(None))], cursor_of
+
+def paginate(query, model):
+    # keyset pagination: every page is an index range scan, no matter how
+    # deep the client pages
+    limit, _ = page_args()
+    queries, cursor_of = listing(query, model, request.args)
+    rows = []
+    for query in queries:
+        rows += query.limit(limit + 1 - len(rows)).all()
+        if len(rows) > limit:
+            break
+    next_cursor = cursor_of(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def parse_fields(model, fields):
+    # sparse fieldset from ?fields=a,b; id is always kept for paging
+    if not fields:
+        return list(model.serialized_fields)
+    keys = ['id'] + [key for key in dict.fromkeys(fields.split(',')) if key != 'id']
+    unknown = [key for key in keys if key not in model.serialized_fields]
+    if unknown:
+        raise APIException(f'unknown fields: {", ".join(unknown)}; '
+                           f'choose from: {", ".join(model.serialized_fields)}')
+    return keys
+
+def field_args(model):
+    return parse_fields(model, request.args.get('fields'))
+
+def wants_ndjson():
+    return request.args.get('format') == 'ndjson'
+
+def stream_ndjson(query, model, keys):
+    # rows come through a server-side cursor in chunks and leave as one
+    # JSON document per line, so memory stays flat for any table size;
+    # the query selects plain rows with `keys` as its leading columns
+    queries, _ = listing(query, model, request.args)
+    rows = itertools.chain.from_iterable(
+        query.yield_per(STREAM_CHUNK_SIZE) for query in queries)
+    dumps = current_app.json.dumps
+
+    def generate():
+        lines = []
+        for row in rows:
+            lines.append(dumps(dict(zip(keys, row))) + '\n')
+            if len(lines) == STREAM_CHUNK_SIZE:
+                yield ''.join(lines)
+                lines = []
+        if lines:
+            yield ''.join(lines)
+
+    return current_app.response_class(
+        stream_with_context(generate()), mimetype='application/x-ndjson')
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
@@ -0,0 +1,92 @@
+import datetime
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+TMP = tempfile.mkdtemp(prefix='api-tests-')
+
+# read by app.py at import time: a throwaway database, no response cache
+# so every request reaches the database, no rate limit on the test client
+os.environ['DATABASE_URL'] = f'sqlite:///{TMP}/test.db'
+os.environ['CACHE_MAX_ENTRIES'] = '0'
+os.environ['RATE_LIMIT'] = '0'
+sys.path.insert(0, SRC)
+
+from sqlalchemy import event  # noqa: E402
+from app import app as flask_app  # noqa: E402
+from cache import setup_cache  # noqa: E402
+from popularity import recount_favorites  # noqa: E402
+from search import reindex  # noqa: E402
+from models import (db, User, Character, Planet, Film, Favorites_Characters, Favorites_Planets,  # noqa: E402
+                    Favorites_Films, Natives_Planets, Appearance_Characters, Appearance_Planets)
+
+
+@pytest.fixture
+def app():
+    """The app on an empty schema, with fresh cache versions and graph
+    index. No app context stays pushed, so each test client request gets
+    its own session as it would when served."""
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        reindex()
+    setup_cache(flask_app)
+    flask_app.extensions['graph']['graph'] = None
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def statements(app):
+    """The SQL statements run since the last clear()."""
+    seen = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        seen.append(statement)
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield seen
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+@pytest.fixture
+def catalog(app):
+    """Two users, five planets, ten characters and three films. Character
+    n is native to planet n % 5 + 1, appears in film n % 3 + 1 and is a
+    favorite of both users. Every planet appears in film 1."""
+    with app.app_context():
+        return seed_catalog()
+
+
+def seed_catalog():
+    users = [User(user_name=f'u{i}', email=f'e{i}', password='p', is_active=True) for i in (1, 2)]
+    planets = [Planet(name=f'p{i}', population_count=i * 10) for i in range(5)]
+    characters = [Character(full_name=f'c{i}', gender='male' if i % 2 else 'female', height_mts=i)
+                  for i in range(10)]
+    films = [Film(title=f'f{i}', episode=str(i), release_date=datetime.date(1977, 5, 25),
+                  opening_crawl='Rebels attack') for i in range(3)]
+    db.session.add_all([*users, *planets, *characters, *films])
+    db.session.flush()
+    for character in characters:
+        db.session.add(Natives_Planets(character_id=character.id, planet_id=character.id % 5 + 1))
+        db.session.add(Appearance_Characters(character_id=character.id, film_id=character.id % 3 + 1))
+        for user in users:
+            db.session.add(Favorites_Characters(user_id=user.id, character_id=character.id))
+    for planet in planets:
+        db.session.add(Appearance_Planets(planet_id=planet.id, film_id=1))
+        db.session.add(Favorites_Planets(user_id=1, planet_id=planet.id))
+    db.session.add(Favorites_Films(user_id=1, film_id=1))
+    db.session.commit()
+    reindex()
+    recount_favorites()
+    return {'users': [user.id for user in users], 'planets': [planet.id for planet in planets],
+            'characters': [character.id for character in characters], 'films': [film.id for film in films]}
@@ -0,0 +1,28 @@
+from sqlalchemy import UniqueConstraint, inspect
+
+
+def leading_columns(table):
+    # columns a sort can read in order from an index
+    leading = {column.name for column in table.primary_key}
+    leading.update(list(index.columns)[0].name for index in table.indexes)
+    leading.update(list(constraint.columns)[0].name for constraint in table.constraints
+                   if isinstance(constraint, UniqueConstraint))
+    return leading
+
+
+def test_admin_sorts_only_on_indexed_columns(app):
+    admin = app.extensions['admin'][0]
+    for view in admin._views:
+        model = getattr(view, 'model', None)
+        if model is None:
+            continue
+        leading = leading_columns(inspect(model).local_table)
+        for name, column in view._sortable_columns.items():
+            if hasattr(column, 'name'):
+                assert column.name in leading, f'{view.name} sorts on unindexed {name}'
+
+
+def test_admin_lists(client, catalog):
+    for path in ['/admin/user/', '/admin/character/?sort=1', '/admin/planet/', '/admin/film/',
+                 '/admin/natives_planets/']:
+        assert client.get(path).status_code == 200, path
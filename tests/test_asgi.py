@@ -0,0 +1,37 @@
+import pytest
+from starlette.testclient import TestClient
+
+import asgi
+
+
+@pytest.fixture
+def asgi_client(app):
+    return TestClient(asgi.app)
+
+
+@pytest.mark.parametrize('url', [
+    '/users',
+    '/user/1',
+    '/user/1/favorites',
+    '/characters?limit=4&cursor=2',
+    '/character/1',
+    '/planets?sort=population_count',
+    # the sync endpoint answers under 'mgs', and so must this one
+    '/planet/1',
+    '/films',
+    '/film/1',
+])
+def test_same_responses_as_flask(client, asgi_client, catalog, url):
+    expected = client.get(url)
+    response = asgi_client.get(url)
+    assert response.status_code == expected.status_code == 200
+    assert response.headers['content-type'] == expected.content_type
+    assert response.json() == expected.get_json()
+
+
+@pytest.mark.parametrize('url', ['/user/99', '/character/99', '/planet/99', '/film/99', '/characters?cursor=x'])
+def test_same_errors_as_flask(client, asgi_client, catalog, url):
+    expected = client.get(url)
+    response = asgi_client.get(url)
+    assert response.status_code == expected.status_code
+    assert response.json() == expected.get_json()
@@ -0,0 +1,71 @@
+import datetime
+
+import pytest
+from sqlalchemy import insert
+
+import app as app_module
+from models import db, Character, Film, Favorites_Planets
+
+
+def test_characters_batch(client, catalog):
+    response = client.post('/characters/batch', json=[
+        {'full_name': 'new', 'height_mts': 2, 'home_planet': 1},
+        {'full_name': 'c0'},
+        {'gender': 'female'},
+        {'full_name': 'other', 'home_planet': [99]},
+    ])
+    assert response.status_code == 200
+    results = response.get_json()['POSTED']
+    assert [result['status'] for result in results] == ['created', 'error', 'error', 'error']
+    assert client.get(f'/character/{results[0]["id"]}').get_json()['GETTED']['home_planet'][0]['id'] == 1
+
+
+@pytest.mark.parametrize('record, field', [
+    ({'full_name': 'new', 'height_mts': '2'}, 'height_mts'),
+    ({'full_name': 'new', 'height_mts': True}, 'height_mts'),
+    ({'full_name': 'new', 'gender': 7}, 'gender'),
+    ({'full_name': 'x' * 51}, 'full_name'),
+])
+def test_batch_rejects_values_of_the_wrong_type(client, catalog, record, field):
+    response = client.post('/characters/batch', json=[{'full_name': 'fine'}, record])
+    assert response.status_code == 200
+    results = response.get_json()['POSTED']
+    assert results[0]['status'] == 'created'
+    assert results[1]['status'] == 'error' and results[1]['index'] == 1
+    assert results[1]['msg'].startswith(field)
+    with app_module.app.app_context():
+        assert Character.query.filter_by(full_name='fine').count() == 1
+        assert Character.query.filter_by(full_name='new').first() is None
+
+
+def test_films_batch_stores_dates(client, catalog):
+    response = client.post('/films/batch', json=[
+        {'title': 'new', 'episode': '4', 'release_date': '1977-05-25', 'feature_char': [1, 2]}])
+    assert response.get_json()['POSTED'][0]['status'] == 'created'
+    with app_module.app.app_context():
+        assert Film.query.filter_by(title='new').one().release_date == datetime.date(1977, 5, 25)
+    response = client.post('/films/batch', json=[{'title': 'bad', 'episode': '4', 'release_date': 'May 1977'}])
+    assert response.get_json()['POSTED'][0]['msg'] == 'release_date expects YYYY-MM-DD dates'
+
+
+def test_favorites_batch(client, catalog):
+    response = client.post('/user/2/favorites/batch', json={'planets': [1, 2, 99], 'characters': [1]})
+    assert response.status_code == 200
+    results = response.get_json()['POSTED']
+    assert [result['status'] for result in results['planets']] == ['created', 'created', 'error']
+    assert results['characters'][0]['msg'] == 'Character: 1 already favorited'
+
+
+def test_favorites_batch_conflict(client, catalog, monkeypatch):
+    insert_rows = app_module.insert_rows
+
+    def racing_insert_rows(model, rows, keys):
+        # another request favorites the first id after this one checked
+        db.session.execute(insert(model), rows[:1])
+        return insert_rows(model, rows, keys)
+    monkeypatch.setattr(app_module, 'insert_rows', racing_insert_rows)
+
+    response = client.post('/user/2/favorites/batch', json={'planets': [1, 2]})
+    assert response.status_code == 409
+    with app_module.app.app_context():
+        assert Favorites_Planets.query.filter_by(user_id=2).count() == 0
@@ -0,0 +1,91 @@
+import pytest
+
+from cache import setup_cache
+from models import db, Favorites_Films
+from popularity import recount_favorites
+
+
+@pytest.fixture
+def cached_client(app, monkeypatch):
+    monkeypatch.setenv('CACHE_MAX_ENTRIES', '1024')
+    setup_cache(app)
+    return app.test_client()
+
+
+def top_names(client, kind, key):
+    response = client.get(f'/top/{kind}?limit=500')
+    assert response.status_code == 200
+    return response.headers['ETag'], {row[key] for row in response.get_json()['GETTED']}
+
+
+@pytest.mark.parametrize('kind, key, url, body', [
+    ('planets', 'name', '/planet', {'name': 'new'}),
+    ('characters', 'full_name', '/character', {'full_name': 'new'}),
+    ('films', 'title', '/film', {'title': 'new', 'episode': '7'}),
+    ('planets', 'name', '/planets/batch', [{'name': 'new'}]),
+    ('characters', 'full_name', '/characters/batch', [{'full_name': 'new'}]),
+    ('films', 'title', '/films/batch', [{'title': 'new', 'episode': '7'}]),
+])
+def test_catalog_writes_invalidate_top(cached_client, catalog, kind, key, url, body):
+    etag, names = top_names(cached_client, kind, key)
+    assert 'new' not in names
+    assert cached_client.post(url, json=body).status_code == 200
+    assert cached_client.get(f'/top/{kind}?limit=500', headers={'If-None-Match': etag}).status_code == 200
+    assert 'new' in top_names(cached_client, kind, key)[1]
+
+
+def test_favorite_invalidates_detail_and_top(cached_client, catalog):
+    etag = cached_client.get('/planet/1').headers['ETag']
+    before = cached_client.get('/top/planets').get_json()['GETTED']
+    assert cached_client.get('/planet/1', headers={'If-None-Match': etag}).status_code == 304
+
+    assert cached_client.post('/user/2/favorites/planet/1').status_code == 200
+    assert cached_client.get('/planet/1', headers={'If-None-Match': etag}).status_code == 200
+    after = cached_client.get('/top/planets').get_json()['GETTED']
+    assert after != before
+
+
+def test_admin_edits_invalidate_embedding_pages(cached_client, catalog):
+    # planet 1 is the home of characters 5 and 10 and appears in film 1
+    urls = ['/planet/1', '/character/5', '/film/1', '/planets']
+    etags = {url: cached_client.get(url).headers['ETag'] for url in urls}
+    response = cached_client.post('/admin/planet/edit/?id=1', data={'name': 'Tatooine'})
+    assert response.status_code == 302
+    for url in urls:
+        assert cached_client.get(url, headers={'If-None-Match': etags[url]}).status_code == 200
+    assert cached_client.get('/character/5').get_json()['GETTED']['home_planet'][0]['name'] == 'Tatooine'
+
+
+def test_admin_link_edits_invalidate_both_ends(cached_client, catalog):
+    # natives row 1 makes planet 2 the home of character 1
+    urls = ['/character/1', '/planet/2', '/planet/3']
+    etags = {url: cached_client.get(url).headers['ETag'] for url in urls}
+    response = cached_client.post('/admin/natives_planets/edit/?id=1', data={'character': '1', 'planet': '3'})
+    assert response.status_code == 302
+    for url in urls:
+        assert cached_client.get(url, headers={'If-None-Match': etags[url]}).status_code == 200
+    assert [planet['id'] for planet in cached_client.get('/character/1').get_json()['GETTED']['home_planet']] == [3]
+
+    etag = cached_client.get('/planet/3').headers['ETag']
+    assert cached_client.post('/admin/natives_planets/delete/', data={'id': '1'}).status_code == 302
+    assert cached_client.get('/planet/3', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_recount_invalidates_top(cached_client, catalog):
+    etags = {kind: cached_client.get(f'/top/{kind}').headers['ETag'] for kind in ('planets', 'films')}
+    # a favorite removed behind the counters' back, as a user delete
+    # through the admin leaves it
+    with cached_client.application.app_context():
+        Favorites_Films.query.delete()
+        db.session.commit()
+        assert recount_favorites() == {'characters': 0, 'planets': 0, 'films': 1}
+    assert cached_client.get('/top/films', headers={'If-None-Match': etags['films']}).status_code == 200
+    assert cached_client.get('/top/planets', headers={'If-None-Match': etags['planets']}).status_code == 304
+
+
+def test_favorite_ids_are_normalized(cached_client, catalog):
+    # 01 and 1 name the same planet, so they must bump the same namespace
+    etag = cached_client.get('/planet/1').headers['ETag']
+    assert cached_client.post('/user/2/favorites/planet/01').status_code == 200
+    assert cached_client.get('/planet/1', headers={'If-None-Match': etag}).status_code == 200
+    assert cached_client.post('/user/2/favorites/planet/one').status_code == 404
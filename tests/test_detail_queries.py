@@ -0,0 +1,29 @@
+import pytest
+
+# detail pages load each collection with one SELECT joined to its
+# targets, so their statement count does not grow with the collections
+MAX_STATEMENTS = 4
+
+
+@pytest.mark.parametrize('url', ['/character/1', '/planet/1', '/film/1', '/user/1/favorites'])
+def test_detail_statement_bound(client, catalog, statements, url):
+    statements.clear()
+    response = client.get(url)
+    assert response.status_code == 200
+    assert len(statements) <= MAX_STATEMENTS, statements
+
+
+def test_detail_statements_do_not_grow_with_favorites(client, catalog, statements):
+    statements.clear()
+    client.get('/user/2/favorites')
+    fewer = len(statements)
+    statements.clear()
+    client.get('/user/1/favorites')
+    assert len(statements) == fewer
+
+
+def test_character_detail_embeds_collections(client, catalog):
+    body = client.get('/character/1').get_json()['GETTED']
+    assert [planet['id'] for planet in body['home_planet']] == [2]
+    assert [film['id'] for film in body['appearances']] == [2]
+    assert {user['id'] for user in body['favorite_by']} == {1, 2}
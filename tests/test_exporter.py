@@ -0,0 +1,43 @@
+import gzip
+import json
+
+import pytest
+
+import exporter
+
+
+def export(app, *args):
+    return app.test_cli_runner().invoke(args=['export', *args])
+
+
+def test_export_ndjson(app, catalog, tmp_path):
+    result = export(app, str(tmp_path), '--tables', 'planet,natives_planets')
+    assert result.exit_code == 0, result.output
+    manifest = json.loads((tmp_path / 'manifest.json').read_text())
+    assert manifest['database'] == 'sqlite' and manifest['format'] == 'ndjson'
+    assert {name: stats['rows'] for name, stats in manifest['tables'].items()} == {'planet': 5, 'natives_planets': 10}
+    with gzip.open(tmp_path / 'planet.ndjson.gz', 'rt') as f:
+        rows = [json.loads(line) for line in f]
+    assert [row['id'] for row in rows] == [1, 2, 3, 4, 5]
+    assert rows[1]['name'] == 'p1' and rows[1]['population_count'] == 10
+
+
+def test_export_parquet(app, catalog, tmp_path):
+    pyarrow = pytest.importorskip('pyarrow.parquet')
+    result = export(app, str(tmp_path), '--format', 'parquet', '--tables', 'film')
+    assert result.exit_code == 0, result.output
+    table = pyarrow.read_table(tmp_path / 'film.parquet')
+    assert table.column('title').to_pylist() == ['f0', 'f1', 'f2']
+
+
+def test_export_fails_verification(app, catalog, tmp_path, monkeypatch):
+    monkeypatch.setattr(exporter, 'reads_back', lambda directory, format, stats: False)
+    result = export(app, str(tmp_path), '--tables', 'planet')
+    assert result.exit_code != 0
+    assert 'does not read back' in result.output
+    assert not (tmp_path / 'manifest.json').exists()
+
+
+def test_export_rejects_unknown_tables(app, tmp_path):
+    result = export(app, str(tmp_path), '--tables', 'planet,starship')
+    assert result.exit_code != 0 and 'starship' in result.output
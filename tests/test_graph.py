@@ -0,0 +1,92 @@
+import os
+import random
+from array import array
+
+import sqlalchemy as sa
+
+import graph
+from graph import Adjacency
+
+
+def costar_ids(client, id):
+    response = client.get(f'/character/{id}/costars')
+    assert response.status_code == 200
+    return {costar['id'] for costar in response.get_json()['GETTED']}
+
+
+def test_costars(client, catalog):
+    # characters 1, 4, 7 and 10 appear in film 2
+    assert costar_ids(client, 1) == {4, 7, 10}
+    assert client.get('/character/99/costars').status_code == 404
+
+
+def test_path(client, catalog, statements):
+    assert client.get('/character/1/path/2').status_code == 404
+    assert client.post('/film', json={'title': 'new', 'episode': '7', 'feature_char': [1, 2]}).status_code == 200
+
+    statements.clear()
+    body = client.get('/character/4/path/2').get_json()['GETTED']
+    assert body['degrees'] == 2
+    assert [list(step) for step in body['path']] == [['character'], ['film'], ['character'], ['film'], ['character']]
+    assert body['path'][2]['character']['id'] == 1
+    # the ids are checked once, then one query per kind of step
+    assert len(statements) == 3
+    assert client.get('/character/1/path/99').status_code == 404
+    assert client.get('/character/4/path/2?max_degrees=1').status_code == 404
+
+
+def test_film_natives(client, catalog):
+    body = client.get('/film/1/natives?limit=4').get_json()
+    assert [native['id'] for native in body['GETTED']] == [1, 2, 3, 4]
+    assert body['GETTED'][0]['planet_ids'] == [2]
+    assert body['next_cursor'] == 4
+
+
+def test_writes_update_the_loaded_index(client, catalog):
+    assert costar_ids(client, 2) == {5, 8}
+    loaded = client.application.extensions['graph']['graph']
+    client.post('/characters/batch', json=[{'full_name': 'new'}])
+    client.post('/films/batch', json=[{'title': 'new', 'episode': '7', 'feature_char': [2, 11]}])
+    assert costar_ids(client, 2) == {5, 8, 11}
+    assert client.delete('/character/5').status_code == 200
+    assert costar_ids(client, 2) == {8, 11}
+    # applied in place, not reloaded
+    assert client.application.extensions['graph']['graph'] is loaded
+
+
+def test_changes_from_other_processes(client, catalog, monkeypatch):
+    response = client.get('/character/1/costars')
+    etag = response.headers['ETag']
+    # another worker or `flask import` links character 2 to film 2
+    other = sa.create_engine(os.environ['DATABASE_URL'])
+    with other.begin() as connection:
+        connection.execute(sa.text('INSERT INTO appearance_characters (character_id, film_id) VALUES (2, 2)'))
+    other.dispose()
+    assert costar_ids(client, 1) == {4, 7, 10}
+
+    client.application.extensions['graph']['graph'].checked -= graph.RECHECK_SECONDS
+    assert client.get('/character/1/costars', headers={'If-None-Match': etag}).status_code == 200
+    assert costar_ids(client, 1) == {2, 4, 7, 10}
+
+
+def test_adjacency_compact_matches_a_fresh_build(monkeypatch):
+    monkeypatch.setattr(graph, 'OVERLAY_LIMIT', 5)
+    rng = random.Random(7)
+    links = {(rng.randrange(30), rng.randrange(30)) for _ in range(200)}
+    adjacency = Adjacency(*links_arrays(links))
+    for _ in range(100):
+        link = (rng.randrange(40), rng.randrange(40))
+        if link in links:
+            links.discard(link)
+            adjacency.remove(*link)
+        else:
+            links.add(link)
+            adjacency.add(*link)
+    fresh = Adjacency(*links_arrays(links))
+    for id in range(45):
+        assert list(adjacency[id]) == list(fresh[id])
+
+
+def links_arrays(links):
+    ordered = sorted(links)
+    return array('i', [source for source, _ in ordered]), array('i', [target for _, target in ordered])
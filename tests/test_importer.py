@@ -0,0 +1,91 @@
+import pytest
+from sqlalchemy import inspect
+
+import importer
+from models import db, Planet, Natives_Planets
+
+
+def index_names(app, model):
+    with app.app_context():
+        return {index['name'] for index in inspect(db.engine).get_indexes(model.__tablename__)}
+
+
+def run(app, *args):
+    return app.test_cli_runner().invoke(args=['import', *args])
+
+
+@pytest.fixture
+def planets_csv(tmp_path):
+    path = tmp_path / 'planets.csv'
+    path.write_text('name,climate,population_count\nTatooine,arid,200000\nHoth,frozen,\nBad,x,many\n')
+    return path
+
+
+def test_import_is_idempotent(app, planets_csv):
+    expected = index_names(app, Planet)
+    for _ in range(2):
+        result = run(app, 'planets', str(planets_csv))
+        assert result.exit_code == 0, result.output
+        assert '2 rows loaded, 1 skipped' in result.output
+    with app.app_context():
+        assert {planet.name: planet.population_count for planet in Planet.query} == {'Tatooine': 200000, 'Hoth': None}
+    assert index_names(app, Planet) == expected
+
+
+def test_import_checks_nulls_and_lengths(app, tmp_path):
+    path = tmp_path / 'planets.ndjson'
+    path.write_text('{"name": "Naboo", "climate": "temperate"}\n{"name": "Dagobah", "climate": "%s"}\n'
+                    '{"name": null, "climate": "arid"}\n' % ('x' * 21))
+    result = run(app, 'planets', str(path))
+    assert result.exit_code == 0, result.output
+    assert '1 rows loaded, 2 skipped' in result.output
+    assert 'climate is limited to 20 characters' in result.output
+    assert 'name must not be null' in result.output
+    with app.app_context():
+        assert [planet.name for planet in Planet.query] == ['Naboo']
+
+
+def test_failed_run_recreates_the_indexes(app, planets_csv, monkeypatch):
+    expected = index_names(app, Planet)
+
+    def fail(*args):
+        raise RuntimeError('connection lost')
+    monkeypatch.setattr(importer, 'upsert', fail)
+    result = run(app, 'planets', str(planets_csv))
+    assert isinstance(result.exception, RuntimeError)
+    assert index_names(app, Planet) == expected
+
+
+def test_killed_run_indexes_are_restored(app, catalog, planets_csv):
+    expected = index_names(app, Planet)
+    with app.app_context():
+        # as left by a run killed before its finally block
+        dropped = importer.drop_secondary_indexes(Planet)
+    assert dropped and index_names(app, Planet) < expected
+    assert run(app, 'planets', str(planets_csv)).exit_code == 0
+    assert index_names(app, Planet) == expected
+
+
+def test_import_links(app, client, catalog, tmp_path):
+    etag = client.get('/planet/3').headers['ETag']
+    path = tmp_path / 'natives.ndjson'
+    path.write_text('{"character": "c0", "planet": "p2"}\n{"character": "c0", "planet": "nowhere"}\n'
+                    '{"character": "c1", "planet": "p2"}\n')
+    result = run(app, 'natives', str(path))
+    assert result.exit_code == 0, result.output
+    assert '2 rows loaded, 1 skipped' in result.output
+    with app.app_context():
+        # c1 was already native to p2
+        assert Natives_Planets.query.filter_by(planet_id=3).count() == 3
+    assert client.get('/planet/3', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_updates_invalidate_embedding_pages(app, client, catalog, tmp_path):
+    # planet p0 is the home of characters 5 and 10 and appears in film 1
+    urls = ['/planet/1', '/character/5', '/film/1']
+    etags = {url: client.get(url).headers['ETag'] for url in urls}
+    path = tmp_path / 'planets.csv'
+    path.write_text('name,climate\np0,arid\n')
+    assert run(app, 'planets', str(path)).exit_code == 0
+    for url in urls:
+        assert client.get(url, headers={'If-None-Match': etags[url]}).status_code == 200
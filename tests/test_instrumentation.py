@@ -0,0 +1,50 @@
+import pytest
+from flask import Flask, jsonify
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from models import db
+from instrumentation import setup_instrumentation
+
+
+@pytest.fixture
+def instrumented(tmp_path, monkeypatch):
+    monkeypatch.setenv('SQL_INSTRUMENTATION', '1')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path}/instrumented.db'
+    db.init_app(app)
+    setup_instrumentation(app, db)
+
+    @app.route('/queries/<int:count>')
+    def queries(count):
+        for _ in range(count):
+            db.session.execute(text('SELECT 1'))
+        return jsonify('ok')
+
+    @app.route('/failing')
+    def failing():
+        try:
+            db.session.execute(text('SELECT * FROM missing'))
+        except OperationalError:
+            db.session.rollback()
+        db.session.execute(text('SELECT 1'))
+        return jsonify('ok')
+    return app
+
+
+def server_timing(response):
+    return dict(entry.split(';', 1) for entry in response.headers.getlist('Server-Timing'))
+
+
+def test_server_timing(instrumented):
+    timing = server_timing(instrumented.test_client().get('/queries/3'))
+    assert set(timing) == {'db', 'app'}
+    assert timing['db'].endswith('desc="3 queries"')
+
+
+def test_failed_statements_leave_no_timing_behind(instrumented):
+    timing = server_timing(instrumented.test_client().get('/failing'))
+    assert timing['db'].endswith('desc="1 queries"')
+    with instrumented.app_context():
+        with db.engine.connect() as connection:
+            assert connection.info.get('query_start') == []
@@ -0,0 +1,49 @@
+import datetime
+import decimal
+import json
+import uuid
+
+import pytest
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+pytest.importorskip('orjson')
+from json_provider import OrjsonProvider  # noqa: E402
+
+PAYLOADS = [
+    {'b': 1, 'a': {'d': [1, 2], 'c': None}, 'name': 'Tatooine', 'ratio': 0.5},
+    {'release_date': datetime.date(1977, 5, 25), 'seen': datetime.datetime(2026, 10, 18, 12, 30)},
+    {'price': decimal.Decimal('1.10'), 'key': uuid.UUID(int=7)},
+    # beyond 64 bits, which orjson rejects
+    {'big': 2 ** 70, 'small': 1},
+]
+
+
+def providers():
+    app = Flask(__name__)
+    return DefaultJSONProvider(app), OrjsonProvider(app), app
+
+
+def pairs(text):
+    # parsed with keys in the order written, so sorting shows
+    return json.loads(text, object_pairs_hook=list)
+
+
+@pytest.mark.parametrize('payload', PAYLOADS)
+def test_dumps_matches_the_stdlib_provider(payload):
+    stdlib, fast, _ = providers()
+    assert pairs(fast.dumps(payload)) == pairs(stdlib.dumps(payload))
+
+
+@pytest.mark.parametrize('payload', PAYLOADS)
+def test_responses_match_the_stdlib_provider(payload):
+    stdlib, fast, app = providers()
+    with app.app_context():
+        expected, response = stdlib.response(payload), fast.response(payload)
+    assert response.mimetype == expected.mimetype == 'application/json'
+    assert pairs(response.get_data(as_text=True)) == pairs(expected.get_data(as_text=True))
+
+
+def test_dates_keep_the_http_format():
+    _, fast, _ = providers()
+    assert fast.loads(fast.dumps({'d': datetime.date(1977, 5, 25)})) == {'d': 'Wed, 25 May 1977 00:00:00 GMT'}
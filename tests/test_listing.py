@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+import utils
+
+
+def all_pages(client, url):
+    ids, cursor = [], None
+    while True:
+        page_url = url if cursor is None else f'{url}&cursor={cursor}'
+        body = client.get(page_url).get_json()
+        assert body['msg'] == 'ok', body
+        ids += [row['id'] for row in body['GETTED']]
+        cursor = body['next_cursor']
+        if cursor is None:
+            return ids
+
+
+@pytest.fixture
+def planets(client, catalog):
+    # ties and NULLs around the existing populations 0, 10, ..., 40
+    response = client.post('/planets/batch', json=[
+        {'name': 'n1'}, {'name': 't1', 'population_count': 10}, {'name': 'n2'},
+        {'name': 't2', 'population_count': 10}, {'name': 'n3'}])
+    assert response.status_code == 200
+    return {row['id']: row['population_count'] for row in client.get('/planets?limit=500').get_json()['GETTED']}
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 500])
+def test_ascending_pages_put_nulls_last(client, planets, limit):
+    expected = sorted(planets, key=lambda id: (planets[id] is None, planets[id] or 0, id))
+    assert all_pages(client, f'/planets?sort=population_count&limit={limit}') == expected
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 500])
+def test_descending_pages_put_nulls_first(client, planets, limit):
+    expected = sorted(planets, key=lambda id: (planets[id] is None, planets[id] or 0, id), reverse=True)
+    assert all_pages(client, f'/planets?sort=-population_count&limit={limit}') == expected
+
+
+def test_id_pages(client, planets):
+    ids, after = [], 0
+    while True:
+        body = client.get(f'/planets?limit=3&after={after}').get_json()
+        ids += [row['id'] for row in body['GETTED']]
+        if body['next_cursor'] is None:
+            break
+        after = body['next_cursor']
+    assert ids == sorted(planets)
+
+
+def test_filters_and_bad_arguments(client, planets):
+    body = client.get('/planets?population_count_min=10&population_count_max=20&limit=500').get_json()
+    assert sorted(planets[row['id']] for row in body['GETTED']) == [10, 10, 10, 20]
+    assert client.get('/planets?sort=password').status_code == 400
+    assert client.get('/planets?sort=name&cursor=garbage').status_code == 400
+    assert client.get('/planets?population_count_min=many').status_code == 400
+
+
+def test_ndjson_streams_every_row(client, planets, monkeypatch):
+    monkeypatch.setattr(utils, 'STREAM_CHUNK_SIZE', 3)
+    response = client.get('/planets?format=ndjson&sort=population_count', buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    chunks = list(response.response)
+    # ten rows in chunks of three
+    assert len(chunks) == 4
+    lines = b''.join(chunks).decode().splitlines()
+    rows = [json.loads(line) for line in lines]
+    assert all(isinstance(row, dict) for row in rows)
+    expected = sorted(planets, key=lambda id: (planets[id] is None, planets[id] or 0, id))
+    assert [row['id'] for row in rows] == expected
+
+
+def test_fields_projection(client, catalog):
+    body = client.get('/characters?fields=full_name,gender&limit=2').get_json()
+    # id stays in every row, as the cursor needs it
+    assert body['GETTED'] == [{'id': 1, 'full_name': 'c0', 'gender': 'female'},
+                              {'id': 2, 'full_name': 'c1', 'gender': 'male'}]
+    assert body['next_cursor'] == 2
+    rows = client.get('/films?fields=id,title,title').get_json()['GETTED']
+    assert rows[0] == {'id': 1, 'title': 'f0'}
+    lines = client.get('/planets?fields=name&format=ndjson').get_data(as_text=True).splitlines()
+    assert json.loads(lines[0]) == {'id': 1, 'name': 'p0'}
+
+
+def test_unknown_fields(client, catalog):
+    response = client.get('/characters?fields=full_name,password')
+    assert response.status_code == 400
+    assert response.get_json()['message'].startswith('unknown fields: password;')
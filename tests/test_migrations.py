@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+import sqlalchemy as sa
+
+from conftest import ROOT, SRC
+
+
+def flask_db(database, *args):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{database}', RATE_LIMIT='0')
+    return subprocess.run(
+        [sys.executable, '-m', 'flask', '--app', 'app', 'db', *args, '-d', os.path.join(ROOT, 'migrations')],
+        cwd=SRC, env=env, capture_output=True, text=True)
+
+
+def test_upgrade_from_an_empty_database(tmp_path):
+    database = tmp_path / 'empty.db'
+    upgraded = flask_db(database, 'upgrade')
+    assert upgraded.returncode == 0, upgraded.stderr
+    tables = set(sa.inspect(sa.create_engine(f'sqlite:///{database}')).get_table_names())
+    assert {'user', 'character', 'planet', 'film', 'favorite_characters', 'favorite_planets',
+            'favorite_films', 'natives_planets', 'appearance_characters', 'appearance_planets'} <= tables
+
+
+def test_upgrade_matches_the_models(tmp_path):
+    database = tmp_path / 'empty.db'
+    assert flask_db(database, 'upgrade').returncode == 0
+    # autogenerate finds nothing left to migrate
+    check = flask_db(database, 'check')
+    assert check.returncode == 0, check.stdout + check.stderr
+
+
+def test_downgrade_to_base(tmp_path):
+    database = tmp_path / 'empty.db'
+    assert flask_db(database, 'upgrade').returncode == 0
+    downgraded = flask_db(database, 'downgrade', 'base')
+    assert downgraded.returncode == 0, downgraded.stderr
+    tables = set(sa.inspect(sa.create_engine(f'sqlite:///{database}')).get_table_names())
+    assert tables <= {'alembic_version'}
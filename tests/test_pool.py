@@ -0,0 +1,52 @@
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+import pool
+from pool import engine_options, pool_stats
+
+
+def sample(name):
+    return REGISTRY.get_sample_value(name) or 0
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    monkeypatch.setenv('DB_POOL_SIZE', '1')
+    monkeypatch.setenv('DB_MAX_OVERFLOW', '0')
+    monkeypatch.setenv('DB_POOL_TIMEOUT', '0.05')
+    url = f'sqlite:///{tmp_path}/pool.db'
+    engine = create_engine(url, **engine_options(url))
+    yield engine
+    engine.dispose()
+
+
+def test_checkout_wait_is_observed(engine):
+    before = sample('db_pool_checkout_wait_seconds_count')
+    with engine.connect():
+        pass
+    with engine.connect():
+        pass
+    assert sample('db_pool_checkout_wait_seconds_count') == before + 2
+
+
+def test_checkout_timeouts_are_counted(engine):
+    timeouts = sample('db_pool_checkout_timeouts_total')
+    waited = sample('db_pool_checkout_wait_seconds_sum')
+    stats_before = pool.checkout_timeouts
+    with engine.connect():
+        with pytest.raises(PoolTimeoutError):
+            engine.connect()
+    assert sample('db_pool_checkout_timeouts_total') == timeouts + 1
+    assert sample('db_pool_checkout_wait_seconds_sum') - waited >= 0.05
+    assert pool_stats(engine)['checkout_timeouts'] == stats_before + 1
+
+
+def test_app_answers_a_pool_timeout_with_503(client, monkeypatch):
+    def busy(*args, **kwargs):
+        raise PoolTimeoutError('pool exhausted')
+    monkeypatch.setitem(client.application.view_functions, 'get_top', busy)
+    response = client.get('/top/planets')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
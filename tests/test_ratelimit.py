@@ -0,0 +1,121 @@
+import pytest
+from flask import Flask
+
+import ratelimit
+from app import app as api
+from ratelimit import SharedMemoryBuckets, ROUTE_COSTS, DEFAULT_COST, NDJSON_COST, setup_rate_limit
+
+
+@pytest.fixture
+def buckets(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(ratelimit.time, 'time', lambda: clock[0])
+    buckets = SharedMemoryBuckets(str(tmp_path / 'buckets'), 64)
+    buckets.clock = clock
+    return buckets
+
+
+def test_bucket_starts_full_and_refills(buckets):
+    assert buckets.take([('a', 10, 2, 10)]) == 0
+    # empty: 1 token needs half a second at 2 per second
+    assert buckets.take([('a', 1, 2, 10)]) == pytest.approx(0.5)
+    buckets.clock[0] += 0.5
+    assert buckets.take([('a', 1, 2, 10)]) == 0
+    # never above the burst
+    buckets.clock[0] += 3600
+    assert buckets.take([('a', 10, 2, 10)]) == 0
+    assert buckets.take([('a', 1, 2, 10)]) > 0
+
+
+def test_refused_request_takes_nothing(buckets):
+    assert buckets.take([('ip', 5, 1, 10), ('user', 5, 1, 5)]) == 0
+    # the user bucket cannot pay, so the ip bucket keeps its tokens
+    assert buckets.take([('ip', 5, 1, 10), ('user', 5, 1, 5)]) == pytest.approx(5)
+    assert buckets.take([('ip', 5, 1, 10)]) == 0
+
+
+def test_keys_are_independent(buckets):
+    assert buckets.take([('a', 10, 1, 10)]) == 0
+    assert buckets.take([('b', 10, 1, 10)]) == 0
+
+
+def test_full_table_reuses_the_idlest_slot(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(ratelimit.time, 'time', lambda: clock[0])
+    buckets = SharedMemoryBuckets(str(tmp_path / 'buckets'), 8)
+    for key in range(8):
+        clock[0] += 1
+        assert buckets.take([(f'k{key}', 10, 1, 10)]) == 0
+    # a ninth key gets a full bucket in place of an idle one
+    assert buckets.take([('new', 10, 1, 10)]) == 0
+
+
+def test_route_costs_name_real_routes():
+    rules = {rule.rule for rule in api.url_map.iter_rules()}
+    assert set(ROUTE_COSTS) <= rules
+
+
+@pytest.fixture
+def limited(tmp_path, monkeypatch):
+    monkeypatch.setenv('RATE_LIMIT', '1')
+    monkeypatch.setenv('RATE_LIMIT_IP_RATE', '1')
+    monkeypatch.setenv('RATE_LIMIT_IP_BURST', '10')
+    monkeypatch.setenv('RATE_LIMIT_USER_RATE', '1')
+    monkeypatch.setenv('RATE_LIMIT_USER_BURST', '4')
+    monkeypatch.setenv('RATE_LIMIT_PROXY_HOPS', '1')
+    monkeypatch.setenv('RATE_LIMIT_FILE', str(tmp_path / 'buckets'))
+    monkeypatch.setenv('RATE_LIMIT_SLOTS', '64')
+    app = Flask(__name__)
+    for rule in ('/characters', '/character/<int:id>', '/user/<int:id>/favorites', '/admin/'):
+        app.add_url_rule(rule, rule, lambda **kwargs: 'ok')
+    setup_rate_limit(app)
+    return app.test_client()
+
+
+def get(client, url, ip='1.2.3.4'):
+    return client.get(url, headers={'X-Forwarded-For': f'9.9.9.9, {ip}'})
+
+
+def test_429_with_retry_after(limited):
+    # /characters costs 5 of the 10 tokens
+    assert get(limited, '/characters').status_code == 200
+    assert get(limited, '/characters').status_code == 200
+    response = get(limited, '/characters')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+
+
+def test_costs(limited):
+    for _ in range(10):
+        assert get(limited, '/character/1').status_code == 200
+    assert get(limited, '/character/1').status_code == 429
+    # NDJSON costs more than the burst, so it takes the whole bucket
+    assert get(limited, '/characters?format=ndjson', ip='5.6.7.8').status_code == 200
+    assert get(limited, '/character/1', ip='5.6.7.8').status_code == 429
+    assert ROUTE_COSTS['/characters'] > DEFAULT_COST and NDJSON_COST > ROUTE_COSTS['/characters']
+
+
+def test_forwarded_ip_and_user_buckets(limited):
+    for _ in range(10):
+        assert get(limited, '/character/1').status_code == 200
+    # the client IP comes from X-Forwarded-For, not the proxy's address
+    assert get(limited, '/character/1', ip='5.6.7.8').status_code == 200
+    # /user/<id>/favorites costs 2 of the user's 4 tokens at that IP
+    assert get(limited, '/user/1/favorites', ip='10.0.0.1').status_code == 200
+    assert get(limited, '/user/1/favorites', ip='10.0.0.1').status_code == 200
+    assert get(limited, '/user/1/favorites', ip='10.0.0.1').status_code == 429
+    assert get(limited, '/user/2/favorites', ip='10.0.0.1').status_code == 200
+
+
+def test_user_bucket_is_per_client(limited):
+    # the unauthenticated user id alone cannot drain a user's bucket for
+    # every other client
+    for ip in ('10.0.0.1', '10.0.0.2'):
+        assert get(limited, '/user/1/favorites', ip=ip).status_code == 200
+        assert get(limited, '/user/1/favorites', ip=ip).status_code == 200
+    assert get(limited, '/user/1/favorites', ip='10.0.0.3').status_code == 200
+
+
+def test_exempt_routes(limited):
+    for _ in range(20):
+        assert get(limited, '/admin/').status_code == 200
@@ -0,0 +1,68 @@
+import pytest
+from flask import Flask, jsonify
+
+from models import db, Planet
+from replicas import STICKY_COOKIE, setup_replicas
+
+
+def database(path, name):
+    url = f'sqlite:///{path}'
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add(Planet(name=name))
+        db.session.commit()
+    return url
+
+
+@pytest.fixture
+def routed(tmp_path, monkeypatch):
+    """An app on a primary and a replica SQLite file whose planet 1 is
+    named after the database it lives in."""
+    def make(replica_url=None):
+        primary = database(tmp_path / 'primary.db', 'primary')
+        replica = replica_url or database(tmp_path / 'replica.db', 'replica')
+        monkeypatch.setenv('DATABASE_REPLICA_URLS', replica)
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = primary
+        db.init_app(app)
+        setup_replicas(app, db)
+
+        @app.route('/planet/<int:id>', methods=['GET'])
+        def get_planet(id):
+            return jsonify(db.session.get(Planet, id).name)
+
+        @app.route('/planet', methods=['POST'])
+        def post_planet():
+            db.session.add(Planet(name='new'))
+            db.session.commit()
+            return jsonify('ok')
+        return app
+    return make
+
+
+def test_reads_go_to_the_replica(routed):
+    client = routed().test_client()
+    assert client.get('/planet/1').get_json() == 'replica'
+    assert client.get_cookie(STICKY_COOKIE) is None
+
+
+def test_writes_read_from_the_primary_while_sticky(routed):
+    client = routed().test_client()
+    assert client.post('/planet').status_code == 200
+    assert client.get_cookie(STICKY_COOKIE) is not None
+    assert client.get('/planet/1').get_json() == 'primary'
+    # once the cookie expires reads go back to the replica
+    client.set_cookie(STICKY_COOKIE, '0')
+    assert client.get('/planet/1').get_json() == 'replica'
+
+
+def test_failed_replica_reads_are_retried_on_the_primary(routed, tmp_path):
+    app = routed(f'sqlite:///{tmp_path}/missing/replica.db')
+    client = app.test_client()
+    assert client.get('/planet/1').get_json() == 'primary'
+    # taken out of rotation, so the next read does not try it
+    assert app.extensions['replicas'].pick() is None
+    assert client.get('/planet/1').get_json() == 'primary'
@@ -0,0 +1,59 @@
+import search
+
+
+def search_results(client, url):
+    response = client.get(url)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_search_matches_titles_and_prefixes(client, catalog):
+    results = search_results(client, '/search?q=c1')['GETTED']
+    assert [(result['kind'], result['id']) for result in results] == [('character', 2)]
+    kinds = {result['kind'] for result in search_results(client, '/search?q=rebel')['GETTED']}
+    assert kinds == {'film'}
+    assert client.get('/search?q=').status_code == 400
+    assert client.get('/search?q=rebel&kind=ship').status_code == 400
+
+
+def test_every_match_is_ranked(client, catalog):
+    # the films' crawls match, but a title match ranks above them even
+    # though its document comes last
+    assert client.post('/planet', json={'name': 'Rebels'}).status_code == 200
+    results = search_results(client, '/search?q=rebels')['GETTED']
+    assert [(result['kind'], result['id']) for result in results][0] == ('planet', 6)
+
+
+def test_broad_queries_rank_the_first_matches(client, catalog, monkeypatch):
+    assert client.post('/planet', json={'name': 'Rebels'}).status_code == 200
+    # four matches are more than three, so only the first two are ranked
+    monkeypatch.setattr(search, 'MAX_CANDIDATES', 3)
+    monkeypatch.setattr(search, 'BROAD_CANDIDATES', 2)
+    body = search_results(client, '/search?q=rebels')
+    assert [(result['kind'], result['id']) for result in body['GETTED']] == [('film', 1), ('film', 2)]
+    assert body['next_cursor'] is None
+
+
+def test_search_pages(client, catalog):
+    first = search_results(client, '/search?q=rebels&limit=2')
+    assert len(first['GETTED']) == 2 and first['next_cursor'] == 2
+    second = search_results(client, '/search?q=rebels&limit=2&cursor=2')
+    assert len(second['GETTED']) == 1 and second['next_cursor'] is None
+    scores = [result['score'] for result in first['GETTED'] + second['GETTED']]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_kind_filter_and_writes(client, catalog):
+    assert search_results(client, '/search?q=rebels&kind=planet')['GETTED'] == []
+    client.put('/planet/1', json={'name': 'Rebel base'})
+    results = search_results(client, '/search?q=rebel&kind=planet')['GETTED']
+    assert [result['id'] for result in results] == [1]
+    client.delete('/planet/1')
+    assert search_results(client, '/search?q=rebel&kind=planet')['GETTED'] == []
+
+
+def test_search_revalidates(client, catalog):
+    etag = client.get('/search?q=rebel').headers['ETag']
+    assert client.get('/search?q=rebel', headers={'If-None-Match': etag}).status_code == 304
+    client.put('/planet/1', json={'name': 'Rebel base'})
+    assert client.get('/search?q=rebel', headers={'If-None-Match': etag}).status_code == 200